@@ -0,0 +1,337 @@
+"""
+ASGI entry point serving the hottest endpoints with coroutines of asyncdao.py
+
+A sync worker serves one request at a time and spends most of it waiting for 17ZSearch and
+Datastore. Run under an ASGI server, e.g.
+
+gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+one worker multiplexes hundreds of concurrent requests on its event loop instead. Listings and
+single items of algorithms and datasets are served by coroutines below, they build their
+responses with the helpers of main.py inside a Flask request context so both modes return the
+same representations, compressed by the same CompressionMiddleware as responses of the Flask app.
+Every other request is passed to the Flask app in a thread, its body is streamed to the thread as
+the app reads it, so BLOB uploads aren't held in memory, and its response is iterated over in the
+thread too.
+
+aiohttp and uvicorn of requirements.txt are needed, without aiohttp every call to 17ZSearch would
+wait in a thread and the event loop would gain nothing, so importing this module fails instead.
+"""
+import asyncio
+import io
+import logging
+import sys
+from flask import request
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from asyncdao import AsyncAlgorithmDAO, AsyncDatasetDAO, run_blocking
+from connections import async_search_sessions
+import main
+from main import get_fields, get_tags, get_page_args, make_etag, set_validators, not_modified, \
+    listing_etag, stream_listing, set_page_headers, _ALGORITHM_FIELDS, _DATASET_FIELDS
+from responses import json_response, status_response
+
+if not async_search_sessions.available():
+    raise ImportError('asgi.py needs aiohttp to call 17ZSearch from the event loop, install requirements.txt')
+
+
+async def get_listing(async_dao):
+    """
+    Listing of algorithms or datasets, the same as api_algorithms_get and api_datasets_get of main.py
+
+    Search results are cached as a whole, so without limit and cursor they are streamed from the list.
+    :param async_dao: AsyncAlgorithmDAO or AsyncDatasetDAO
+    :return: Response
+    """
+    found_list = []
+    page = {}
+    page_args = get_page_args(request.args)
+    tags = get_tags(request.args)
+    if page_args is None or tags is None:
+        return status_response(400, in_list=True)
+    result_code = await async_dao.searchindexpage(found_list, page, tags=tags, limit=page_args[0],
+                                                  cursor=page_args[1])
+    if result_code != 0:
+        return status_response(400, in_list=True)
+    if page_args == (None, None):
+        etag = listing_etag(page['version'])
+    else:
+        etag = listing_etag(page['version'], page_args)
+    resp = not_modified(etag) if etag is not None else None
+    if resp is not None:
+        resp.headers['Vary'] = 'Accept'
+        if page_args != (None, None):
+            set_page_headers(resp, page)
+        return resp
+    if page_args == (None, None):
+        return stream_listing(iter(found_list), etag)
+    resp = json_response(found_list)
+    set_page_headers(resp, page)
+    if etag is not None:
+        set_validators(resp, etag)
+    return resp
+
+
+async def get_item(async_dao, item_id, all_fields):
+    """
+    Single algorithm or dataset, the same as api_algorithm_get and api_dataset_get of main.py
+
+    :param async_dao: AsyncAlgorithmDAO or AsyncDatasetDAO
+    :param item_id: id of the item
+    :param all_fields: all fields of the item
+    :return: Response
+    """
+    fields = get_fields(request.args, all_fields, async_dao.blob_field)
+    if fields is None:
+        return status_response(400, 'fields')
+    result = await async_dao.get(item_id)
+    if result not in [1, 2]:
+        # BLOB writes update the timestamp too
+        etag = make_etag(result.gettimestamp(), fields)
+        resp = not_modified(etag, result.gettimestamp())
+        if resp is not None:
+            return resp
+        if async_dao.blob_field in fields:
+            # metadata comes from the cache again, BLOB is loaded only for responses returning it
+            result = await async_dao.get(item_id, with_blob=True)
+    if result in [1, 2]:
+        return status_response(404)
+    resp = json_response(result.to_dict(fields))
+    set_validators(resp, etag, result.gettimestamp())
+    return resp
+
+
+async def api_algorithms_get():
+    return await get_listing(AsyncAlgorithmDAO)
+
+
+async def api_algorithm_get(algorithm_id):
+    return await get_item(AsyncAlgorithmDAO, algorithm_id, _ALGORITHM_FIELDS)
+
+
+async def api_datasets_get():
+    return await get_listing(AsyncDatasetDAO)
+
+
+async def api_dataset_get(dataset_id):
+    return await get_item(AsyncDatasetDAO, dataset_id, _DATASET_FIELDS)
+
+
+# routes served by coroutines, the same rules as in main.py
+# rules without an endpoint are passed to the Flask app, they keep batch requests from matching item rules
+async_routes = Map([
+    Rule('/algorithms/', endpoint=api_algorithms_get, methods=['GET']),
+    Rule('/algorithms/batch', endpoint=None, methods=['GET']),
+    Rule('/algorithms/<algorithm_id>', endpoint=api_algorithm_get, methods=['GET']),
+    Rule('/datasets/', endpoint=api_datasets_get, methods=['GET']),
+    Rule('/datasets/batch', endpoint=None, methods=['GET']),
+    Rule('/datasets/<dataset_id>', endpoint=api_dataset_get, methods=['GET']),
+])
+
+
+async def read_body(receive):
+    """Reads the whole body of an HTTP request served by a coroutine"""
+    body = io.BytesIO()
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    body.seek(0)
+    return body
+
+
+class ReceiveStream(io.RawIOBase):
+    """
+    Body of an HTTP request read from ASGI receive by a thread of the WSGI app
+
+    Every read waits for the next message on the event loop, so only one message is held at a time.
+    A disconnect ends the stream early, werkzeug reports that as ClientDisconnected.
+
+    Usage:
+    environ['wsgi.input'] = io.BufferedReader(ReceiveStream(receive, asyncio.get_running_loop()))
+    """
+
+    def __init__(self, receive, loop):
+        """
+        :param receive: ASGI receive of the request
+        :param loop: event loop running the request
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self.receive = receive
+        self.loop = loop
+        self._chunk = memoryview(b'')
+        self._more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more_body = False
+                break
+            self._chunk = memoryview(message.get('body', b''))
+            self._more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def make_environ(scope, body):
+    """
+    WSGI environ of an ASGI HTTP request
+
+    :param scope: ASGI connection scope
+    :type scope: dict
+    :param body: stream of the request body, wsgi.input
+    :type body: io.BufferedIOBase
+    :rtype: dict
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def send_start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+
+
+class AsyncApp:
+    """
+    ASGI application serving async_routes with coroutines and everything else with a WSGI app
+
+    Requests matching no rule or a rule without an endpoint are passed to the WSGI app.
+    Usage:
+    app = AsyncApp(main.app, async_routes)
+    """
+
+    def __init__(self, wsgi_app, routes):
+        """
+        :param wsgi_app: Flask app of all the other endpoints
+        :type wsgi_app: Flask
+        :param routes: rules whose endpoints are coroutine functions
+        :type routes: Map
+        """
+        self.wsgi_app = wsgi_app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope ' + scope['type'])
+        environ = make_environ(scope, io.BufferedReader(ReceiveStream(receive, asyncio.get_running_loop())))
+        try:
+            view, kwargs = self.routes.bind_to_environ(environ).match()
+        except HTTPException:
+            view = None
+        if view is None:
+            await self.call_wsgi(environ, send)
+            return
+        # a coroutine reading the stream would wait for the event loop it blocks
+        environ['wsgi.input'] = await read_body(receive)
+        with self.wsgi_app.request_context(environ):
+            try:
+                resp = await view(**kwargs)
+            except Exception as err:
+                resp = self.wsgi_app.make_response(main.server_error(err))
+            await self.send_response(environ, resp, send)
+
+    async def send_response(self, environ, resp, send):
+        """Sends a response of a coroutine, compressed like responses of the WSGI app when it's enabled"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        if main._RESPONSE_COMPRESSION:
+            iterable = main.compression_middleware.compress(resp, environ, start_response)
+        else:
+            iterable = resp(environ, start_response)
+        try:
+            iterator = iter(iterable)
+            # start_response of CompressionMiddleware is called just before the first chunk
+            data = next(iterator, None)
+            await send_start(send, started['status'], started['headers'])
+            while data is not None:
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                data = next(iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def call_wsgi(self, environ, send):
+        """Runs the WSGI app in the thread pool, its response is iterated over there too"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        iterable = await run_blocking(self.wsgi_app, environ, start_response)
+        try:
+            iterator = iter(iterable)
+            data = await run_blocking(next, iterator, None)
+            await send_start(send, started['status'], started['headers'])
+            while data is not None:
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                data = await run_blocking(next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                await run_blocking(iterable.close)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await async_search_sessions.close()
+                except Exception:
+                    logging.exception('Closing 17ZSearch session failed')
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncApp(main.app, async_routes)
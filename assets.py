@@ -0,0 +1,261 @@
+"""
+Documents and static assets served from memory in the form they are sent in
+
+A document is read from its file, optionally rewritten, and kept as bytes together with its
+compressed variants (gzip and, when the brotli package is installed, br) and a strong ETag of each
+variant. Serving it costs a memory copy instead of reading, parsing or compressing anything, and
+a conditional request is answered from the ETag without touching the file.
+
+FileDocument rebuilds its document when the file changes, which costs a single stat() per request.
+StaticDirectory encodes a directory of assets, e.g. Swagger UI, once per process. Every asset has a
+version, a hash of its content, and links of HTML pages to other assets of the directory get it as
+?v=<version>, so a versioned URL always returns the same bytes and may be cached as immutable.
+
+Usage:
+swagger_document = FileDocument('static/swagger.json', 'application/json', transform=set_host)
+encoded = swagger_document.get()
+swaggerui_assets = StaticDirectory('static/swaggerui')
+encoded = swaggerui_assets.get('swagger-ui-bundle.js')
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from werkzeug.security import safe_join
+from werkzeug.utils import get_content_type
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# compression level of gzip variants, they are compressed once so the highest level is used
+_DOCUMENT_GZIP_LEVEL = int(os.environ.get('DOCUMENT_GZIP_LEVEL', 9))
+# compression quality of br variants
+_DOCUMENT_BROTLI_QUALITY = int(os.environ.get('DOCUMENT_BROTLI_QUALITY', 11))
+# compressed variants saving less than this fraction of size aren't kept, e.g. of PNG images
+_MIN_COMPRESSION_SAVING = float(os.environ.get('MIN_COMPRESSION_SAVING', 0.1))
+# encode every static asset when the process starts, 0 encodes each of them on its first request
+_STATIC_ASSETS_PRELOAD = int(os.environ.get('STATIC_ASSETS_PRELOAD', 1))
+# Content-Type of files unknown to mimetypes module
+_ASSET_MIMETYPES = {
+    '.map': 'application/json',
+}
+
+
+def compress(body, encoding):
+    """
+    Compresses body with the given Content-Encoding
+
+    :param encoding: gzip or br
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=_DOCUMENT_BROTLI_QUALITY)
+    # mtime=0 keeps the variant identical in every worker
+    return gzip.compress(body, _DOCUMENT_GZIP_LEVEL, mtime=0)
+
+
+def get_encodings():
+    """Content-Encodings of compressed variants in order of preference"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+class EncodedDocument:
+    """
+    Bytes of a document, its compressed variants and their ETags
+
+    Every variant is a different representation, so it has its own strong ETag.
+    """
+    __slots__ = ('body', 'mimetype', 'version', 'etag', 'variants')
+
+    def __init__(self, body, mimetype, encodings=None):
+        """
+        :param body: the whole document
+        :type body: bytes
+        :param mimetype: Content-Type of the document
+        :type mimetype: str
+        :param encodings: Content-Encodings of variants to be built, get_encodings() by default
+        :type encodings: list
+        """
+        self.body = body
+        self.mimetype = mimetype
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        self.etag = self.version
+        # Content-Encoding: (body, ETag) in order of preference
+        self.variants = {}
+        for encoding in get_encodings() if encodings is None else encodings:
+            compressed = compress(body, encoding)
+            if len(compressed) <= len(body) * (1 - _MIN_COMPRESSION_SAVING):
+                self.variants[encoding] = (compressed, self.etag + '-' + encoding)
+
+    @property
+    def gzip_body(self):
+        return self.variants['gzip'][0] if 'gzip' in self.variants else None
+
+    @property
+    def gzip_etag(self):
+        return self.variants['gzip'][1] if 'gzip' in self.variants else None
+
+    def select(self, accept_encodings):
+        """
+        Chooses the variant for a client
+
+        :param accept_encodings: Accept-Encoding of the request, e.g. request.accept_encodings
+        :type accept_encodings: werkzeug.datastructures.MIMEAccept
+        :returns: tuple (Content-Encoding or None, body, ETag)
+        :rtype: tuple
+        """
+        for encoding, (body, etag) in self.variants.items():
+            if accept_encodings[encoding]:
+                return encoding, body, etag
+        return None, self.body, self.etag
+
+
+class FileDocument:
+    """
+    Document of a file kept encoded in memory and rebuilt when the file changes
+
+    Thread safe, concurrent requests after a change rebuild it only once.
+    """
+
+    def __init__(self, path, mimetype, transform=None):
+        """
+        :param path: path of the file
+        :type path: str
+        :param mimetype: Content-Type of the document
+        :type mimetype: str
+        :param transform: function returning bytes to be served from bytes of the file, e.g. with a changed host
+        :type transform: function
+        """
+        self.path = path
+        self.mimetype = mimetype
+        self.transform = transform
+        self._lock = threading.Lock()
+        self._document = None
+        self._signature = None
+        self._builds = 0
+
+    def _stat(self):
+        """Size and modification time identifying content of the file"""
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self):
+        """
+        Gets the encoded document, it's rebuilt if the file changed since the last call
+
+        :rtype: EncodedDocument
+        :raises: OSError if the file can't be read
+        """
+        signature = self._stat()
+        if signature == self._signature:
+            return self._document
+        with self._lock:
+            if signature != self._signature:
+                with open(self.path, 'rb') as document_file:
+                    body = document_file.read()
+                if self.transform is not None:
+                    body = self.transform(body)
+                self._document = EncodedDocument(body, self.mimetype)
+                self._signature = signature
+                self._builds += 1
+            return self._document
+
+    def stats(self):
+        document = self._document
+        gzip_body = document.gzip_body if document is not None else None
+        return {
+            'builds': self._builds,
+            'size': len(document.body) if document is not None else None,
+            'gzip_size': len(gzip_body) if gzip_body is not None else None,
+        }
+
+
+class StaticDirectory:
+    """
+    Files of a directory kept encoded in memory, each of them is read and compressed once per process
+
+    Assets are deployed with the application, so changes of files are picked up by new workers only.
+    """
+
+    def __init__(self, root, preload=_STATIC_ASSETS_PRELOAD):
+        """
+        :param root: path of the directory
+        :type root: str
+        :param preload: encode all files now, otherwise every file is encoded on its first request
+        :type preload: bool
+        """
+        self.root = root
+        self._lock = threading.RLock()
+        self._assets = {}
+        self._misses = 0
+        if preload:
+            self.build()
+
+    def build(self):
+        """Encodes every file of the directory, HTML pages last as their links carry versions of the others"""
+        paths = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                paths.append(os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/'))
+        for path in sorted(paths, key=lambda path: path.endswith('.html')):
+            self.get(path)
+
+    def get_mimetype(self, path):
+        mimetype = mimetypes.guess_type(path)[0] or _ASSET_MIMETYPES.get(os.path.splitext(path)[1],
+                                                                         'application/octet-stream')
+        return get_content_type(mimetype, 'utf-8')
+
+    def link_versions(self, path, body):
+        """
+        Adds ?v=<version> to relative links, e.g. src="./swagger-ui.js", to other assets in an HTML page
+
+        :rtype: bytes
+        """
+        base = path.rsplit('/', 1)[0] + '/' if '/' in path else ''
+
+        def add_version(match):
+            linked = self.get(base + match.group(2).decode('utf-8'))
+            if linked is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + b'?v=' + linked.version.encode('ascii') + match.group(3)
+        return re.sub(rb'((?:src|href)=["\']\./)([^"\'?#]+)(["\'])', add_version, body)
+
+    def get(self, path):
+        """
+        Gets an encoded asset
+
+        :param path: path relative to the root, with / as separator
+        :type path: str
+        :returns: EncodedDocument or None if there is no such file
+        """
+        asset = self._assets.get(path)
+        if asset is not None:
+            return asset
+        full_path = safe_join(self.root, path)
+        if full_path is None or not os.path.isfile(full_path):
+            self._misses += 1
+            return None
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is None:
+                with open(full_path, 'rb') as asset_file:
+                    body = asset_file.read()
+                if path.endswith('.html'):
+                    body = self.link_versions(path, body)
+                asset = EncodedDocument(body, self.get_mimetype(path))
+                self._assets[path] = asset
+            return asset
+
+    def stats(self):
+        assets = list(self._assets.values())
+        return {
+            'assets': len(assets),
+            'size': sum(len(asset.body) for asset in assets),
+            'compressed_size': {encoding: sum(len(asset.variants.get(encoding, (asset.body,))[0]) for asset in assets)
+                                for encoding in get_encodings()},
+            'misses': self._misses,
+        }
@@ -0,0 +1,296 @@
+"""
+Asyncio variants of DAOs used by the ASGI entry point in asgi.py
+
+Lookups in 17ZSearch go through aiohttp, one pooled session per event loop, when it's installed.
+Datastore has no asyncio client, so its calls, and search calls without aiohttp, run in a thread
+pool of this module which is much larger than the number of CPUs because its threads only wait
+for I/O. A worker can so serve hundreds of concurrent requests instead of one.
+
+Caches, the index queue and the item classes are those of dao.py, so both modes see the same data
+and a write in one of them invalidates what the other one cached.
+
+Usage:
+code = await AsyncAlgorithmDAO.searchindex(found_algorithms_list, tags='algo,rithm')
+algorithm = await AsyncAlgorithmDAO.get(algorithm_id)
+"""
+import asyncio
+import functools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from connections import async_search_sessions, search_sessions, SEARCH_CONNECTION_ERRORS
+from dao import Algorithm, AlgorithmDAO, Dataset, DatasetDAO, UserDAO, algorithm_cache, dataset_cache, \
+    algorithm_search_cache, dataset_search_cache, get_search_url, normalize_tags, is_cacheable_search, \
+    listing_version, paginate, pending_index, search_loader, search_query, search_path
+
+# threads running blocking calls of coroutines in every process
+_ASYNC_IO_WORKERS = int(os.environ.get('ASYNC_IO_WORKERS', 64))
+_io_executor = None
+_io_executor_pid = None
+_io_executor_lock = threading.Lock()
+
+
+def get_io_executor():
+    """
+    Gets thread pool of the current process for blocking calls, a pool inherited through fork has no threads
+
+    :rtype: ThreadPoolExecutor
+    """
+    global _io_executor, _io_executor_pid
+    if _io_executor is None or _io_executor_pid != os.getpid():
+        with _io_executor_lock:
+            if _io_executor is None or _io_executor_pid != os.getpid():
+                _io_executor = ThreadPoolExecutor(max_workers=_ASYNC_IO_WORKERS, thread_name_prefix='async-io')
+                _io_executor_pid = os.getpid()
+    return _io_executor
+
+
+async def run_blocking(function, *args):
+    """
+    Runs a blocking function in the thread pool without blocking the event loop
+
+    :returns: result of function(*args)
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_io_executor(), functools.partial(function, *args))
+
+
+async def search_get(url):
+    """
+    GET from 17ZSearch with aiohttp or, when it's not installed, with the pooled requests session in a thread
+
+    :returns: tuple (status code, body text) or None for connection errors
+    :rtype: tuple
+    """
+    if async_search_sessions.available():
+        try:
+            return await async_search_sessions.get(url)
+        except ConnectionError:
+            return None
+    try:
+        response = await run_blocking(search_sessions.get, url)
+    except SEARCH_CONNECTION_ERRORS:
+        return None
+    return response.status_code, response.text
+
+
+class AsyncItemDAO:
+    """
+    Coroutines of an item DAO, subclasses set the DAO, caches and names of the item kind
+
+    Writes and BLOBs are rare or large, so they simply run the synchronous DAO in the thread pool.
+    """
+    dao = None
+    item_class = None
+    # name of the index in 17ZSearch
+    index_name = None
+    cache = None
+    search_cache = None
+    blob_field = None
+
+    @classmethod
+    async def searchindexuncached(cls, found_list, tags=''):
+        """
+        Search for items in index from Full Text Search and write into found_list
+
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri, 2 Connection error, 3 Application or server error
+        """
+        url = get_search_url() + '/' + cls.index_name + '/'
+        if tags != '':
+            url += search_query(tags)
+        response = await search_get(url)
+        if response is None:
+            return 2
+        status, text = response
+        if status > 499:
+            return 3
+        if status != 200:
+            return 1
+        try:
+            found_list.extend(json.loads(text))
+        except ValueError:
+            return 3
+        return 0
+
+    @classmethod
+    async def search(cls, tags=''):
+        """
+        Search in 17ZSearch through the cache shared with the synchronous DAO
+
+        Stale results are refreshed in background by the synchronous DAO, like in search_cached.
+        :returns: tuple (result_code, found list, version of found list or None)
+        :rtype: tuple
+        """
+        key = normalize_tags(tags)
+        found, value, token = cls.search_cache.lookup(key, search_loader(cls.dao.searchindexuncached, tags),
+                                                      is_cacheable_search)
+        if found:
+            return value
+        found_list = []
+        result_code = await cls.searchindexuncached(found_list, tags)
+        value = (result_code, found_list, listing_version(found_list) if result_code == 0 else None)
+        cls.search_cache.store(key, value, is_cacheable_search, token)
+        return value
+
+    @classmethod
+    async def searchindex(cls, found_list, tags=''):
+        """
+        Search for items in index from Full Text Search through the cache and write into found_list
+
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri, 2 Connection error, 3 Application or server error
+        """
+        result_code, found, version = await cls.search(tags)
+        found_list.extend(found)
+        return result_code
+
+    @classmethod
+    async def searchindexpage(cls, found_list, page, tags='', limit=None, cursor=None):
+        """
+        Search for a page of items in index from Full Text Search and write it into found_list
+
+        :param page: dictionary updated with totalCount, totalPages, nextCursor and version of all results
+        :type page: dict
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri or cursor, 2 Connection error, 3 Application or server error
+        """
+        result_code, found_all, page['version'] = await cls.search(tags)
+        if result_code != 0:
+            return result_code
+        return paginate(found_all, found_list, page, limit, cursor)
+
+    @classmethod
+    async def getindex(cls, item_id):
+        """
+        Get a single item index from 17ZSearch
+
+        :returns: dictionary of a single item index or 1 - not found or 2 - Connection Error
+            or 3 - Application or server error
+        :rtype : dict, int
+        """
+        response = await search_get(get_search_url() + '/' + cls.index_name + '/' + search_path(item_id))
+        if response is None:
+            return 2
+        status, text = response
+        if status != 200:
+            return 1
+        try:
+            return json.loads(text)
+        except ValueError:
+            return 3
+
+    @classmethod
+    async def getuncached(cls, item_id):
+        """
+        Get item data from 17ZSearch and Datastore concurrently bypassing the cache
+
+        :returns: merged index and data dictionary or 1 - GAE search Error or 2 - Datastore Error
+        :rtype : dict, int
+        """
+        idx, dat = await asyncio.gather(cls.getindex(item_id), run_blocking(cls.dao.getdata, item_id))
+        idx = await run_blocking(pending_index, cls.index_name, item_id, idx)
+        if idx in [1, 2, 3]:
+            return 1
+        if dat == 1:
+            return 2
+        idx.update(dat)
+        return idx
+
+    @classmethod
+    async def get(cls, item_id, with_blob=False):
+        """
+        Get specific item data, metadata comes from the cache shared with the synchronous DAO
+
+        :param with_blob: load BLOB too, otherwise it's None
+        :type with_blob: bool
+        :returns: Algorithm or Dataset object or 1 - GAE search Error or 2 - Datastore Error
+        """
+        found, value, token = cls.cache.lookup(item_id)
+        if not found:
+            value = await cls.getuncached(item_id)
+            cls.cache.store(item_id, value, lambda value: value not in [1, 2], token)
+        if value in [1, 2]:
+            return value
+        blob = await cls.getblob(item_id) if with_blob else None
+        if blob == 1:
+            return 2
+        value = dict(value)
+        value[cls.blob_field] = blob
+        return cls.item_class(value)
+
+    @classmethod
+    async def getblob(cls, item_id):
+        """
+        Get BLOB of an item
+
+        :returns: BLOB or 1 - Error
+        """
+        return await run_blocking(cls.dao.getblob, item_id)
+
+    @classmethod
+    async def set(cls, item):
+        """
+        Writing the whole item, codes as returned by set of the synchronous DAO
+
+        :rtype: int
+        """
+        return await run_blocking(cls.dao.set, item)
+
+    @classmethod
+    async def delete(cls, item_id):
+        """
+        Delete item from index in Full Text Search
+
+        :returns: 0 - EOK, 1 - not found, 2 - Error
+        :rtype: int
+        """
+        return await run_blocking(cls.dao.delete, item_id)
+
+
+class AsyncAlgorithmDAO(AsyncItemDAO):
+    """
+    Asyncio Data Access Object Interface for Algorithm
+    """
+    dao = AlgorithmDAO
+    item_class = Algorithm
+    index_name = 'algorithms'
+    cache = algorithm_cache
+    search_cache = algorithm_search_cache
+    blob_field = 'algorithmBLOB'
+
+
+class AsyncDatasetDAO(AsyncItemDAO):
+    """
+    Asyncio Data Access Object Interface for Dataset
+    """
+    dao = DatasetDAO
+    item_class = Dataset
+    index_name = 'datasets'
+    cache = dataset_cache
+    search_cache = dataset_search_cache
+    blob_field = 'datasetBLOB'
+
+
+class AsyncUserDAO:
+    """
+    Asyncio Data Access Object Interface for User, users live only in Datastore
+    """
+
+    @staticmethod
+    async def get(user_id):
+        """
+        Get a single user from Datastore
+
+        :rtype : User
+        """
+        return await run_blocking(UserDAO.get, user_id)
+
+    @staticmethod
+    async def set(user):
+        """
+        Writing user data to Datastore
+
+        :rtype : int
+        """
+        return await run_blocking(UserDAO.set, user)
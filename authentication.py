@@ -18,44 +18,269 @@ These six fields are included in all Google ID Tokens.
  "family_name": "User",
  "locale": "en"
 """
+import hashlib
+import json
+import logging
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
 from functools import wraps
-from flask import request, abort
+from urllib.parse import urlparse
+import requests
+from flask import request, abort, g
 from oauth2client import client, crypt
+from cache import TTLCache
 from dao import User
 
+# public certificates of keys signing Google ID tokens, file:///path points at a local key set, e.g. in tests
+_ID_TOKEN_CERTS_URL = os.environ.get('ID_TOKEN_CERTS_URL', client.ID_TOKEN_VERIFICATION_CERTS)
+# copy of the certificates which survives restarts of workers, unset keeps them in memory only
+_ID_TOKEN_CERTS_PATH = os.environ.get('ID_TOKEN_CERTS_PATH') or None
+# seconds before expiry when certificates are refreshed in background
+_ID_TOKEN_CERTS_REFRESH_MARGIN = float(os.environ.get('ID_TOKEN_CERTS_REFRESH_MARGIN', 300))
+# seconds certificates are used when their response has no max-age, and between retries of a failed refresh
+_ID_TOKEN_CERTS_DEFAULT_MAX_AGE = float(os.environ.get('ID_TOKEN_CERTS_DEFAULT_MAX_AGE', 3600))
+_ID_TOKEN_CERTS_RETRY = float(os.environ.get('ID_TOKEN_CERTS_RETRY', 30))
+_ID_TOKEN_CERTS_TIMEOUT = float(os.environ.get('ID_TOKEN_CERTS_TIMEOUT', 10))
 
-def get_user_from_id_token(id_token):
+# verified tokens kept so that repeated requests with the same token skip signature checks
+_ID_TOKEN_CACHE_SIZE = int(os.environ.get('ID_TOKEN_CACHE_SIZE', 10000))
+# upper bound of how long a token stays cached, it never outlives its exp claim anyway
+_ID_TOKEN_CACHE_MAX_TTL = float(os.environ.get('ID_TOKEN_CACHE_MAX_TTL', 3600))
+
+# claims of verified id_tokens by sha256 of the token, so tokens themselves aren't kept in memory
+id_token_cache = TTLCache(_ID_TOKEN_CACHE_SIZE, _ID_TOKEN_CACHE_MAX_TTL)
+
+
+class CertificateError(Exception):
+    """Exception raised when there are no certificates to verify tokens with"""
+    pass
+
+
+def get_max_age(cache_control):
     """
-    Extracts user data from Google Identity Platform id_token.
-    There is no phone in id_token so it's set to ""
-    :param id_token: 
-    :return: User object 
+    Extracts max-age of Cache-Control header
+
+    :param cache_control: value of Cache-Control header or None
+    :type cache_control: str
+    :return: seconds, 0 for no-cache and no-store, or None if it's not given
+    :rtype: int
     """
-    id_info = client.verify_id_token(id_token, None)
-    dict_data = {
-        'userID': id_info['sub'],
-        'firstName': id_info['given_name'],
-        'lastName': id_info['family_name'],
-        'email': id_info['email'],
-        'phone': "",
-        'userStatus': 0
-    }
-    user = User(dict_data)
-    return user
+    if cache_control is None:
+        return None
+    if re.search(r'\bno-(cache|store)\b', cache_control):
+        return 0
+    match = re.search(r'\bmax-age\s*=\s*"?(\d+)', cache_control)
+    return int(match.group(1)) if match else None
 
 
-def verify_google_id_token(id_token):
+class CertificateCache:
     """
-    Verifies if id_token is a valid google account token
-    :param id_token: 
-    :return: None or sub
+    Certificates of keys signing Google ID tokens kept in memory and on disk
+
+    Certificates are used for max-age of their response and a background thread fetches new
+    ones before that, so verification of a token never waits for the network. After a restart
+    workers start from the copy on disk, which is shared by all of them when ID_TOKEN_CERTS_PATH
+    is set. When a refresh fails, the old certificates are used until one succeeds.
+
+    Usage:
+    id_info = crypt.verify_signed_jwt_with_certs(id_token, certificate_cache.get())
     """
 
+    def __init__(self, url=_ID_TOKEN_CERTS_URL, path=_ID_TOKEN_CERTS_PATH,
+                 refresh_margin=_ID_TOKEN_CERTS_REFRESH_MARGIN, default_max_age=_ID_TOKEN_CERTS_DEFAULT_MAX_AGE,
+                 retry_interval=_ID_TOKEN_CERTS_RETRY):
+        """
+        :param url: http(s) url of certificates in JSON or file:///path of a local key set
+        :type url: str
+        :param path: file of the copy on disk, None means no copy
+        :type path: str
+        :param refresh_margin: seconds before expiry when certificates are refreshed
+        :type refresh_margin: float
+        :param default_max_age: seconds certificates are used when their response has no max-age
+        :type default_max_age: float
+        :param retry_interval: seconds between retries of a failed refresh, and at least between background refreshes
+        :type retry_interval: float
+        """
+        self.url = url
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.default_max_age = default_max_age
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._certs = None
+        # wall clock time, it's written to the copy on disk
+        self._expires_at = 0.0
+        # a failed refresh isn't repeated by requests before this time
+        self._next_retry = 0.0
+        self._thread = None
+        self._pid = None
+        self._counters = {
+            'fetches': 0,
+            'fetch_errors': 0,
+            'disk_loads': 0,
+        }
+
+    def _fetch(self):
+        """Returns tuple (certificates, expires_at) from url"""
+        parsed = urlparse(self.url)
+        if parsed.scheme == 'file':
+            with open(parsed.path) as certs_file:
+                return json.load(certs_file), time.time() + self.default_max_age
+        response = requests.get(self.url, timeout=_ID_TOKEN_CERTS_TIMEOUT)
+        if response.status_code != 200:
+            raise CertificateError('Status code: ' + str(response.status_code))
+        max_age = get_max_age(response.headers.get('Cache-Control'))
+        if max_age is None:
+            max_age = self.default_max_age
+        age = response.headers.get('Age', '0')
+        max_age -= int(age) if age.isdigit() else 0
+        return response.json(), time.time() + max(0, max_age)
+
+    def _load(self):
+        """
+        Takes the copy on disk if it expires later than certificates in memory, has to be called with the lock held
+
+        The copy is ignored unless it's owned by the user of this process and nobody else can write it,
+        otherwise anyone could make workers accept tokens signed with their own keys.
+        """
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as certs_file:
+                status = os.fstat(certs_file.fileno())
+                if status.st_uid != os.getuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    logging.error('Copy of ID token certificates in %s is ignored, it may be written by other users',
+                                  self.path)
+                    return
+                saved = json.load(certs_file)
+            if saved['expires_at'] > self._expires_at:
+                self._certs, self._expires_at = saved['certs'], saved['expires_at']
+                self._counters['disk_loads'] += 1
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logging.exception('Copy of ID token certificates in %s is broken', self.path)
+
+    def _save(self):
+        """Replaces the copy on disk, has to be called with the lock held"""
+        if self.path is None:
+            return
+        try:
+            descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.certs-')
+            with os.fdopen(descriptor, 'w') as temp_file:
+                json.dump({'expires_at': self._expires_at, 'certs': self._certs}, temp_file)
+            os.replace(temp_path, self.path)
+        except OSError:
+            logging.exception('Copy of ID token certificates was not written to %s', self.path)
+
+    def refresh(self):
+        """
+        Fetches certificates unless another worker already put fresh ones on disk
+
+        :raises: CertificateError when they can't be fetched
+        """
+        with self._lock:
+            self._load()
+            if self._certs is not None and time.time() < self._expires_at - self.refresh_margin:
+                return
+            self._counters['fetches'] += 1
+            try:
+                certs, expires_at = self._fetch()
+            except (requests.RequestException, OSError, ValueError, CertificateError) as err:
+                self._counters['fetch_errors'] += 1
+                self._next_retry = time.time() + self.retry_interval
+                raise CertificateError('ID token certificates were not fetched from ' + self.url) from err
+            self._certs, self._expires_at = certs, expires_at
+            self._save()
+
+    def get(self):
+        """
+        Returns certificates, fetching them only when there are none yet or they have expired
+
+        :return: dictionary of certificates in PEM format by key id
+        :rtype: dict
+        :raises: CertificateError when there are no certificates at all
+        """
+        certs = self._certs
+        now = time.time()
+        if certs is None or (now >= self._expires_at and now >= self._next_retry):
+            try:
+                self.refresh()
+            except CertificateError:
+                if self._certs is None:
+                    raise
+                logging.exception('Expired ID token certificates are used')
+            certs = self._certs
+        self.start()
+        return certs
+
+    def _refresh_delay(self):
+        """
+        Seconds until the background refresh, at least retry_interval
+
+        Certificates whose max-age is shorter than refresh_margin are due at once, without the lower bound
+        they would be fetched in a loop.
+        """
+        return max(self.retry_interval, self._expires_at - self.refresh_margin - time.time())
+
+    def _run(self):
+        while True:
+            time.sleep(self._refresh_delay())
+            try:
+                self.refresh()
+            except CertificateError:
+                logging.exception('ID token certificates were not refreshed')
+                time.sleep(self.retry_interval)
+
+    def start(self):
+        """Starts the background refresh of the current process unless it's running"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='id-token-certs', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        """
+        Counters and seconds until certificates expire
+
+        :rtype: dict
+        """
+        stats = dict(self._counters)
+        stats['certificates'] = len(self._certs) if self._certs is not None else 0
+        stats['expires_in'] = self._expires_at - time.time() if self._certs is not None else 0.0
+        return stats
+
+
+certificate_cache = CertificateCache()
+
+
+def verify_id_token_claims(id_token):
+    """
+    Verifies if id_token is a valid google account token, verified claims are cached until exp
+
+    :param id_token: Google ID token
+    :type id_token: str
+    :return: dictionary of claims, which must not be modified, or None if the token is not valid
+    :rtype: dict
+    :raises: CertificateError when there are no certificates to verify the token with
+    """
+    key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+    id_info = id_token_cache.get(key)
+    if id_info is not None:
+        return id_info
     try:
-        # id_info = client.verify_id_token(id_token, CLIENT_ID)
+        # id_info = crypt.verify_signed_jwt_with_certs(id_token, certificate_cache.get(), CLIENT_ID)
 
         # Or, if multiple clients access the backend server:
-        id_info = client.verify_id_token(id_token, None)
+        id_info = crypt.verify_signed_jwt_with_certs(id_token, certificate_cache.get(), None)
         # if id_info['aud'] not in [CLIENT_ID_1, CLIENT_ID_2, CLIENT_ID_3]:
         #    raise crypt.AppIdentityError("Unrecognized client.")
 
@@ -68,6 +293,54 @@ def verify_google_id_token(id_token):
     except crypt.AppIdentityError:
         # Invalid token
         return None
+    ttl = int(id_info['exp']) - time.time()
+    if ttl > 0:
+        id_token_cache.set(key, id_info, ttl)
+    return id_info
+
+
+def get_user_from_claims(id_info):
+    """
+    Extracts user data from claims of a verified Google Identity Platform id_token.
+    There is no phone in id_token so it's set to ""
+    :param id_info: claims returned by verify_id_token_claims
+    :return: User object
+    """
+    dict_data = {
+        'userID': id_info['sub'],
+        'firstName': id_info['given_name'],
+        'lastName': id_info['family_name'],
+        'email': id_info['email'],
+        'phone': "",
+        'userStatus': 0
+    }
+    user = User(dict_data)
+    return user
+
+
+def get_user_from_id_token(id_token):
+    """
+    Extracts user data from Google Identity Platform id_token.
+    There is no phone in id_token so it's set to ""
+    :param id_token: 
+    :return: User object 
+    :raises: crypt.AppIdentityError if id_token is not valid
+    """
+    id_info = verify_id_token_claims(id_token)
+    if id_info is None:
+        raise crypt.AppIdentityError("Invalid token.")
+    return get_user_from_claims(id_info)
+
+
+def verify_google_id_token(id_token):
+    """
+    Verifies if id_token is a valid google account token
+    :param id_token: 
+    :return: None or sub
+    """
+    id_info = verify_id_token_claims(id_token)
+    if id_info is None:
+        return None
     user_id = id_info['sub']
     return user_id
 
@@ -76,7 +349,7 @@ def authenticated(fn):
     """
     Decorator which checks if there is Authenticate: Bearer id_token in headers and then 
     checks if it's a valid Google ID
-    Returns sub of the user or None if error
+    Returns sub of the user or None if error, verified claims of the token are in g.id_token_claims
     :param fn: 
     :return: None or sub
     Usage:
@@ -102,12 +375,14 @@ def authenticated(fn):
 
         print("Checking token...")
         # extracts 'Authorization: Bearer <id_token>' and checks id_token
-        user_id = verify_google_id_token(request.headers['Authorization'].split(" ")[1])
-        if user_id is None:
+        id_info = verify_id_token_claims(request.headers['Authorization'].split(" ")[1])
+        if id_info is None:
             print("This is not a valid Google account id_token")
             # Unauthorized
             abort(401)
             return None
 
-        return fn(user_id=user_id, *args, **kwargs)
+        # views needing more than sub take the claims from here instead of verifying the token again
+        g.id_token_claims = id_info
+        return fn(user_id=id_info['sub'], *args, **kwargs)
     return wrapped_function
@@ -0,0 +1,167 @@
+"""
+Compares a single sync worker with a single asyncio worker serving GET /algorithms/?tags=...
+
+17ZSearch is replaced by a local stand-in answering after a fixed latency and the search cache is
+disabled, so every request waits for it like an uncached search does. The sync worker serves one
+request at a time as a sync gunicorn worker does, the asyncio worker runs asgi.app on one event loop.
+
+Usage:
+python benchmarks/async_vs_sync.py --requests 400 --concurrency 100 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# every request has to reach the search stand-in
+os.environ['SEARCH_CACHE_TTL'] = '0'
+os.environ['SEARCH_CACHE_STALE_TTL'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import asgi
+import asyncdao
+import dao
+import main
+from connections import async_search_sessions
+
+
+class SearchStandIn(BaseHTTPRequestHandler):
+    """Answers every search with the same algorithms after latency seconds"""
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle's algorithm would delay the body
+    disable_nagle_algorithm = True
+    latency = 0.05
+    body = json.dumps([{'algorithmId': 'algorithm' + str(number), 'algorithmSummary': 'summary',
+                        'displayName': 'name', 'linkURL': 'http://example.com'} for number in range(20)]).encode()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summary(mode, latencies, elapsed):
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1),
+    }
+
+
+def run_sync(requests, concurrency, path):
+    """Clients in threads share one worker which serves a single request at a time"""
+    client = main.app.test_client()
+    worker = threading.Lock()
+    latencies = []
+    remaining = [requests]
+    counter_lock = threading.Lock()
+
+    def run_client():
+        while True:
+            with counter_lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            with worker:
+                response = client.get(path)
+                response.get_data()
+            assert response.status_code == 200, response.status_code
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=run_client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summary('sync', latencies, time.perf_counter() - start)
+
+
+async def call_asgi(path, query_string):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string, 'headers': [],
+             'http_version': '1.1', 'scheme': 'http'}
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await asgi.app(scope, receive, send)
+    assert status == [200], status
+
+
+async def run_async(requests, concurrency, path):
+    """Clients are tasks on the event loop of one worker"""
+    path, _, query_string = path.partition('?')
+    latencies = []
+    remaining = [requests]
+
+    async def run_client():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            await call_asgi(path, query_string.encode('latin-1'))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await async_search_sessions.close()
+    return summary('async', latencies, elapsed)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the search stand-in takes to answer')
+    parser.add_argument('--path', default='/algorithms/?tags=algorithm')
+    args = parser.parse_args()
+
+    SearchStandIn.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:' + str(server.server_port)
+    # both modes resolve the search app through these functions
+    dao.get_search_url = lambda: url
+    asyncdao.get_search_url = lambda: url
+
+    results = [
+        run_sync(args.requests, args.concurrency, args.path),
+        asyncio.run(run_async(args.requests, args.concurrency, args.path)),
+    ]
+    print(json.dumps({
+        'search_latency_ms': args.latency * 1000,
+        'concurrency': args.concurrency,
+        'async_io_workers': asyncdao._ASYNC_IO_WORKERS,
+        'results': results,
+    }, indent=2))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,218 @@
+"""
+Load test of main.app endpoints against local stand-ins of 17ZSearch and Datastore
+
+main.app is served by a threaded WSGI server in this process. 17ZSearch is replaced by SearchService
+of harness.py answering after --latency seconds. --storage selects where the DAOs keep data:
+
+datastore   DatastoreStorage on InMemoryDatastoreClient of harness.py, BLOBs in it too (default)
+emulator    DatastoreStorage on the Datastore emulator found through DATASTORE_EMULATOR_HOST
+memory      MemoryStorage, BLOBs in local files
+sqlite      SQLiteStorage in a temporary directory, BLOBs in local files
+
+Algorithms and datasets are written through the DAOs before the run, writes are authenticated with
+ID tokens signed by the key in testdata.
+
+Every endpoint gets --requests requests from --concurrency clients, POST /algorithms/ writes new
+algorithms which DELETE /algorithms/<id> removes afterwards. Throughput and p50/p95/p99 latency of
+every endpoint are printed and written as JSON to --output, by default
+benchmarks/results/endpoints-<commit>.json, --baseline adds changes against results of an earlier
+commit. Caches are disabled unless SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL and ITEM_CACHE_TTL are
+set, so every request reaches the stand-ins.
+
+Usage:
+python benchmarks/endpoints.py --requests 500 --concurrency 16 --latency 0.005
+python benchmarks/endpoints.py --baseline benchmarks/results/endpoints-a58516b.json
+"""
+import argparse
+import atexit
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+_TESTDATA = os.path.join(_ROOT, 'testdata')
+_WORK_DIR = tempfile.mkdtemp(prefix='17z-benchmark-')
+atexit.register(shutil.rmtree, _WORK_DIR, True)
+# every request has to reach the stand-ins unless caching is asked for
+os.environ.setdefault('SEARCH_CACHE_TTL', '0')
+os.environ.setdefault('SEARCH_CACHE_STALE_TTL', '0')
+os.environ.setdefault('ITEM_CACHE_TTL', '0')
+os.environ.setdefault('INDEX_QUEUE_PATH', os.path.join(_WORK_DIR, 'index-queue.sqlite3'))
+os.environ.setdefault('ID_TOKEN_CERTS_URL', 'file://' + os.path.join(_TESTDATA, 'id_token_certs.json'))
+os.environ.setdefault('ID_TOKEN_CERTS_PATH', os.path.join(_WORK_DIR, 'id-token-certs.json'))
+sys.path.insert(0, _ROOT)
+
+import blobstore
+import dao
+import main
+import storage
+from connections import DatastoreClientManager
+from oauth2client import crypt
+from werkzeug.serving import make_server
+from harness import Endpoint, InMemoryDatastoreClient, SearchService, run_load
+
+_TAGS = ['sorting', 'graph', 'matrix', 'search']
+# ids of algorithms requested at once from the batch endpoint
+_BATCH_SIZE = 10
+
+
+def make_token():
+    """ID token signed with the test key whose certificate ID_TOKEN_CERTS_URL points to"""
+    with open(os.path.join(_TESTDATA, 'id_token_key.pem')) as key_file:
+        signer = crypt.Signer.from_string(key_file.read())
+    claims = {'iss': 'accounts.google.com', 'sub': 'benchmark', 'aud': 'benchmark', 'iat': int(time.time()),
+              'exp': int(time.time()) + 3600, 'email': 'benchmark@example.com'}
+    return crypt.make_signed_jwt(signer, claims, key_id='test').decode('ascii')
+
+
+def make_algorithm(algorithm_id, number, blob_size):
+    return {'algorithmId': algorithm_id, 'algorithmSummary': _TAGS[number % len(_TAGS)] + ' algorithm',
+            'displayName': 'Algorithm ' + str(number), 'linkURL': 'http://example.com/' + algorithm_id,
+            'algorithmBLOB': 'x' * blob_size, 'algorithmDescription': 'description ' * 50,
+            'datasetDescription': 'dataset description'}
+
+
+def make_dataset(number, blob_size):
+    return {'datasetId': 'dataset' + str(number), 'datasetSummary': _TAGS[number % len(_TAGS)] + ' dataset',
+            'displayName': 'Dataset ' + str(number), 'linkURL': 'http://example.com/dataset' + str(number),
+            'datasetBLOB': 'x' * blob_size, 'datasetDescription': 'description ' * 50}
+
+
+def seed(search, items, blob_size):
+    """Writes algorithms and datasets to Datastore through the DAOs and their index documents to search"""
+    algorithms = [dao.Algorithm(make_algorithm('algorithm' + str(number), number, blob_size))
+                  for number in range(items)]
+    datasets = [dao.Dataset(make_dataset(number, blob_size)) for number in range(items)]
+    if any(dao.AlgorithmDAO.setdatamulti(algorithms)) or any(dao.DatasetDAO.setdatamulti(datasets)):
+        raise RuntimeError('Seeding Datastore failed')
+    for algorithm in algorithms:
+        search.put('algorithms', algorithm.getalgorithm_id(), dao.AlgorithmDAO.toindex(algorithm))
+    for dataset in datasets:
+        search.put('datasets', dataset.getdataset_id(), dao.DatasetDAO.toindex(dataset))
+
+
+def get_endpoints(items, blob_size):
+    auth = {'Authorization': 'Bearer ' + make_token()}
+
+    def batch_path(number):
+        ids = ['algorithm' + str((number + offset) % items) for offset in range(_BATCH_SIZE)]
+        return '/algorithms/batch?ids=' + ','.join(ids)
+
+    def new_algorithm(number):
+        return json.dumps(make_algorithm('new-algorithm' + str(number), number, blob_size)).encode('utf-8')
+
+    return [
+        Endpoint('GET /algorithms/?tags', '/algorithms/?tags=sorting'),
+        Endpoint('GET /algorithms/?tags&limit', '/algorithms/?tags=sorting&limit=10'),
+        Endpoint('GET /algorithms/<id>', lambda number: '/algorithms/algorithm' + str(number % items)),
+        Endpoint('GET /algorithms/batch', batch_path),
+        Endpoint('GET /algorithms/<id>/blob', lambda number: '/algorithms/algorithm' + str(number % items) + '/blob'),
+        Endpoint('GET /datasets/?tags', '/datasets/?tags=graph'),
+        Endpoint('GET /datasets/<id>', lambda number: '/datasets/dataset' + str(number % items)),
+        Endpoint('POST /algorithms/', '/algorithms/', 'POST', new_algorithm,
+                 dict(auth, **{'Content-Type': 'application/json'})),
+        Endpoint('DELETE /algorithms/<id>', lambda number: '/algorithms/new-algorithm' + str(number), 'DELETE',
+                 headers=auth),
+        Endpoint('GET /swagger.json', '/swagger.json'),
+    ]
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=_ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Relative changes of throughput and latency against results of the same endpoints in baseline"""
+    previous = {result['endpoint']: result for result in baseline['endpoints']}
+    changes = {}
+    for result in results:
+        before = previous.get(result['endpoint'])
+        if before is None:
+            continue
+        changes[result['endpoint']] = {
+            name: round(result[name] / before[name] - 1, 3) if result[name] and before[name] else None
+            for name in ['requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms']
+        }
+    return {'commit': baseline.get('commit'), 'changes': changes}
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds the search stand-in takes to answer')
+    parser.add_argument('--items', type=int, default=200, help='algorithms and datasets written before the run')
+    parser.add_argument('--blob-size', type=int, default=4096, help='bytes of every BLOB')
+    parser.add_argument('--storage', choices=['datastore', 'emulator', 'memory', 'sqlite'], default='datastore')
+    parser.add_argument('--output', help='JSON file with results, by default benchmarks/results/endpoints-<commit>.json')
+    parser.add_argument('--baseline', help='JSON file with results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    if args.storage == 'datastore':
+        clients = DatastoreClientManager(factory=InMemoryDatastoreClient, health_check_interval=0)
+        main.datastore_clients = clients
+        dao.storage = main.storage = storage.DatastoreStorage(clients)
+        dao.blob_store = blobstore.DatastoreBlobBackend(clients)
+    elif args.storage == 'emulator':
+        if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+            parser.error('--storage emulator needs DATASTORE_EMULATOR_HOST, e.g. from gcloud beta emulators '
+                         'datastore env-init')
+    else:
+        url = 'memory://' if args.storage == 'memory' else 'sqlite://' + os.path.join(_WORK_DIR, 'storage.sqlite3')
+        dao.storage = main.storage = storage.get_storage(url)
+        dao.blob_store = blobstore.FilesystemBlobBackend(os.path.join(_WORK_DIR, 'blobs'))
+    search = SearchService(latency=args.latency).start()
+    dao.get_search_url = lambda: search.url
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = []
+    try:
+        seed(search, args.items, args.blob_size)
+        # views print authentication progress for every request
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for endpoint in get_endpoints(args.items, args.blob_size):
+                results.append(run_load('127.0.0.1', server.server_port, endpoint, args.concurrency, args.requests))
+    finally:
+        server.shutdown()
+        search.stop()
+        dao.index_queue.stop()
+
+    commit = get_commit()
+    report = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'storage': args.storage,
+        'search_latency_ms': args.latency * 1000,
+        'concurrency': args.concurrency,
+        'items': args.items,
+        'endpoints': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report['baseline'] = compare(results, json.load(baseline_file))
+    output = args.output or os.path.join(_ROOT, 'benchmarks', 'results', 'endpoints-' + (commit or 'unknown') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,323 @@
+"""
+Local stand-ins of 17ZSearch and Datastore and a concurrent HTTP load driver shared by benchmarks
+
+SearchService keeps index documents in memory and answers like 17ZSearch after a fixed latency:
+
+GET /<index>/?query=a OR b  documents having any of the words in their text fields, ids included
+GET /<index>/<id>           a single document or 404
+POST /<index>/              JSON document stored under its id field, e.g. algorithmId
+DELETE /<index>/<id>        removes the document
+
+InMemoryDatastoreClient implements the part of datastore.Client used by the DAOs and the BLOB store.
+run_load sends requests of an endpoint from clients in threads over keep-alive connections and
+reports throughput and latency percentiles.
+
+Usage:
+search = SearchService(latency=0.02).start()
+dao.get_search_url = lambda: search.url
+clients = DatastoreClientManager(factory=InMemoryDatastoreClient, health_check_interval=0)
+result = run_load('127.0.0.1', port, Endpoint('item', lambda number: '/algorithms/a' + str(number)), 32, 1000)
+"""
+import http.client
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from google.cloud import datastore
+
+# field of an index document its id is in
+_ID_FIELDS = {
+    'algorithms': 'algorithmId',
+    'datasets': 'datasetId',
+}
+_WORD = re.compile(r'\w+')
+
+
+def get_words(document):
+    """Lower case words of all text fields of an index document"""
+    words = set()
+    for value in document.values():
+        if isinstance(value, str):
+            words.update(word.lower() for word in _WORD.findall(value))
+    return words
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Requests to SearchService"""
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle's algorithm would delay the body
+    disable_nagle_algorithm = True
+
+    def route(self):
+        """Index and id of the requested URL, id is '' for the index itself"""
+        parts = urlsplit(self.path).path.strip('/').split('/', 1)
+        if parts[0] not in _ID_FIELDS:
+            return None, None
+        return parts[0], unquote(parts[1]) if len(parts) > 1 else ''
+
+    def reply(self, status, data=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.wait()
+        index, item_id = self.route()
+        if index is None:
+            return self.reply(404)
+        if item_id:
+            document = self.server.get(index, item_id)
+            return self.reply(200, document) if document is not None else self.reply(404)
+        query = parse_qs(urlsplit(self.path).query).get('query', [''])[0]
+        words = [word.strip().lower() for word in query.split(' OR ') if word.strip()]
+        self.reply(200, self.server.search(index, words))
+
+    def do_POST(self):
+        self.server.wait()
+        index, _ = self.route()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            document = json.loads(body)
+            item_id = document[_ID_FIELDS[index]]
+        except (ValueError, KeyError, TypeError):
+            return self.reply(400)
+        self.server.put(index, item_id, document)
+        self.reply(200)
+
+    def do_DELETE(self):
+        self.server.wait()
+        index, item_id = self.route()
+        if index is None or not self.server.delete(index, item_id):
+            return self.reply(404)
+        self.reply(200)
+
+    def log_message(self, *args):
+        pass
+
+
+class SearchService(ThreadingHTTPServer):
+    """17ZSearch stand-in answering every request after latency seconds"""
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        """
+        :param address: (host, port) to listen on, port 0 picks a free one
+        :type address: tuple
+        :param latency: seconds every request waits before it's answered
+        :type latency: float
+        """
+        super().__init__(address, SearchHandler)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        # index: {id: (document, words)}
+        self._indexes = {index: {} for index in _ID_FIELDS}
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:' + str(self.server_port)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def wait(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def put(self, index, item_id, document):
+        with self._lock:
+            self._indexes[index][item_id] = (document, get_words(document))
+
+    def get(self, index, item_id):
+        found = self._indexes[index].get(item_id)
+        return found[0] if found is not None else None
+
+    def delete(self, index, item_id):
+        with self._lock:
+            return self._indexes[index].pop(item_id, None) is not None
+
+    def search(self, index, words):
+        """Documents with any of the words, all of them when there are no words"""
+        with self._lock:
+            documents = list(self._indexes[index].values())
+        return [document for document, document_words in documents
+                if not words or not document_words.isdisjoint(words)]
+
+
+class InMemoryDatastoreClient:
+    """
+    Datastore client keeping entities in a dictionary by key
+
+    Entities are copied on the way in and out, callers modify those they get like they would with
+    entities deserialized by a real client.
+    """
+
+    def __init__(self, project='benchmark'):
+        self.project = project
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.Lock()
+        self._entities = {}
+
+    @staticmethod
+    def _copy(entity):
+        copied = datastore.Entity(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+        copied.update(entity)
+        return copied
+
+    def key(self, *path):
+        return datastore.Key(*path, project=self.project)
+
+    def get(self, key):
+        entity = self._entities.get(key)
+        return self._copy(entity) if entity is not None else None
+
+    def get_multi(self, keys):
+        found = [self._entities.get(key) for key in keys]
+        return [self._copy(entity) for entity in found if entity is not None]
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        copies = [self._copy(entity) for entity in entities]
+        with self._lock:
+            for entity in copies:
+                self._entities[entity.key] = entity
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def transaction(self):
+        """Transactions run one at a time, their writes are applied at once like those of put"""
+        return self._transaction_lock
+
+    def delete_multi(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entities.pop(key, None)
+
+
+class Endpoint:
+    """A request sent repeatedly by run_load"""
+
+    def __init__(self, name, path, method='GET', body=None, headers=None, expected=(200,)):
+        """
+        :param name: name of the endpoint in results
+        :type name: str
+        :param path: path with query or function returning it for the number of the request
+        :param method: HTTP method
+        :type method: str
+        :param body: request body, bytes or function returning them for the number of the request
+        :param headers: request headers
+        :type headers: dict
+        :param expected: status codes counted as success
+        :type expected: tuple
+        """
+        self.name = name
+        self.path = path
+        self.method = method
+        self.body = body
+        self.headers = headers or {}
+        self.expected = expected
+
+    def request(self, number):
+        """Path and body of the request with the given number"""
+        path = self.path(number) if callable(self.path) else self.path
+        body = self.body(number) if callable(self.body) else self.body
+        return path, body
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_load(host, port, endpoint, concurrency, requests=None, duration=None):
+    """
+    Sends requests of an endpoint from concurrent clients, each over its own keep-alive connection
+
+    Requests are numbered from 0 in the order they are sent, so that e.g. every POST writes a new item.
+
+    :param endpoint: the requests to be sent
+    :type endpoint: Endpoint
+    :param concurrency: number of clients
+    :type concurrency: int
+    :param requests: number of requests to be sent
+    :type requests: int
+    :param duration: seconds requests are sent for when requests is None
+    :type duration: float
+    :returns: dictionary with throughput and latency percentiles in milliseconds
+    :rtype: dict
+    """
+    latencies = []
+    errors = [0]
+    counter = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration if requests is None else None
+
+    def next_number():
+        with lock:
+            number = counter[0]
+            if requests is not None and number >= requests:
+                return None
+            counter[0] += 1
+            return number
+
+    def run_client():
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        own = []
+        failed = 0
+        while deadline is None or time.perf_counter() < deadline:
+            number = next_number()
+            if number is None:
+                break
+            path, body = endpoint.request(number)
+            start = time.perf_counter()
+            try:
+                connection.request(endpoint.method, path, body=body, headers=endpoint.headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                failed += 1
+                continue
+            if response.status in endpoint.expected:
+                own.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        connection.close()
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=run_client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    result = {
+        'endpoint': endpoint.name,
+        'method': endpoint.method,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+    }
+    for name, fraction in [('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)]:
+        result[name] = round(percentile(latencies, fraction) * 1000, 2) if latencies else None
+    result['max_ms'] = round(max(latencies) * 1000, 2) if latencies else None
+    return result
@@ -0,0 +1,118 @@
+"""
+Measures building JSON responses of listing and single item endpoints with each encoder of responses.py
+
+DAOs are replaced with in-memory data, so only the view, encoding and the Flask test client are timed.
+Every endpoint is requested with the json and the orjson encoder (the latter only when orjson is
+installed), a 404 shows the cost of a pre-encoded status body. The former way of building responses,
+flask.json.dumps and setting Content-Type on a Response, is timed alone next to json_response and
+status_response.
+
+Usage:
+python benchmarks/responses.py --items 100 --requests 2000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main
+import responses
+from dao import Algorithm
+from flask import Response
+
+_NOT_FOUND = {"code": 404, "fields": "string", "message": "Not Found"}
+
+
+def make_algorithm(number):
+    return {'algorithmId': 'algorithm' + str(number), 'algorithmSummary': 'summary of algorithm ' + str(number),
+            'displayName': 'Algorithm ' + str(number), 'linkURL': 'http://example.com/' + str(number),
+            'algorithmBLOB': None, 'algorithmDescription': 'description ' * 20, 'datasetDescription': 'dataset',
+            'timestamp': datetime(2017, 1, 1)}
+
+
+def legacy_response(data, status):
+    """Response built the way main.py did before responses.py"""
+    js = main.json.dumps(data)
+    resp = Response(js, status=status, mimetype='application/json')
+    resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+    return resp
+
+
+def time_endpoints(items, requests):
+    """
+    :returns: microseconds per request of every endpoint with every available encoder
+    :rtype: list
+    """
+    listing = [{key: value for key, value in make_algorithm(number).items() if key in main._ALGORITHM_FIELDS}
+               for number in range(items)]
+
+    def searchindexpage(found_list, page, tags='', limit=None, cursor=None):
+        found_list.extend(listing[:limit])
+        page.update(totalCount=len(listing), totalPages=1, nextCursor=None, version='v1')
+        return 0
+
+    def get(algorithm_id):
+        return Algorithm(make_algorithm(1)) if algorithm_id != 'missing' else 1
+
+    paths = {
+        'listing page': '/algorithms/?limit=' + str(items),
+        'single item': '/algorithms/algorithm1',
+        'not found': '/algorithms/missing',
+    }
+    encoders = ['json'] + (['orjson'] if responses.orjson is not None else [])
+    client = main.app.test_client()
+    results = []
+    with mock.patch.object(main.AlgorithmDAO, 'searchindexpage', searchindexpage), \
+            mock.patch.object(main.AlgorithmDAO, 'get', get):
+        for name in encoders:
+            with mock.patch.object(responses, 'encode', responses.get_encoder(name)):
+                for endpoint, path in paths.items():
+                    client.get(path)
+                    seconds = min(timeit.repeat(lambda: client.get(path).get_data(), number=requests, repeat=3))
+                    results.append({'endpoint': endpoint, 'encoder': name,
+                                    'us_per_request': round(seconds / requests * 1e6, 1)})
+    return results
+
+
+def time_builders(items, requests):
+    """
+    :returns: microseconds per response built the former way and with responses.py
+    :rtype: list
+    """
+    listing = [{key: value for key, value in make_algorithm(number).items() if key in main._ALGORITHM_FIELDS}
+               for number in range(items)]
+    cases = [
+        ('listing page', lambda: legacy_response(listing, 200), lambda: responses.json_response(listing)),
+        ('not found', lambda: legacy_response(_NOT_FOUND, 404), lambda: responses.status_response(404)),
+    ]
+    results = []
+    with main.app.app_context():
+        for case, legacy, current in cases:
+            for builder, build in [('json.dumps + Response', legacy), ('responses.py', current)]:
+                seconds = min(timeit.repeat(build, number=requests, repeat=3))
+                results.append({'response': case, 'builder': builder,
+                                'us_per_response': round(seconds / requests * 1e6, 1)})
+    return results
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--items', type=int, default=100, help='algorithms on a listing page')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'items': args.items,
+        'orjson': responses.orjson is not None,
+        'endpoints': time_endpoints(args.items, args.requests),
+        'builders': time_builders(args.items, args.requests),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main_benchmark()
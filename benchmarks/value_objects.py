@@ -0,0 +1,141 @@
+"""
+Compares construction time and memory of Algorithm objects with slots with the former dict-based class
+
+The former class kept fields in a dictionary written through a chain of setter calls, it's kept
+below as DictAlgorithm for the comparison only. Every round builds a listing of objects from wire
+dicts, like main.py does for results of 17ZSearch, and turns them back into dicts.
+
+Usage:
+python benchmarks/value_objects.py --objects 10000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dao import Algorithm, decode_text
+
+
+class DictAlgorithm:
+    """Algorithm with fields in a dictionary per instance, as before slots"""
+
+    def setalgorithm_id(self, algorithm_id):
+        self._data['algorithm_id'] = algorithm_id
+
+    def getalgorithm_id(self):
+        return self._data['algorithm_id']
+
+    def setsummary(self, summary):
+        self._data['summary'] = summary
+
+    def getsummary(self):
+        return self._data['summary']
+
+    def setdisplay_name(self, display_name):
+        self._data['display_name'] = display_name
+
+    def getdisplay_name(self):
+        return self._data['display_name']
+
+    def setlink_url(self, link_url):
+        self._data['link_url'] = link_url
+
+    def getlink_url(self):
+        return self._data['link_url']
+
+    def setblob(self, blob):
+        self._data['blob'] = blob
+
+    def getblob(self):
+        return self._data['blob']
+
+    def setdescription(self, description):
+        self._data['description'] = description
+
+    def getdescription(self):
+        return decode_text(self._data['description'])
+
+    def setdataset_description(self, dataset_description):
+        self._data['dataset_description'] = dataset_description
+
+    def getdataset_description(self):
+        return decode_text(self._data['dataset_description'])
+
+    def settimestamp(self, timestamp):
+        self._data['timestamp'] = timestamp
+
+    def __init__(self, dict_data):
+        self._data = {}
+        self.setalgorithm_id(dict_data['algorithmId'])
+        self.setsummary(dict_data['algorithmSummary'])
+        self.setdisplay_name(dict_data['displayName'])
+        self.setlink_url(dict_data['linkURL'])
+        self.setblob(dict_data['algorithmBLOB'])
+        self.setdescription(dict_data['algorithmDescription'])
+        self.setdataset_description(dict_data['datasetDescription'])
+        self.settimestamp(dict_data.get('timestamp'))
+
+    def get_dict(self, fields=None):
+        getters = {
+            'algorithmId': self.getalgorithm_id,
+            'algorithmSummary': self.getsummary,
+            'displayName': self.getdisplay_name,
+            'linkURL': self.getlink_url,
+            'algorithmBLOB': self.getblob,
+            'algorithmDescription': self.getdescription,
+            'datasetDescription': self.getdataset_description
+        }
+        if fields is None:
+            fields = getters
+        return {field: getters[field]() for field in fields}
+
+
+def make_wire_dicts(count):
+    return [{'algorithmId': 'algorithm' + str(number), 'algorithmSummary': 'summary of algorithm',
+             'displayName': 'Algorithm ' + str(number), 'linkURL': 'http://example.com/' + str(number),
+             'algorithmBLOB': None, 'algorithmDescription': 'description', 'datasetDescription': 'dataset'}
+            for number in range(count)]
+
+
+def measure(item_class, wire_dicts, repeat):
+    """
+    :returns: best times of building the objects and of building and serializing them, memory they keep
+    :rtype: dict
+    """
+    construct = min(timeit.repeat(lambda: [item_class(data) for data in wire_dicts], number=1, repeat=repeat))
+    round_trip = min(timeit.repeat(lambda: [item_class(data).get_dict() for data in wire_dicts], number=1,
+                                   repeat=repeat))
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [item_class(data) for data in wire_dicts]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del objects
+    return {
+        'class': item_class.__name__,
+        'construct_us_per_object': round(construct / len(wire_dicts) * 1e6, 3),
+        'construct_and_get_dict_us_per_object': round(round_trip / len(wire_dicts) * 1e6, 3),
+        'bytes_per_object': round(allocated / len(wire_dicts), 1),
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--objects', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    wire_dicts = make_wire_dicts(args.objects)
+    print(json.dumps({
+        'objects': args.objects,
+        'results': [measure(DictAlgorithm, wire_dicts, args.repeat), measure(Algorithm, wire_dicts, args.repeat)],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,114 @@
+"""
+Compares gunicorn worker models of gunicorn.conf.py on the existing endpoints
+
+Every mode runs the same number of gunicorn workers with gunicorn.conf.py. 17ZSearch is replaced by
+a stand-in on localhost:8080, the address dao.py uses outside of Google Cloud, answering after a
+fixed latency, and the search cache is disabled so every listing waits for it. Clients in threads
+send requests over keep-alive connections for a fixed time per endpoint:
+
+/algorithms/?tags=algorithm  waits for the search stand-in, shows how many requests a worker overlaps
+/swagger.json                served from memory, shows the overhead of the worker model itself
+/doc/                        small redirect built per request
+
+gevent mode runs only when gevent is installed.
+
+Usage:
+python benchmarks/worker_models.py --workers 2 --concurrency 32 --duration 5 --latency 0.05
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from harness import Endpoint, SearchService, run_load
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+_ENDPOINTS = [
+    Endpoint('/algorithms/?tags=algorithm', '/algorithms/?tags=algorithm', headers={'Accept-Encoding': 'gzip'}),
+    Endpoint('/swagger.json', '/swagger.json', headers={'Accept-Encoding': 'gzip'}),
+    Endpoint('/doc/', '/doc/', expected=(302,)),
+]
+
+
+def get_free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_gunicorn(worker_class, workers, port, work_dir):
+    """Starts gunicorn with gunicorn.conf.py and waits until it answers"""
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers),
+               GUNICORN_BIND='127.0.0.1:' + str(port), GUNICORN_LOGLEVEL='warning',
+               SEARCH_CACHE_TTL='0', SEARCH_CACHE_STALE_TTL='0',
+               INDEX_QUEUE_PATH=os.path.join(work_dir, worker_class + '-index-queue.sqlite3'))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+                               cwd=_ROOT, env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/swagger.json')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn with ' + worker_class + ' workers did not start')
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers of every mode')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of load per endpoint')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the search stand-in takes to answer')
+    parser.add_argument('--modes', default='sync,gthread,gevent')
+    args = parser.parse_args()
+
+    search = SearchService(('127.0.0.1', 8080), args.latency).start()
+    for number in range(20):
+        search.put('algorithms', 'algorithm' + str(number), {
+            'algorithmId': 'algorithm' + str(number), 'algorithmSummary': 'algorithm summary',
+            'displayName': 'name', 'linkURL': 'http://example.com'})
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='17z-benchmark-')
+    try:
+        for worker_class in args.modes.split(','):
+            if worker_class == 'gevent':
+                try:
+                    import gevent
+                except ImportError:
+                    results.append({'worker_class': 'gevent', 'skipped': 'gevent is not installed'})
+                    continue
+            port = get_free_port()
+            process = start_gunicorn(worker_class, args.workers, port, work_dir)
+            try:
+                results.append({
+                    'worker_class': worker_class,
+                    'endpoints': [run_load('127.0.0.1', port, endpoint, args.concurrency, duration=args.duration)
+                                  for endpoint in _ENDPOINTS],
+                })
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        search.stop()
+        shutil.rmtree(work_dir, True)
+    print(json.dumps({
+        'workers': args.workers,
+        'concurrency': args.concurrency,
+        'search_latency_ms': args.latency * 1000,
+        'cpus': os.cpu_count(),
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,339 @@
+"""
+Chunked storage of algorithm and dataset BLOBs
+
+A BLOB is split into chunks of fixed size so that it's not limited by the maximum size of
+a single Datastore entity, and so that it's written from and read into a stream holding
+only a single chunk in memory.
+
+In Datastore a BLOB is a manifest entity of the given kind, keyed by id of the item, and
+chunk entities of kind <kind>chunks. Every write creates chunks of a new generation and
+switches the manifest to it only once all of them are stored, so a reader never sees a
+partially written BLOB. Chunks of the previous generation are deleted afterwards.
+
+For tests and single machine runs BLOBs may be kept in local files instead (BLOB_STORE_URL=file:///path).
+
+The store keeps bytes as they are given, a BLOB may be written encoded (e.g. compressed) and
+the name of its codec is kept with it so that readers know how to decode it.
+"""
+import os
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+from google.cloud import datastore
+from connections import datastore_clients
+
+# bytes in a single chunk, has to stay below the 1 MiB limit of a Datastore entity
+_BLOB_CHUNK_SIZE = int(os.environ.get('BLOB_CHUNK_SIZE', 512 * 1024))
+# chunks fetched by a single Datastore lookup while a BLOB is read
+_BLOB_READ_AHEAD = int(os.environ.get('BLOB_READ_AHEAD', 4))
+# file:///path keeps BLOBs in local files, empty means Datastore
+_BLOB_STORE_URL = os.environ.get('BLOB_STORE_URL', '')
+_CHUNKS_KIND_SUFFIX = 'chunks'
+# codec of BLOBs stored as they are
+_IDENTITY_CODEC = 'identity'
+# files start with this and the codec name followed by a new line
+_FILE_MAGIC = b'17zblob:'
+
+
+class BlobStoreError(Exception):
+    """Exception raised when a BLOB can't be read or written"""
+    pass
+
+
+class BlobNotFoundError(BlobStoreError):
+    """Exception raised when there is no BLOB for the given id"""
+    pass
+
+
+class BlobReader:
+    """
+    Opened BLOB, iterating over it yields its chunks as bytes
+
+    Usage:
+    reader = blob_store.open('algorithmblobs', algorithm_id)
+    resp = Response(iter(reader), headers={'Content-Length': str(reader.size)})
+    """
+
+    def __init__(self, size, chunks, codec=_IDENTITY_CODEC):
+        """
+        :param size: size of the whole BLOB in bytes as it's stored
+        :type size: int
+        :param chunks: iterator of chunks
+        :param codec: name of the codec the BLOB was written with
+        :type codec: str
+        """
+        self.size = size
+        self.codec = codec
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self._chunks
+
+    def read(self):
+        """Returns the whole BLOB at once"""
+        return b''.join(self._chunks)
+
+
+def iter_stream(stream, chunk_size):
+    """
+    Yields chunks of exactly chunk_size bytes read from a stream, only the last one may be shorter
+
+    :param stream: binary file-like object with read(size), it may return less than asked for
+    """
+    buffer = b''
+    while True:
+        data = stream.read(chunk_size - len(buffer))
+        if not data:
+            break
+        buffer += data
+        if len(buffer) == chunk_size:
+            yield buffer
+            buffer = b''
+    if buffer:
+        yield buffer
+
+
+class DatastoreBlobBackend:
+    """Keeps BLOBs in Datastore as a manifest entity and chunk entities"""
+
+    def __init__(self, clients=datastore_clients, chunk_size=_BLOB_CHUNK_SIZE, read_ahead=_BLOB_READ_AHEAD):
+        """
+        :param clients: manager of Datastore clients
+        :type clients: connections.DatastoreClientManager
+        :param chunk_size: bytes in a single chunk entity
+        :type chunk_size: int
+        :param read_ahead: chunks fetched by a single lookup
+        :type read_ahead: int
+        """
+        self.clients = clients
+        self.chunk_size = chunk_size
+        self.read_ahead = read_ahead
+
+    @staticmethod
+    def _chunk_name(name, generation, index):
+        return name + ':' + generation + ':' + str(index)
+
+    def _chunk_keys(self, ds, kind, name, generation, start, stop):
+        return [ds.key(kind + _CHUNKS_KIND_SUFFIX, self._chunk_name(name, generation, index))
+                for index in range(start, stop)]
+
+    def _iter_chunks(self, kind, name, generation, chunks):
+        for start in range(0, chunks, self.read_ahead):
+            stop = min(start + self.read_ahead, chunks)
+            ds = self.clients.get()
+            try:
+                keys = self._chunk_keys(ds, kind, name, generation, start, stop)
+                found = {entity.key.name: entity['data'] for entity in ds.get_multi(keys)}
+            except Exception as err:
+                self.clients.report_failure(err)
+                raise BlobStoreError('Reading chunks of ' + name + ' failed') from err
+            for key in keys:
+                if key.name not in found:
+                    # the BLOB was overwritten and this generation deleted while it was read
+                    raise BlobStoreError('Chunk ' + key.name + ' is missing')
+                yield found[key.name]
+
+    def open(self, kind, name):
+        """
+        Opens a BLOB for reading, its chunks are fetched only as the reader is iterated over
+
+        :param kind: kind of manifest entities
+        :type kind: str
+        :param name: id of an item
+        :type name: str
+        :rtype: BlobReader
+        :raises: BlobNotFoundError, BlobStoreError
+        """
+        ds = self.clients.get()
+        try:
+            manifest = ds.get(ds.key(kind, name))
+        except Exception as err:
+            self.clients.report_failure(err)
+            raise BlobStoreError('Reading manifest of ' + name + ' failed') from err
+        if manifest is None or 'generation' not in manifest:
+            raise BlobNotFoundError(name)
+        return BlobReader(manifest['size'],
+                          self._iter_chunks(kind, name, manifest['generation'], manifest['chunks']),
+                          manifest.get('codec', _IDENTITY_CODEC))
+
+    def write(self, kind, name, stream, codec=_IDENTITY_CODEC):
+        """
+        Writes a BLOB read from a stream chunk by chunk, replacing the previous one
+
+        :param kind: kind of manifest entities
+        :type kind: str
+        :param name: id of an item
+        :type name: str
+        :param stream: binary file-like object with read(size)
+        :param codec: name of the codec stream is encoded with
+        :type codec: str
+        :returns: size of the BLOB in bytes as it's stored
+        :rtype: int
+        :raises: BlobStoreError
+        """
+        generation = uuid.uuid4().hex
+        chunks = 0
+        size = 0
+        ds = self.clients.get()
+        try:
+            for data in iter_stream(stream, self.chunk_size):
+                entity = datastore.Entity(key=ds.key(kind + _CHUNKS_KIND_SUFFIX,
+                                                     self._chunk_name(name, generation, chunks)),
+                                          exclude_from_indexes=('data',))
+                entity['data'] = data
+                ds.put(entity)
+                chunks += 1
+                size += len(data)
+            previous = ds.get(ds.key(kind, name))
+            manifest = datastore.Entity(key=ds.key(kind, name))
+            manifest.update({
+                'generation': generation,
+                'chunks': chunks,
+                'size': size,
+                'codec': codec,
+                'timestamp': datetime.now(timezone.utc)
+            })
+            ds.put(manifest)
+        except Exception as err:
+            self.clients.report_failure(err)
+            self._delete_chunks(kind, name, generation, chunks)
+            raise BlobStoreError('Writing ' + name + ' failed') from err
+        if previous is not None and 'generation' in previous:
+            self._delete_chunks(kind, name, previous['generation'], previous['chunks'])
+        return size
+
+    def _delete_chunks(self, kind, name, generation, chunks):
+        """Deletes chunks of a generation, failures only leave orphaned chunks behind"""
+        ds = self.clients.get()
+        try:
+            for start in range(0, chunks, 500):
+                ds.delete_multi(self._chunk_keys(ds, kind, name, generation, start, min(start + 500, chunks)))
+        except Exception as err:
+            self.clients.report_failure(err)
+
+    def delete(self, kind, name):
+        """
+        Deletes a BLOB, deleting one which doesn't exist isn't an error
+
+        :raises: BlobStoreError
+        """
+        ds = self.clients.get()
+        try:
+            manifest = ds.get(ds.key(kind, name))
+            ds.delete(ds.key(kind, name))
+        except Exception as err:
+            self.clients.report_failure(err)
+            raise BlobStoreError('Deleting ' + name + ' failed') from err
+        if manifest is not None and 'generation' in manifest:
+            self._delete_chunks(kind, name, manifest['generation'], manifest['chunks'])
+
+
+class FilesystemBlobBackend:
+    """Keeps BLOBs as files in directories named after kinds, meant for tests and local runs"""
+
+    def __init__(self, root, chunk_size=_BLOB_CHUNK_SIZE):
+        """
+        :param root: directory of the store, it's created if needed
+        :type root: str
+        :param chunk_size: bytes read from a file at once
+        :type chunk_size: int
+        """
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def _path(self, kind, name):
+        # quoting keeps any id inside the kind directory
+        return os.path.join(self.root, quote(kind, safe=''), 'blob-' + quote(name, safe=''))
+
+    def _iter_file(self, blob_file):
+        with blob_file:
+            while True:
+                data = blob_file.read(self.chunk_size)
+                if not data:
+                    return
+                yield data
+
+    def open(self, kind, name):
+        """
+        Opens a BLOB for reading, a file already opened is read whole even if it's replaced meanwhile
+
+        :rtype: BlobReader
+        :raises: BlobNotFoundError, BlobStoreError
+        """
+        try:
+            blob_file = open(self._path(kind, name), 'rb')
+            header = blob_file.readline(128)
+            if header.startswith(_FILE_MAGIC) and header.endswith(b'\n'):
+                codec = header[len(_FILE_MAGIC):-1].decode('ascii')
+            else:
+                blob_file.seek(0)
+                header = b''
+                codec = _IDENTITY_CODEC
+            size = os.fstat(blob_file.fileno()).st_size - len(header)
+        except FileNotFoundError:
+            raise BlobNotFoundError(name) from None
+        except (OSError, UnicodeDecodeError) as err:
+            raise BlobStoreError('Opening ' + name + ' failed') from err
+        return BlobReader(size, self._iter_file(blob_file), codec)
+
+    def write(self, kind, name, stream, codec=_IDENTITY_CODEC):
+        """
+        Writes a BLOB read from a stream into a temporary file which then replaces the previous one
+
+        :param codec: name of the codec stream is encoded with
+        :type codec: str
+        :returns: size of the BLOB in bytes as it's stored
+        :rtype: int
+        :raises: BlobStoreError
+        """
+        path = self._path(kind, name)
+        size = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        except OSError as err:
+            raise BlobStoreError('Writing ' + name + ' failed') from err
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                temp_file.write(_FILE_MAGIC + codec.encode('ascii') + b'\n')
+                for data in iter_stream(stream, self.chunk_size):
+                    temp_file.write(data)
+                    size += len(data)
+            os.replace(temp_path, path)
+        except Exception as err:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise BlobStoreError('Writing ' + name + ' failed') from err
+        return size
+
+    def delete(self, kind, name):
+        """
+        Deletes a BLOB, deleting one which doesn't exist isn't an error
+
+        :raises: BlobStoreError
+        """
+        try:
+            os.unlink(self._path(kind, name))
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            raise BlobStoreError('Deleting ' + name + ' failed') from err
+
+
+def get_blob_store(url=_BLOB_STORE_URL):
+    """
+    Creates BLOB store backend for url
+
+    :param url: file:///path for FilesystemBlobBackend or '' for DatastoreBlobBackend
+    :type url: str
+    :returns: backend with open(kind, name), write(kind, name, stream, codec) and delete(kind, name)
+    """
+    if url == '':
+        return DatastoreBlobBackend()
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return FilesystemBlobBackend(parsed.path)
+    raise ValueError('Unsupported BLOB_STORE_URL ' + url)
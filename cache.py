@@ -0,0 +1,407 @@
+"""
+In-process caches in front of DAO lookups
+
+Catalogue entries change rarely, so single item lookups are kept in a bounded LRU cache with
+a TTL. Writes on the same worker invalidate entries directly. When a shared backend is
+configured (CACHE_REDIS_URL, anything speaking the Redis protocol) every invalidation also
+bumps a per-key version in it, and other workers treat their local copy as stale once its
+version no longer matches, so invalidations propagate across workers without pub/sub.
+
+Search results are cached as a whole namespace, any write invalidates all of them, and an
+expired result is still served for a while as stale while it's refreshed in the background.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# url of the shared backend, e.g. redis://localhost:6379/0, empty means local invalidation only
+_CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', '')
+# prefix of version keys written to the shared backend
+_SHARED_KEY_PREFIX = '17z:cache:'
+
+
+class LocalSharedBackend:
+    """
+    Redis-compatible stand-in keeping versions in memory of the current process
+
+    It's only shared by caches of one process so it's meant for tests and single worker runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, 0)) + 1
+            self._data[key] = value
+            return value
+
+
+def get_shared_backend(url=_CACHE_REDIS_URL):
+    """
+    Creates shared backend for url
+
+    :param url: redis:// url, 'local' for LocalSharedBackend or '' for none
+    :type url: str
+    :returns: backend with get(key) and incr(key) or None
+    """
+    if url == '':
+        return None
+    if url == 'local':
+        return LocalSharedBackend()
+    if redis is None:
+        raise ImportError('CACHE_REDIS_URL is set but redis package is not installed')
+    return redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after ttl seconds
+
+    Thread safe, values are returned as they were stored so callers must not mutate them.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """
+        :param maxsize: maximum number of entries, the least recently used is evicted first
+        :type maxsize: int
+        :param ttl: seconds after which an entry expires
+        :type ttl: float
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'expirations': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def _lookup(self, key, now):
+        """Returns entry tuple (value, expires_at, tag) or None, has to be called with the lock held"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            self._counters['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, tag=None, ttl=None):
+        """Has to be called with the lock held"""
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), tag)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is None:
+                self._counters['misses'] += 1
+                return default
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores value of key
+
+        :param ttl: seconds after which this entry expires, at most ttl of the cache, None means ttl of the cache
+        :type ttl: float
+        """
+        with self._lock:
+            self._store(key, value, ttl=self.ttl if ttl is None else min(ttl, self.ttl))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters['invalidations'] += 1
+
+    def stats(self):
+        """
+        Counters and current size of the cache
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+        stats['maxsize'] = self.maxsize
+        stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class ReadThroughCache(TTLCache):
+    """
+    TTLCache loading missing entries with a loader function
+
+    Usage:
+    algorithm_cache = ReadThroughCache('algorithms', 1000, 60)
+    found = algorithm_cache.get_or_load(algorithm_id, load_algorithm, lambda value: value not in [1, 2])
+    ...
+    algorithm_cache.invalidate(algorithm_id)  # after every write
+    """
+
+    def __init__(self, name, maxsize, ttl, shared=None):
+        """
+        :param name: namespace of keys in the shared backend
+        :type name: str
+        :param maxsize: maximum number of entries
+        :type maxsize: int
+        :param ttl: seconds after which an entry expires
+        :type ttl: float
+        :param shared: backend with get(key) and incr(key) propagating invalidations or None
+        """
+        super().__init__(maxsize, ttl)
+        self.name = name
+        self.shared = shared
+        # bumped by every local invalidation, a load which overlapped one is not stored
+        self._epoch = 0
+        self._counters['shared_errors'] = 0
+
+    def _shared_key(self, key):
+        return _SHARED_KEY_PREFIX + self.name + ':' + str(key)
+
+    def _shared_version(self, key):
+        """Version of key in the shared backend, None if unknown or the backend failed"""
+        try:
+            version = self.shared.get(self._shared_key(key))
+        except Exception:
+            with self._lock:
+                self._counters['shared_errors'] += 1
+            return None
+        return int(version) if version is not None else 0
+
+    def lookup(self, key):
+        """
+        Returns cached value of key
+
+        Used directly by callers which load values in their own way, e.g. with asyncio.
+        :param key: key of an entry
+        :returns: tuple (found, value, token), on a miss value is None and token has to be passed to store()
+        :rtype: tuple
+        """
+        version = self._shared_version(key) if self.shared is not None else None
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is not None and (self.shared is None or (version is not None and entry[2] == version)):
+                self._counters['hits'] += 1
+                return True, entry[0], (version, self._epoch)
+            self._counters['misses'] += 1
+            return False, None, (version, self._epoch)
+
+    def store(self, key, value, cacheable, token):
+        """
+        Stores value loaded after a miss reported by lookup
+
+        :param token: token returned by lookup, the value isn't stored if an invalidation happened since
+        """
+        version, epoch = token
+        if cacheable(value) and (self.shared is None or version is not None):
+            with self._lock:
+                if epoch == self._epoch:
+                    self._store(key, value, version)
+
+    def get_or_load(self, key, loader, cacheable=lambda value: True):
+        """
+        Returns cached value of key or loads it with loader(key) and stores it if cacheable
+
+        :param key: key of an entry
+        :param loader: function returning value for key
+        :param cacheable: function telling if loaded value may be stored, e.g. it's not an error code
+        :returns: value from cache or from loader
+        """
+        found, value, token = self.lookup(key)
+        if found:
+            return value
+        value = loader(key)
+        self.store(key, value, cacheable, token)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+            self._counters['invalidations'] += 1
+
+    def invalidate(self, key):
+        """Drops key here and, through the shared backend, in every other worker"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._epoch += 1
+            self._counters['invalidations'] += 1
+        if self.shared is not None:
+            try:
+                self.shared.incr(self._shared_key(key))
+            except Exception:
+                with self._lock:
+                    self._counters['shared_errors'] += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats['shared'] = self.shared is not None
+        return stats
+
+
+class SearchResultCache(TTLCache):
+    """
+    TTLCache of search results invalidated all at once, serving stale results while refreshing them
+
+    An entry is fresh for ttl seconds, then for stale_ttl seconds it's still returned while a single
+    background thread loads a new value, after that it's loaded synchronously again.
+
+    Usage:
+    algorithm_search_cache = SearchResultCache('algorithms-search', 256, 30, 300)
+    code, found = algorithm_search_cache.get_or_load(('algo', 'rithm'), search, lambda value: value[0] == 0)
+    ...
+    algorithm_search_cache.clear()  # after every write
+    """
+
+    def __init__(self, name, maxsize, ttl, stale_ttl, shared=None):
+        """
+        :param name: key of the namespace version in the shared backend
+        :type name: str
+        :param maxsize: maximum number of entries
+        :type maxsize: int
+        :param ttl: seconds during which an entry is fresh
+        :type ttl: float
+        :param stale_ttl: seconds after ttl during which a stale entry is served while being refreshed
+        :type stale_ttl: float
+        :param shared: backend with get(key) and incr(key) propagating invalidations or None
+        """
+        super().__init__(maxsize, ttl + stale_ttl)
+        self.name = name
+        self.fresh_ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        # bumped by every local invalidation, a load which overlapped one is not stored
+        self._epoch = 0
+        self._refreshing = set()
+        self._counters['stale_hits'] = 0
+        self._counters['refreshes'] = 0
+        self._counters['refresh_errors'] = 0
+        self._counters['shared_errors'] = 0
+
+    def _shared_version(self):
+        """Version of the namespace in the shared backend, None if the backend failed"""
+        try:
+            version = self.shared.get(_SHARED_KEY_PREFIX + self.name)
+        except Exception:
+            with self._lock:
+                self._counters['shared_errors'] += 1
+            return None
+        return int(version) if version is not None else 0
+
+    def store(self, key, value, cacheable, token):
+        """
+        Stores value loaded after a miss reported by lookup
+
+        :param token: token returned by lookup, the value isn't stored if an invalidation happened since
+        """
+        version, epoch = token
+        if cacheable(value) and (self.shared is None or version is not None):
+            with self._lock:
+                if epoch == self._epoch:
+                    self._store(key, value, (time.monotonic() + self.fresh_ttl, version))
+
+    def _refresh(self, key, loader, cacheable, token):
+        try:
+            self.store(key, loader(key), cacheable, token)
+        except Exception:
+            with self._lock:
+                self._counters['refresh_errors'] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def lookup(self, key, loader, cacheable=lambda value: True):
+        """
+        Returns cached value of key, refreshing it in background with loader(key) when stale
+
+        Used directly by callers which load values in their own way, e.g. stream them.
+        :param key: hashable normalized key of a search
+        :param loader: function returning value for key used for background refresh
+        :param cacheable: function telling if loaded value may be stored, e.g. it's not an error
+        :returns: tuple (found, value, token), on a miss value is None and token has to be passed to store()
+        :rtype: tuple
+        """
+        version = self._shared_version() if self.shared is not None else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lookup(key, now)
+            token = (version, self._epoch)
+            if entry is None or (self.shared is not None and (version is None or entry[2][1] != version)):
+                self._counters['misses'] += 1
+                return False, None, token
+            if now < entry[2][0]:
+                self._counters['hits'] += 1
+                return True, entry[0], token
+            self._counters['stale_hits'] += 1
+            refresh = key not in self._refreshing
+            if refresh:
+                self._refreshing.add(key)
+                self._counters['refreshes'] += 1
+        if refresh:
+            threading.Thread(target=self._refresh, args=(key, loader, cacheable, token),
+                             name='cache-refresh', daemon=True).start()
+        return True, entry[0], token
+
+    def get_or_load(self, key, loader, cacheable=lambda value: True):
+        """
+        Returns cached value of key, refreshing it in background when stale, or loads it with loader(key)
+
+        :param key: hashable normalized key of a search
+        :param loader: function returning value for key
+        :param cacheable: function telling if loaded value may be stored, e.g. it's not an error
+        :returns: value from cache or from loader
+        """
+        found, value, token = self.lookup(key, loader, cacheable)
+        if found:
+            return value
+        value = loader(key)
+        self.store(key, value, cacheable, token)
+        return value
+
+    def clear(self):
+        """Drops every result here and, through the shared backend, in every other worker"""
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+            self._counters['invalidations'] += 1
+        if self.shared is not None:
+            try:
+                self.shared.incr(_SHARED_KEY_PREFIX + self.name)
+            except Exception:
+                with self._lock:
+                    self._counters['shared_errors'] += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats['stale_ttl'] = self.stale_ttl
+        stats['ttl'] = self.fresh_ttl
+        stats['shared'] = self.shared is not None
+        return stats
@@ -0,0 +1,298 @@
+"""
+WSGI middleware compressing responses with gzip or deflate
+
+Responses of compressible types above a size threshold are compressed for clients accepting it.
+Responses with a known length are compressed at once, streamed ones chunk by chunk as they come,
+flushed every COMPRESSION_FLUSH_SIZE bytes so clients get items of long listings without waiting for
+the end. Responses with Content-Encoding, e.g. precompressed assets or gzip BLOBs, are passed through.
+A compressed response is a different representation, so its strong ETag is made weak like nginx does,
+conditional requests with it still match through weak comparison in main.not_modified.
+
+Compression ratio and CPU time are counted per route to tune COMPRESSION_MIN_SIZE and COMPRESSION_LEVEL.
+
+Usage:
+app.wsgi_app = CompressionMiddleware(app.wsgi_app, url_map=app.url_map)
+body = app.wsgi_app.compress(response, environ, start_response)
+"""
+import os
+import threading
+import time
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+# responses smaller than this number of bytes aren't compressed, the header overhead isn't worth it
+_COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# zlib compression level, 1 is the fastest, 9 the smallest
+_COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# bytes of a streamed response compressed before they're flushed to the client
+_COMPRESSION_FLUSH_SIZE = int(os.environ.get('COMPRESSION_FLUSH_SIZE', 16 * 1024))
+# responses of known length up to this number of bytes are compressed at once with a new Content-Length
+_COMPRESSION_BUFFER_SIZE = int(os.environ.get('COMPRESSION_BUFFER_SIZE', 1024 * 1024))
+# coma delimited list of compressed Content-Types
+_COMPRESSION_MIMETYPES = os.environ.get(
+    'COMPRESSION_MIMETYPES',
+    'application/json,application/x-ndjson,text/html,text/plain,text/css,text/javascript,application/javascript')
+# window bits of zlib for Content-Encodings in order of preference, deflate is zlib format as HTTP defines it
+_ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Chooses Content-Encoding from Accept-Encoding header
+
+    :param accept_encoding: value of Accept-Encoding header
+    :type accept_encoding: str
+    :returns: gzip, deflate or None
+    """
+    if not accept_encoding:
+        return None
+    accepted = parse_accept_header(accept_encoding)
+    for encoding in _ENCODINGS:
+        if accepted[encoding]:
+            return encoding
+    return None
+
+
+class RouteStats:
+    """Counters of a single route"""
+    __slots__ = ('responses', 'compressed', 'small', 'bytes_in', 'bytes_out', 'cpu_seconds')
+
+    def __init__(self):
+        self.responses = 0
+        self.compressed = 0
+        self.small = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def to_dict(self):
+        return {
+            'responses': self.responses,
+            'compressed': self.compressed,
+            'small': self.small,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+            'cpu_ms': round(self.cpu_seconds * 1000, 3),
+            'cpu_us_per_kb': round(self.cpu_seconds * 1e6 / (self.bytes_in / 1024), 3) if self.bytes_in else None,
+        }
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of a WSGI app
+
+    Only responses to clients accepting gzip or deflate are inspected, others go straight through.
+    """
+
+    def __init__(self, app, url_map=None, min_size=_COMPRESSION_MIN_SIZE, level=_COMPRESSION_LEVEL,
+                 flush_size=_COMPRESSION_FLUSH_SIZE, mimetypes=_COMPRESSION_MIMETYPES):
+        """
+        :param app: WSGI app
+        :param url_map: URL map of the app, statistics are kept per rule, e.g. /algorithms/<algorithm_id>,
+            without it per path
+        :type url_map: werkzeug.routing.Map
+        :param min_size: minimal size of compressed responses in bytes
+        :type min_size: int
+        :param level: zlib compression level
+        :type level: int
+        :param flush_size: bytes of a streamed response compressed before they're flushed
+        :type flush_size: int
+        :param mimetypes: coma delimited list of compressed Content-Types
+        :type mimetypes: str
+        """
+        self.app = app
+        self.url_map = url_map
+        self.min_size = min_size
+        self.level = level
+        self.flush_size = flush_size
+        self.mimetypes = frozenset(mimetype.strip() for mimetype in mimetypes.split(',') if mimetype.strip())
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._skipped = {'not_accepted': 0, 'encoded': 0, 'mimetype': 0, 'status': 0}
+
+    def __call__(self, environ, start_response):
+        return self.compress(self.app, environ, start_response)
+
+    def compress(self, app, environ, start_response):
+        """
+        Response of a WSGI app compressed when the client accepts it, e.g. of a single werkzeug Response
+
+        :param app: WSGI app, the wrapped one or another sharing the URL map and statistics
+        :returns: iterable of the response body
+        """
+        encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None or environ['REQUEST_METHOD'] == 'HEAD':
+            self._skip('not_accepted')
+            return app(environ, start_response)
+        started = {}
+        written = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            if exc_info is not None and started.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'] = status
+            started['headers'] = headers
+            return written.append
+
+        app_iter = app(environ, capture_start_response)
+        body = self._respond(environ, start_response, encoding, started, written, iter(app_iter))
+        # closes the response of the app even if the server never starts iterating over the body
+        return ClosingIterator(body, getattr(app_iter, 'close', None))
+
+    def _skip(self, reason):
+        with self._lock:
+            self._skipped[reason] += 1
+
+    def get_route(self, environ):
+        """Rule of the requested URL or its path when there's no URL map"""
+        if self.url_map is None:
+            return environ.get('PATH_INFO', '')
+        try:
+            rule, _ = self.url_map.bind_to_environ(environ).match(return_rule=True)
+        except HTTPException:
+            return 'unknown'
+        return rule.rule
+
+    def _record(self, environ, compressed, bytes_in=0, bytes_out=0, cpu_seconds=0.0):
+        route = self.get_route(environ)
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.responses += 1
+            if compressed:
+                stats.compressed += 1
+                stats.bytes_in += bytes_in
+                stats.bytes_out += bytes_out
+                stats.cpu_seconds += cpu_seconds
+            else:
+                stats.small += 1
+
+    def compressible(self, status, headers):
+        """
+        Checks if a response can be compressed judging by its status and headers
+
+        :returns: None if it can or reason why it can't
+        """
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return 'status'
+        if 'Content-Encoding' in headers or 'no-transform' in headers.get('Cache-Control', ''):
+            return 'encoded'
+        if headers.get('Content-Type', '').split(';', 1)[0].strip().lower() not in self.mimetypes:
+            return 'mimetype'
+        return None
+
+    def set_headers(self, headers, encoding):
+        """Headers of a compressed response"""
+        headers['Content-Encoding'] = encoding
+        vary = headers.get('Vary')
+        headers['Vary'] = vary + ', Accept-Encoding' if vary else 'Accept-Encoding'
+        etag = headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+
+    def _respond(self, environ, start_response, encoding, started, written, chunks):
+        """Generator of the response body, start_response is called just before its first chunk"""
+        buffered = list(written)
+        del written[:]
+        while 'status' not in started:
+            buffered.append(next(chunks))
+        headers = Headers(started['headers'])
+        reason = self.compressible(started['status'], headers)
+        if reason is not None:
+            self._skip(reason)
+            yield from self._pass(start_response, started, written, buffered, chunks)
+            return
+        length = headers.get('Content-Length')
+        if length is not None and int(length) < self.min_size:
+            self._record(environ, False)
+            yield from self._pass(start_response, started, written, buffered, chunks)
+            return
+        # the response is read until it's known to be large enough, or whole if its length is known
+        # and it's likely in memory already
+        size = sum(len(data) for data in buffered)
+        read_size = int(length) if length is not None and int(length) <= _COMPRESSION_BUFFER_SIZE else self.min_size
+        complete = False
+        while size < read_size and not complete:
+            data = next(chunks, None)
+            if data is None:
+                complete = True
+            else:
+                buffered.append(data)
+                size += len(data)
+        buffered.extend(written)
+        del written[:]
+        if length is not None and size >= int(length):
+            complete = True
+        if size < self.min_size:
+            self._record(environ, False)
+            yield from self._pass(start_response, started, written, buffered, chunks)
+            return
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _ENCODINGS[encoding])
+        cpu_start = time.thread_time()
+        body = compressor.compress(b''.join(buffered))
+        body += compressor.flush() if complete else compressor.flush(zlib.Z_SYNC_FLUSH)
+        cpu_seconds = time.thread_time() - cpu_start
+        self.set_headers(headers, encoding)
+        if complete:
+            headers['Content-Length'] = str(len(body))
+        else:
+            del headers['Content-Length']
+        started['sent'] = True
+        start_response(started['status'], headers.to_wsgi_list())
+        bytes_in = size
+        bytes_out = len(body)
+        yield body
+        if not complete:
+            unflushed = 0
+            for data in chunks:
+                if written:
+                    data = b''.join(written) + data
+                    del written[:]
+                cpu_start = time.thread_time()
+                body = compressor.compress(data)
+                unflushed += len(data)
+                if unflushed >= self.flush_size:
+                    body += compressor.flush(zlib.Z_SYNC_FLUSH)
+                    unflushed = 0
+                cpu_seconds += time.thread_time() - cpu_start
+                bytes_in += len(data)
+                if body:
+                    bytes_out += len(body)
+                    yield body
+            data = b''.join(written)
+            cpu_start = time.thread_time()
+            body = compressor.compress(data) + compressor.flush()
+            cpu_seconds += time.thread_time() - cpu_start
+            bytes_in += len(data)
+            bytes_out += len(body)
+            yield body
+        self._record(environ, True, bytes_in, bytes_out, cpu_seconds)
+
+    def _pass(self, start_response, started, written, buffered, chunks):
+        """Generator of an uncompressed response body"""
+        started['sent'] = True
+        start_response(started['status'], started['headers'])
+        yield from buffered
+        for data in chunks:
+            if written:
+                yield b''.join(written)
+                del written[:]
+            yield data
+        if written:
+            yield b''.join(written)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'skipped': dict(self._skipped),
+                'routes': {route: stats.to_dict() for route, stats in self._routes.items()},
+            }
@@ -0,0 +1,445 @@
+"""
+Lifecycle of connections to remote services used by dao.py
+
+Creating a datastore.Client re-resolves credentials and project and opens a new gRPC channel,
+so one client is kept per process and shared by all DAOs. The client is created lazily after
+fork (gunicorn workers never inherit the master's channel), re-checked periodically and
+recreated when the channel fails.
+
+Calls to 17ZSearch go through one pooled keep-alive requests.Session per process with
+timeouts and bounded retries, so they don't pay a TCP+TLS handshake each time and a slow
+search app can't pin a worker forever. Coroutines of asyncdao.py use one aiohttp.ClientSession
+per event loop with the same pool size, timeouts and retries instead, when aiohttp is installed.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+from google.cloud import datastore
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# seconds between health checks of a Datastore client, 0 disables periodic checks
+_DATASTORE_HEALTH_CHECK_INTERVAL = float(os.environ.get('DATASTORE_HEALTH_CHECK_INTERVAL', 300))
+# kind used by health check lookups, nothing is ever written to it
+_DATASTORE_KIND_HEALTH = '__health__'
+
+# size of the keep-alive connection pool to 17ZSearch, per host and process
+_SEARCH_POOL_SIZE = int(os.environ.get('SEARCH_POOL_SIZE', 10))
+# seconds to wait for a connection to 17ZSearch and for its response
+_SEARCH_CONNECT_TIMEOUT = float(os.environ.get('SEARCH_CONNECT_TIMEOUT', 3.05))
+_SEARCH_READ_TIMEOUT = float(os.environ.get('SEARCH_READ_TIMEOUT', 10))
+# retries of idempotent calls to 17ZSearch, waiting backoff * 2 ** (retry - 1) seconds in between
+_SEARCH_RETRIES = int(os.environ.get('SEARCH_RETRIES', 2))
+_SEARCH_RETRY_BACKOFF = float(os.environ.get('SEARCH_RETRY_BACKOFF', 0.1))
+# 17ZSearch runs on GAE standard which answers these while scaling up
+_SEARCH_RETRY_STATUSES = (502, 503, 504)
+
+# errors of a call to 17ZSearch that DAOs report as Connection Error
+SEARCH_CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+# errors meaning that the channel itself is broken, not that the operation was wrong
+_TRANSPORT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.Unknown,
+    auth_exceptions.TransportError,
+    ConnectionError,
+)
+
+
+def is_transport_error(err):
+    """
+    Checks if an exception raised by a client call means that its connection is broken
+
+    :param err: exception raised by a Datastore call
+    :type err: Exception
+    :rtype: bool
+    """
+    return isinstance(err, _TRANSPORT_ERRORS)
+
+
+class DatastoreClientManager:
+    """
+    Keeps a single datastore.Client per process
+
+    Usage:
+    ds = datastore_clients.get()
+    try:
+        ds.put(entity)
+    except Exception as err:
+        datastore_clients.report_failure(err)
+    """
+
+    def __init__(self, factory=datastore.Client, health_check_interval=_DATASTORE_HEALTH_CHECK_INTERVAL):
+        """
+        :param factory: callable creating a new client
+        :param health_check_interval: seconds between health checks, 0 disables them
+        :type health_check_interval: float
+        """
+        self._factory = factory
+        self._health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        # counters are updated outside of _lock too, by every get() reusing the client
+        self._counters_lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self._next_check = 0.0
+        self._counters = {
+            'creations': 0,
+            'reuses': 0,
+            'failures': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'health_check_errors': 0,
+        }
+
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def _check_due(self):
+        return self._health_check_interval > 0 and time.monotonic() >= self._next_check
+
+    def _create(self):
+        self._client = self._factory()
+        self._pid = os.getpid()
+        self._next_check = time.monotonic() + self._health_check_interval
+        self._count('creations')
+
+    def _health_check(self, client):
+        """
+        Looks up a key that never exists, a transport error means the client has to be recreated
+
+        Other errors, e.g. PermissionDenied, are logged and the client is kept, the request which
+        happened to trigger the check must not fail because of it. It's called without the lock,
+        other threads go on using the client meanwhile.
+
+        :returns: False if the client has to be recreated
+        :rtype: bool
+        """
+        self._count('health_checks')
+        try:
+            client.get(client.key(_DATASTORE_KIND_HEALTH, 'ping'))
+        except Exception as err:
+            if not is_transport_error(err):
+                self._count('health_check_errors')
+                logging.exception('Datastore health check failed, the client is kept')
+                return True
+            self._count('health_check_failures')
+            return False
+        return True
+
+    def get(self):
+        """
+        Returns the client of the current process, creating it if needed
+
+        :rtype: datastore.Client
+        """
+        client = self._client
+        if client is not None and self._pid == os.getpid() and not self._check_due():
+            self._count('reuses')
+            return client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._create()
+                return self._client
+            client = self._client
+            if not self._check_due():
+                self._count('reuses')
+                return client
+            # the check is started by this thread only, the others reuse the client until it's done
+            self._next_check = time.monotonic() + self._health_check_interval
+        if self._health_check(client):
+            return client
+        with self._lock:
+            # unless another thread has replaced it meanwhile
+            if self._client is client or self._client is None or self._pid != os.getpid():
+                self._create()
+            return self._client
+
+    def report_failure(self, err):
+        """
+        Drops the client if err shows that its channel is broken so the next get() recreates it
+
+        :param err: exception raised while using the client
+        :type err: Exception
+        :returns: True if the client was dropped
+        :rtype: bool
+        """
+        if not is_transport_error(err):
+            return False
+        with self._lock:
+            self._count('failures')
+            self._client = None
+        return True
+
+    def reset(self):
+        """Forgets the client without touching it, used in a freshly forked child"""
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._client = None
+        self._pid = None
+
+    def stats(self):
+        """
+        Counters of client lifecycle events in the current process
+
+        :rtype: dict
+        """
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['pid'] = os.getpid()
+        stats['active'] = self._client is not None and self._pid == os.getpid()
+        return stats
+
+
+class SearchSessionManager:
+    """
+    Keeps a single pooled requests.Session to 17ZSearch per process
+
+    Only idempotent methods (GET, DELETE) are retried after the request reached the server,
+    POST is retried only when the connection could not be established.
+
+    Usage:
+    response = search_sessions.get(get_search_url() + '/algorithms/')
+    """
+
+    def __init__(self, pool_size=_SEARCH_POOL_SIZE, timeout=(_SEARCH_CONNECT_TIMEOUT, _SEARCH_READ_TIMEOUT),
+                 retries=_SEARCH_RETRIES, backoff=_SEARCH_RETRY_BACKOFF):
+        """
+        :param pool_size: maximum number of kept-alive connections per host
+        :type pool_size: int
+        :param timeout: (connect, read) timeouts in seconds
+        :type timeout: tuple
+        :param retries: maximum number of retries of a single call
+        :type retries: int
+        :param backoff: backoff factor between retries in seconds
+        :type backoff: float
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        # counters are updated outside of _lock, by every request of every thread
+        self._counters_lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._counters = {
+            'sessions': 0,
+            'requests': 0,
+            'errors': 0,
+        }
+
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def _create(self):
+        retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                      allowed_methods=frozenset(['GET', 'DELETE']),
+                      status_forcelist=_SEARCH_RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._session = session
+        self._pid = os.getpid()
+        self._count('sessions')
+
+    def session(self):
+        """
+        Returns the session of the current process, creating it if needed
+
+        :rtype: requests.Session
+        """
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            return session
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._create()
+            return self._session
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request with the default timeout unless one is given
+
+        :raises: requests.ConnectionError, requests.Timeout
+        :rtype: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        self._count('requests')
+        try:
+            return self.session().request(method, url, **kwargs)
+        except SEARCH_CONNECTION_ERRORS:
+            self._count('errors')
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def reset(self):
+        """Forgets the session without closing it, used in a freshly forked child"""
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def stats(self):
+        """
+        Counters and connection pool utilisation per host in the current process
+
+        :rtype: dict
+        """
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['pool_size'] = self.pool_size
+        pools = []
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            pool_manager = session.get_adapter('https://').poolmanager
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+                idle = pool.pool.qsize() if pool.pool is not None else 0
+                pools.append({
+                    'host': pool.scheme + '://' + pool.host + ':' + str(pool.port),
+                    'connections_created': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'in_use': self.pool_size - idle,
+                })
+        stats['pools'] = pools
+        return stats
+
+
+class AsyncSearchSessionManager:
+    """
+    Keeps a single pooled aiohttp.ClientSession to 17ZSearch per event loop
+
+    Usage:
+    status, text = await async_search_sessions.get(get_search_url() + '/algorithms/')
+    """
+
+    def __init__(self, pool_size=_SEARCH_POOL_SIZE, timeout=(_SEARCH_CONNECT_TIMEOUT, _SEARCH_READ_TIMEOUT),
+                 retries=_SEARCH_RETRIES, backoff=_SEARCH_RETRY_BACKOFF):
+        """
+        :param pool_size: maximum number of kept-alive connections per host
+        :type pool_size: int
+        :param timeout: (connect, read) timeouts in seconds
+        :type timeout: tuple
+        :param retries: maximum number of retries of a single call
+        :type retries: int
+        :param backoff: backoff factor between retries in seconds
+        :type backoff: float
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._sessions = weakref.WeakKeyDictionary()
+        self._counters = {
+            'sessions': 0,
+            'requests': 0,
+            'errors': 0,
+        }
+
+    @staticmethod
+    def available():
+        """Checks if aiohttp is installed"""
+        return aiohttp is not None
+
+    def session(self):
+        """
+        Returns the session of the running event loop, creating it if needed
+
+        :rtype: aiohttp.ClientSession
+        """
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_size)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._sessions[loop] = session
+            self._counters['sessions'] += 1
+        return session
+
+    async def get(self, url):
+        """
+        Sends GET retrying connection errors and statuses of a scaling 17ZSearch
+
+        :returns: tuple (status code, body text)
+        :rtype: tuple
+        :raises: ConnectionError when 17ZSearch can't be reached
+        """
+        self._counters['requests'] += 1
+        for retry in range(self.retries + 1):
+            if retry > 0:
+                await asyncio.sleep(self.backoff * 2 ** (retry - 1))
+            try:
+                async with self.session().get(url) as response:
+                    status, text = response.status, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                error = err
+                continue
+            if status not in _SEARCH_RETRY_STATUSES or retry == self.retries:
+                return status, text
+        self._counters['errors'] += 1
+        raise ConnectionError('17ZSearch is not available') from error
+
+    async def close(self):
+        """Closes the session of the running event loop, e.g. on shutdown of an ASGI server"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def reset(self):
+        """Forgets sessions without closing them, used in a freshly forked child"""
+        self._sessions = weakref.WeakKeyDictionary()
+
+    def stats(self):
+        """
+        Counters of the current process
+
+        :rtype: dict
+        """
+        stats = dict(self._counters)
+        stats['pool_size'] = self.pool_size
+        stats['available'] = self.available()
+        stats['open'] = sum(1 for session in list(self._sessions.values()) if not session.closed)
+        return stats
+
+
+datastore_clients = DatastoreClientManager()
+search_sessions = SearchSessionManager()
+async_search_sessions = AsyncSearchSessionManager()
+
+
+def reinit_after_fork():
+    """Drops every connection inherited from the parent process"""
+    datastore_clients.reset()
+    search_sessions.reset()
+    async_search_sessions.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reinit_after_fork)
@@ -1,13 +1,143 @@
-import requests
+import base64
+import binascii
+import hashlib
+import io
 import json
+import logging
 import os
-from google.cloud import datastore
-from datetime import datetime
-
-# name of kind to store data in Datastore
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote
+from urllib3.exceptions import HTTPError
+from connections import search_sessions, SEARCH_CONNECTION_ERRORS
+from jsonstream import iter_json_array, JSONStreamError
+from cache import ReadThroughCache, SearchResultCache, get_shared_backend
+from blobstore import BlobReader, BlobStoreError, BlobNotFoundError, DatastoreBlobBackend, get_blob_store
+from indexqueue import IndexQueue, ACTION_SET, ACTION_DELETE
+from storage import DatastoreStorage, StorageError, get_storage
+
+# backend keeping users, algorithms and datasets, Datastore unless STORAGE_URL says otherwise
+storage = get_storage()
+# name of kind to store data in
 _DATASTORE_KIND_ALGORITHMS = 'algorithms'
 _DATASTORE_KIND_USERS = 'users'
 _DATASTORE_KIND_DATASETS = 'datasets'
+# BLOBs are kept in the BLOB store under these kinds with the same key name so that reading metadata never loads them
+_DATASTORE_KIND_ALGORITHM_BLOBS = 'algorithmblobs'
+_DATASTORE_KIND_DATASET_BLOBS = 'datasetblobs'
+
+
+def check_blob_store(storage, blob_store):
+    """
+    Checks that BLOBs aren't kept in Datastore when the rest of the data isn't
+
+    STORAGE_URL alone would otherwise still need Datastore credentials for every BLOB.
+
+    :raises: ValueError
+    """
+    if not isinstance(storage, DatastoreStorage) and isinstance(blob_store, DatastoreBlobBackend):
+        raise ValueError('STORAGE_URL without Datastore needs BLOB_STORE_URL too, e.g. file:///path')
+
+
+blob_store = get_blob_store()
+check_blob_store(storage, blob_store)
+# codec compressing BLOBs and descriptions on write, it's recorded with them so any registered codec can be read
+_DAO_CODEC = os.environ.get('DAO_CODEC', 'gzip')
+_DAO_CODEC_LEVEL = int(os.environ.get('DAO_CODEC_LEVEL', 6))
+# shorter descriptions are stored as they are, compression wouldn't make them smaller
+_COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 256))
+# bytes read at once from a stream being compressed
+_COMPRESS_READ_SIZE = 64 * 1024
+# names of indexes in 17ZSearch
+_SEARCH_INDEX_ALGORITHMS = 'algorithms'
+_SEARCH_INDEX_DATASETS = 'datasets'
+# maximum number of entities written by a single commit, the limit of Datastore
+_DATASTORE_MAX_BATCH = 500
+
+# threads running Datastore lookups concurrently with 17ZSearch lookups, per process
+_LOOKUP_WORKERS = int(os.environ.get('DAO_LOOKUP_WORKERS', 8))
+_lookup_executor = None
+_lookup_executor_pid = None
+_lookup_executor_lock = threading.Lock()
+# number of ids searched for with a single 17ZSearch query by batch lookups
+_BATCH_SEARCH_CHUNK = int(os.environ.get('BATCH_SEARCH_CHUNK', 20))
+
+# cache of single algorithm and dataset lookups, entries are merged index and data dicts
+_ITEM_CACHE_SIZE = int(os.environ.get('ITEM_CACHE_SIZE', 1000))
+_ITEM_CACHE_TTL = float(os.environ.get('ITEM_CACHE_TTL', 60))
+_shared_cache_backend = get_shared_backend()
+algorithm_cache = ReadThroughCache('algorithms', _ITEM_CACHE_SIZE, _ITEM_CACHE_TTL, _shared_cache_backend)
+dataset_cache = ReadThroughCache('datasets', _ITEM_CACHE_SIZE, _ITEM_CACHE_TTL, _shared_cache_backend)
+# cache of search results keyed on normalized tags, stale results are served while refreshed
+_SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 256))
+_SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 30))
+_SEARCH_CACHE_STALE_TTL = float(os.environ.get('SEARCH_CACHE_STALE_TTL', 300))
+# larger search results are not cached so that memory of a worker stays bounded
+_SEARCH_CACHE_MAX_ITEMS = int(os.environ.get('SEARCH_CACHE_MAX_ITEMS', 10000))
+algorithm_search_cache = SearchResultCache('algorithms-search', _SEARCH_CACHE_SIZE, _SEARCH_CACHE_TTL,
+                                           _SEARCH_CACHE_STALE_TTL, _shared_cache_backend)
+dataset_search_cache = SearchResultCache('datasets-search', _SEARCH_CACHE_SIZE, _SEARCH_CACHE_TTL,
+                                         _SEARCH_CACHE_STALE_TTL, _shared_cache_backend)
+
+
+def dispatch_index_updates(entries):
+    """
+    Applies index updates claimed from index_queue, concurrently as 17ZSearch has no batch API
+
+    Cached items and search results are invalidated once the updates are visible in 17ZSearch.
+    :param entries: list of IndexQueueEntry
+    :returns: list of HTTP status codes, None for connection errors
+    :rtype: list
+    """
+    def apply(entry):
+        url = get_search_url() + '/' + entry.kind + '/'
+        try:
+            if entry.action == ACTION_SET:
+                response = search_sessions.post(url, json=entry.document,
+                                                headers={'Content-Type': 'application/json; charset=utf-8'})
+            else:
+                response = search_sessions.delete(url + search_path(entry.item_id))
+        except SEARCH_CONNECTION_ERRORS:
+            return None
+        return response.status_code
+    statuses = list(get_lookup_executor().map(apply, entries))
+    item_caches = {_SEARCH_INDEX_ALGORITHMS: algorithm_cache, _SEARCH_INDEX_DATASETS: dataset_cache}
+    search_caches = {_SEARCH_INDEX_ALGORITHMS: algorithm_search_cache, _SEARCH_INDEX_DATASETS: dataset_search_cache}
+    for entry in entries:
+        item_caches[entry.kind].invalidate(entry.item_id)
+    for kind in set(entry.kind for entry in entries):
+        search_caches[kind].clear()
+    return statuses
+
+
+# index updates are written to 17ZSearch in background, writes wait only for Datastore
+index_queue = IndexQueue(dispatcher=dispatch_index_updates)
+os.register_at_fork(after_in_child=index_queue.reset)
+
+
+def pending_index(kind, item_id, idx):
+    """
+    Index dictionary of an item taking its update still waiting in index_queue into account
+
+    :param kind: name of the index
+    :type kind: str
+    :param item_id: id of the item
+    :type item_id: str
+    :param idx: index dictionary or error code returned by getindex
+    :returns: index dictionary or 1 - not found or 2 - Connection Error
+    """
+    try:
+        pending = index_queue.pending(kind, item_id)
+    except sqlite3.Error:
+        # writes report the queue as unavailable, reads fall back to the index
+        return idx
+    if pending is None:
+        return idx
+    action, document = pending
+    return document if action == ACTION_SET else 1
 
 
 def get_search_url():
@@ -25,16 +155,482 @@ def get_search_url():
     return url
 
 
+def normalize_tags(tags):
+    """
+    Normalizes coma delimited tags so that equivalent searches share a cache entry
+
+    Tags are joined with OR so their order, repetitions and spaces around them don't matter,
+    'a,b', 'b, a' and 'a,b,a' give ('a', 'b'). No tags at all give an empty tuple.
+
+    :param tags: coma delimited list of tags
+    :type tags: str
+    :rtype: tuple
+    """
+    if tags == '':
+        return ()
+    return tuple(sorted(set(tag.strip() for tag in tags.split(','))))
+
+
+def search_query(tags):
+    """
+    Query string of a 17ZSearch search for any of coma delimited tags
+
+    Tags come from clients, they are URL encoded so that e.g. & or # in them can't change the query.
+
+    :param tags: coma delimited list of tags, not empty
+    :type tags: str
+    :rtype: str
+    """
+    return '?query=' + quote(' OR '.join(tags.split(',')), safe='')
+
+
+def search_path(item_id):
+    """
+    Path segment of an item in a 17ZSearch index, URL encoded like search_query
+
+    :rtype: str
+    """
+    return quote(item_id, safe='')
+
+
+def fetch_index_multi(searchindex, getindex, id_field, item_ids):
+    """
+    Gets index data of many items from 17ZSearch in as few calls as possible
+
+    Ids are searched for in chunks with one OR query each, ids which the query didn't return
+    (e.g. tokenized differently by Full Text Search) are looked up one by one concurrently.
+
+    :param searchindex: uncached searchindex of a DAO
+    :param getindex: getindex of a DAO
+    :param id_field: name of the id field in index data, e.g. 'algorithmId'
+    :type id_field: str
+    :param item_ids: ids of items to be retrieved
+    :type item_ids: list
+    :returns: dictionary of found index dictionaries by id
+    :rtype: dict
+    """
+    found = {}
+    wanted = set(item_ids)
+    for start in range(0, len(item_ids), _BATCH_SEARCH_CHUNK):
+        results = []
+        if searchindex(results, ','.join(item_ids[start:start + _BATCH_SEARCH_CHUNK])) == 0:
+            for item in results:
+                if item.get(id_field) in wanted:
+                    found[item[id_field]] = item
+    missing = [item_id for item_id in item_ids if item_id not in found]
+    for item_id, idx in zip(missing, get_lookup_executor().map(getindex, missing)):
+        if idx not in [1, 2]:
+            found[item_id] = idx
+    return found
+
+
+def is_cacheable_search(value):
+    """
+    Checks if (result_code, found list, version) returned by a search may be cached
+
+    :rtype: bool
+    """
+    return value[0] == 0 and len(value[1]) <= _SEARCH_CACHE_MAX_ITEMS
+
+
+def listing_version(found):
+    """
+    Digest of search results identifying them in ETags of listings, it's computed once when they are cached
+
+    :param found: search results
+    :type found: list
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps(found, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def search_loader(searchindexuncached, tags):
+    """Returns function loading (result_code, found list, version) of a search to be cached"""
+    def search(key):
+        found = []
+        result_code = searchindexuncached(found, tags)
+        return result_code, found, listing_version(found) if result_code == 0 else None
+    return search
+
+
+def search_cached(search_cache, searchindexuncached, tags=''):
+    """
+    Search in 17ZSearch through the cache
+
+    :param search_cache: cache of results of the searched index
+    :type search_cache: SearchResultCache
+    :param searchindexuncached: searchindexuncached of a DAO
+    :param tags: coma delimited list of tags
+    :type tags: str
+    :returns: tuple (result_code, found list, version of found list or None), codes as returned by searchindex
+    :rtype: tuple
+    """
+    return search_cache.get_or_load(normalize_tags(tags), search_loader(searchindexuncached, tags),
+                                    is_cacheable_search)
+
+
+def _iter_search_response(response, search_cache, key, token):
+    """Yields items parsed incrementally from 17ZSearch response and caches them if there are not too many"""
+    collected = []
+    try:
+        for item in iter_json_array(response.raw):
+            if collected is not None:
+                collected.append(item)
+                if len(collected) > _SEARCH_CACHE_MAX_ITEMS:
+                    collected = None
+            yield item
+        if collected is not None:
+            search_cache.store(key, (0, collected, listing_version(collected)), is_cacheable_search, token)
+    except (JSONStreamError, HTTPError, OSError):
+        # status was already sent so the client gets truncated JSON which it can't parse
+        logging.exception('Search results from %s were broken while streaming', response.url)
+    finally:
+        response.close()
+
+
+def iter_search(url, search_cache, searchindexuncached, tags=''):
+    """
+    Search in 17ZSearch returning results as an iterator instead of a list
+
+    Cached results are iterated over directly, otherwise items are parsed from 17ZSearch response
+    while it's being read so the whole result set is never held in memory at once.
+
+    :param url: url of the searched index, e.g. get_search_url() + '/algorithms/'
+    :type url: str
+    :param search_cache: cache of results of that index
+    :type search_cache: SearchResultCache
+    :param searchindexuncached: searchindexuncached of a DAO used for background refresh
+    :param tags: coma delimited list of tags
+    :type tags: str
+    :returns: tuple (result_code, iterator, version), codes as returned by searchindex, version of results
+        as returned by listing_version is known only when they come from the cache, otherwise it's None
+    :rtype: tuple
+    """
+    key = normalize_tags(tags)
+    found, value, token = search_cache.lookup(key, search_loader(searchindexuncached, tags), is_cacheable_search)
+    if found:
+        return value[0], iter(value[1]), value[2]
+    if tags != '':
+        url += search_query(tags)
+    try:
+        response = search_sessions.get(url, stream=True)
+    except SEARCH_CONNECTION_ERRORS:
+        return 2, iter(()), None
+    if response.status_code != 200:
+        response.close()
+        # server error 500 and above
+        return (3 if response.status_code > 499 else 1), iter(()), None
+    response.raw.decode_content = True
+    return 0, _iter_search_response(response, search_cache, key, token), None
+
+
+def encode_cursor(offset):
+    """
+    Encodes position in search results as an opaque url safe cursor
+
+    :param offset: index of the first item of the next page
+    :type offset: int
+    :rtype: str
+    """
+    return base64.urlsafe_b64encode(('o:' + str(offset)).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes cursor made by encode_cursor
+
+    :param cursor: cursor from the previous page
+    :type cursor: str
+    :returns: offset or None if cursor is malformed
+    :rtype: int
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+    except (binascii.Error, ValueError):
+        return None
+    if not decoded.startswith('o:') or not decoded[2:].isdigit():
+        return None
+    return int(decoded[2:])
+
+
+def paginate(found_all, found_list, page, limit=None, cursor=None):
+    """
+    Writes a page of search results into found_list and its description into page
+
+    17ZSearch returns the whole result set, which is cached for the normalized tags, so pages
+    are sliced from it and the cursor is the position of the next page in that result set.
+
+    :param found_all: all search results
+    :type found_all: list
+    :param found_list: list to extend with the page
+    :type found_list: list
+    :param page: dictionary to update with totalCount, totalPages and nextCursor (None on the last page)
+    :type page: dict
+    :param limit: maximum number of items on a page, None means everything from cursor
+    :type limit: int
+    :param cursor: cursor from the previous page or None for the first page
+    :type cursor: str
+    :returns: 0 OK, 1 Malformed cursor
+    :rtype: int
+    """
+    offset = 0
+    if cursor is not None:
+        offset = decode_cursor(cursor)
+        if offset is None:
+            return 1
+    end = len(found_all) if limit is None else offset + limit
+    found_list.extend(found_all[offset:end])
+    page['totalCount'] = len(found_all)
+    if limit is None:
+        page['totalPages'] = 1
+    else:
+        page['totalPages'] = (len(found_all) + limit - 1) // limit
+    page['nextCursor'] = encode_cursor(end) if end < len(found_all) else None
+    return 0
+
+
+def get_lookup_executor():
+    """
+    Gets thread pool of the current process, a pool inherited through fork has no threads
+
+    :rtype: ThreadPoolExecutor
+    """
+    global _lookup_executor, _lookup_executor_pid
+    if _lookup_executor is None or _lookup_executor_pid != os.getpid():
+        with _lookup_executor_lock:
+            if _lookup_executor is None or _lookup_executor_pid != os.getpid():
+                _lookup_executor = ThreadPoolExecutor(max_workers=_LOOKUP_WORKERS, thread_name_prefix='dao-lookup')
+                _lookup_executor_pid = os.getpid()
+    return _lookup_executor
+
+
+def fetch_index_and_data(getindex, getdata, item_id):
+    """
+    Runs index lookup in 17ZSearch and data lookup in Datastore concurrently
+
+    Data lookup runs in the thread pool while index lookup runs in the calling thread
+    so a single item costs the slower of the two round trips instead of their sum.
+
+    :param getindex: function getting index dict of an item from 17ZSearch
+    :param getdata: function getting data dict of an item from Datastore
+    :param item_id: id of an item to be retrieved
+    :type item_id: str
+    :returns: tuple of results of getindex and getdata, getdata result is None when getindex failed
+    :rtype: tuple
+    """
+    data_future = get_lookup_executor().submit(getdata, item_id)
+    idx = getindex(item_id)
+    if idx in [1, 2]:
+        # index error is reported first anyway so there is no need to wait for Datastore
+        return idx, None
+    dat = data_future.result()
+    return idx, dat
+
+
+class IdentityCodec:
+    """Codec storing data as it is"""
+    name = 'identity'
+    # value of Content-Encoding header when encoded data is served as it's stored, None if it's not encoded
+    content_encoding = None
+
+    class _Passthrough:
+        def compress(self, data):
+            return data
+
+        def decompress(self, data):
+            return data
+
+        def flush(self):
+            return b''
+
+    def compressor(self):
+        return IdentityCodec._Passthrough()
+
+    def decompressor(self):
+        return IdentityCodec._Passthrough()
+
+
+class ZlibCodec:
+    """
+    DEFLATE compression with zlib
+
+    With gzip framing (wbits=31) stored data can be served directly with Content-Encoding: gzip,
+    with zlib framing (wbits=15) with Content-Encoding: deflate.
+    """
+
+    def __init__(self, name, wbits, content_encoding, level=_DAO_CODEC_LEVEL):
+        """
+        :param name: name recorded with encoded data
+        :type name: str
+        :param wbits: zlib wbits selecting framing of compressed data
+        :type wbits: int
+        :param content_encoding: HTTP content coding of compressed data
+        :type content_encoding: str
+        :param level: compression level 1-9
+        :type level: int
+        """
+        self.name = name
+        self.wbits = wbits
+        self.content_encoding = content_encoding
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+
+    def decompressor(self):
+        return zlib.decompressobj(self.wbits)
+
+
+_codecs = {}
+
+
+def register_codec(codec):
+    """
+    Makes a codec available for writing (DAO_CODEC=<name>) and for reading data written with it
+
+    :param codec: object with name, content_encoding, compressor() and decompressor(),
+        returning objects with compress(data)/decompress(data) and flush() like zlib ones
+    """
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    """
+    :param name: name of a registered codec
+    :type name: str
+    :raises: KeyError when there is no such codec
+    """
+    return _codecs[name]
+
+
+register_codec(IdentityCodec())
+register_codec(ZlibCodec('gzip', 31, 'gzip'))
+register_codec(ZlibCodec('zlib', 15, 'deflate'))
+
+
+def encode_bytes(codec, data):
+    compressor = codec.compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def decode_bytes(codec, data):
+    decompressor = codec.decompressor()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def iter_decoded(chunks, codec):
+    """
+    Yields decoded data of chunks encoded with a codec
+
+    :param chunks: iterator of encoded bytes
+    :param codec: codec or its name
+    """
+    if isinstance(codec, str):
+        codec = get_codec(codec)
+    decompressor = codec.decompressor()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+class EncodingStream:
+    """
+    Binary file-like object returning data of another stream encoded with a codec
+
+    Usage:
+    blob_store.write(kind, item_id, EncodingStream(request.stream, codec), codec.name)
+    """
+
+    def __init__(self, stream, codec, read_size=_COMPRESS_READ_SIZE):
+        self._stream = stream
+        self._compressor = codec.compressor()
+        self._read_size = read_size
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) < size) and not self._eof:
+            data = self._stream.read(self._read_size)
+            if data:
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class CompressedText:
+    """Text property read compressed from Datastore, it's decompressed only when it's used"""
+
+    def __init__(self, codec_name, data):
+        self.codec_name = codec_name
+        self.data = data
+
+    def decode(self):
+        return decode_bytes(get_codec(self.codec_name), self.data).decode('utf-8')
+
+
+def encode_text(text, codec_name=_DAO_CODEC):
+    """
+    Compresses text to be written to Datastore if it's long enough and compression makes it smaller
+
+    :returns: compressed bytes or text as it was
+    :rtype: bytes, str
+    """
+    if not isinstance(text, str) or len(text) < _COMPRESS_MIN_SIZE:
+        return text
+    raw = text.encode('utf-8')
+    data = encode_bytes(get_codec(codec_name), raw)
+    return data if len(data) < len(raw) else text
+
+
+def decode_text(value):
+    """Returns text of a property which may be CompressedText"""
+    if isinstance(value, CompressedText):
+        return value.decode()
+    return value
+
+
+def decode_properties(entity, names):
+    """
+    Replaces compressed properties of an entity read from Datastore with CompressedText
+
+    :param entity: entity or dictionary with an optional codec property, it's removed
+    :param names: names of properties which may be compressed
+    :returns: the same entity
+    """
+    codec_name = entity.pop('codec', IdentityCodec.name)
+    for name in names:
+        if isinstance(entity.get(name), bytes):
+            entity[name] = CompressedText(codec_name, entity[name])
+    return entity
+
+
+def write_blob(kind, item_id, stream):
+    """
+    Writes a BLOB read from a stream to the BLOB store compressed with DAO_CODEC
+
+    :raises: BlobStoreError
+    """
+    codec = get_codec(_DAO_CODEC)
+    return blob_store.write(kind, item_id, EncodingStream(stream, codec), codec.name)
+
+
 class User:
-    """ User class"""
-    _data = {
-        #      userID: string # google id_info['sub']
-        #      firstName: string
-        #       lastName: string
-        #       email: string
-        #       phone: string
-        #       userStatus: integer
-    }
+    """
+    User class
+
+    Fields live in slots of every instance, so objects built in concurrent requests don't share state
+    and take less memory than with a dictionary per instance.
+    """
+    __slots__ = ('user_id', 'first_name', 'last_name', 'email', 'phone', 'user_status', 'timestamp')
 
     def setuser_id(self, user_id):
         """
@@ -47,61 +643,80 @@ class User:
         :type user_id: str, int
         """
         if type(user_id) is str:
-            self._data['userID'] = user_id
+            self.user_id = user_id
         else:
-            self._data['userID'] = str(user_id)
+            self.user_id = str(user_id)
     
     def getuser_id(self):
-        return self._data['userID']
+        return self.user_id
 
     def setfirst_name(self, first_name):
-        self._data['firstName'] = first_name
+        self.first_name = first_name
 
     def getfirst_name(self):
-        return self._data['firstName']
+        return self.first_name
 
     def setlast_name(self, last_name):
-        self._data['lastName'] = last_name
+        self.last_name = last_name
 
     def getlast_name(self):
-        return self._data['lastName']
+        return self.last_name
 
     def setemail(self, email):
-        self._data['email'] = email
+        self.email = email
 
     def getemail(self):
-        return self._data['email']
+        return self.email
 
     def setphone(self, phone):
-        self._data['phone'] = phone
+        self.phone = phone
 
     def getphone(self):
-        return self._data['phone']
+        return self.phone
     
     def setuser_status(self, user_status):
-        self._data['userStatus'] = user_status
+        self.user_status = user_status
 
     def getuser_status(self):
-        return self._data['userStatus']
+        return self.user_status
+
+    def settimestamp(self, timestamp):
+        self.timestamp = timestamp
+
+    def gettimestamp(self):
+        """Time of the last write to Datastore, None for objects which weren't read from it"""
+        return self.timestamp
 
     def __init__(self, dict_data):
-        self.setuser_id(dict_data['userID'])
-        self.setfirst_name(dict_data['firstName'])
-        self.setlast_name(dict_data['lastName'])
-        self.setemail(dict_data['email'])
-        self.setphone(dict_data['phone'])
-        self.setuser_status(dict_data['userStatus'])
-        
-    def get_dict(self):
-        user_dict = {
-            'userID': self.getuser_id(),
-            'firstName': self.getfirst_name(),
-            'lastName': self.getlast_name(),
-            'email': self.getemail(),
-            'phone': self.getphone(),
-            'userStatus': self.getuser_status()
+        """
+        :param dict_data: user as sent by the API or read from Datastore
+        :type dict_data: dict
+        """
+        user_id = dict_data['userID']
+        self.user_id = user_id if type(user_id) is str else str(user_id)
+        self.first_name = dict_data['firstName']
+        self.last_name = dict_data['lastName']
+        self.email = dict_data['email']
+        self.phone = dict_data['phone']
+        self.user_status = dict_data['userStatus']
+        self.timestamp = dict_data.get('timestamp')
+
+    def to_dict(self):
+        """
+        :returns: user as sent by the API
+        :rtype: dict
+        """
+        return {
+            'userID': self.user_id,
+            'firstName': self.first_name,
+            'lastName': self.last_name,
+            'email': self.email,
+            'phone': self.phone,
+            'userStatus': self.user_status
         }
-        return user_dict
+
+    def get_dict(self):
+        return self.to_dict()
 
 
 # Data Access Object Interface for User
@@ -110,182 +725,243 @@ class UserDAO:
     @staticmethod
     def set(user):
         """
-        Writing user data to Datastore
+        Writing user data to storage
         :rtype : int
         """
-        ds = datastore.Client()
         try:
-            entity = datastore.Entity(key=ds.key(_DATASTORE_KIND_USERS, user.getuser_id()))
-            entity.update({
+            storage.put(_DATASTORE_KIND_USERS, user.getuser_id(), {
                 'firstName': user.getfirst_name(),
                 'lastName': user.getlast_name(),
                 'email': user.getemail(),
                 'phone': user.getphone(),
                 'userStatus': user.getuser_status(),
-                'timestamp': datetime.now()
+                'timestamp': datetime.now(timezone.utc)
             })
-            ds.put(entity)
-        except:
+        except StorageError:
             return 1
         return 0
 
     @staticmethod
     def get(user_id):
         """
-        Get a single algorithm data from Datastore
+        Get a single user data from storage
         :rtype : User
         """
-        ds = datastore.Client()
         try:
-            key = ds.key(_DATASTORE_KIND_USERS, user_id)
-            entity = ds.get(key)
-            entity.pop('timestamp')
-        except:
+            entity = storage.get(_DATASTORE_KIND_USERS, user_id)
+        except StorageError:
+            return 1
+        if entity is None:
             return 1
         entity['userID'] = user_id
         return User(entity)
 
 # Dataset class
 class Dataset:
-    _data = {
-        #    "dataset_id": "string",
-        #    "summary": "string",
-        #    "display_name": "string",
-        #    "link_url": "string",
-        #    "blob": "string",
-        #    "description": "string"
-    }
+    """
+    Dataset class
+
+    Fields live in slots of every instance, a compressed description is kept as CompressedText
+    and decompressed only when it's read.
+    """
+    __slots__ = ('dataset_id', 'summary', 'display_name', 'link_url', 'blob', 'description', 'timestamp')
 
     def setdataset_id(self, dataset_id):
-        self._data['dataset_id'] = dataset_id
+        self.dataset_id = dataset_id
 
     def getdataset_id(self):
-        return self._data['dataset_id']
+        return self.dataset_id
 
     def setsummary(self, summary):
-        self._data['summary'] = summary
+        self.summary = summary
 
     def getsummary(self):
-        return self._data['summary']
+        return self.summary
 
     def setdisplay_name(self, display_name):
-        self._data['display_name'] = display_name
+        self.display_name = display_name
 
     def getdisplay_name(self):
-        return self._data['display_name']
+        return self.display_name
 
     def setlink_url(self, link_url):
-        self._data['link_url'] = link_url
+        self.link_url = link_url
 
     def getlink_url(self):
-        return self._data['link_url']
+        return self.link_url
 
     def setblob(self, blob):
-        self._data['blob'] = blob
+        self.blob = blob
 
     def getblob(self):
-        return self._data['blob']
+        return self.blob
 
     def setdescription(self, description):
-        self._data['description'] = description
+        self.description = description
 
     def getdescription(self):
-        return self._data['description']
+        return decode_text(self.description)
 
-    def __init__(self, dict_data):
-        self.setdataset_id(dict_data['datasetId'])
-        self.setsummary(dict_data['datasetSummary'])
-        self.setdisplay_name(dict_data['displayName'])
-        self.setlink_url(dict_data['linkURL'])
-        self.setblob(dict_data['datasetBLOB'])
-        self.setdescription(dict_data['datasetDescription'])
+    def settimestamp(self, timestamp):
+        self.timestamp = timestamp
 
-    def get_dict(self):
-        dataset_dict = {
-            'datasetId': self.getdataset_id(),
-            'datasetSummary': self.getsummary(),
-            'displayName': self.getdisplay_name(),
-            'linkURL': self.getlink_url(),
-            'algorithmBLOB': self.getblob(),
-            'algorithmDescription': self.getdescription()
-        }
-        return dataset_dict
+    def gettimestamp(self):
+        """Time of the last write to Datastore, None for objects which weren't read from it"""
+        return self.timestamp
+
+    def __init__(self, dict_data):
+        """
+        :param dict_data: dataset as sent by the API or merged from 17ZSearch and Datastore
+        :type dict_data: dict
+        """
+        self.dataset_id = dict_data['datasetId']
+        self.summary = dict_data['datasetSummary']
+        self.display_name = dict_data['displayName']
+        self.link_url = dict_data['linkURL']
+        self.blob = dict_data['datasetBLOB']
+        self.description = dict_data['datasetDescription']
+        self.timestamp = dict_data.get('timestamp')
+
+    def to_dict(self, fields=None):
+        """
+        :param fields: keys to be returned, all of them by default, a compressed description is decompressed
+            only if it's returned
+        :type fields: list
+        :rtype: dict
+        """
+        if fields is None:
+            return {
+                'datasetId': self.dataset_id,
+                'datasetSummary': self.summary,
+                'displayName': self.display_name,
+                'linkURL': self.link_url,
+                'datasetBLOB': self.blob,
+                'datasetDescription': decode_text(self.description)
+            }
+        return {field: _DATASET_GETTERS[field](self) for field in fields}
+
+    def get_dict(self, fields=None):
+        return self.to_dict(fields)
+
+
+# readers of Dataset fields by their names in the API
+_DATASET_GETTERS = {
+    'datasetId': Dataset.getdataset_id,
+    'datasetSummary': Dataset.getsummary,
+    'displayName': Dataset.getdisplay_name,
+    'linkURL': Dataset.getlink_url,
+    'datasetBLOB': Dataset.getblob,
+    'datasetDescription': Dataset.getdescription
+}
 
 
 # Algorithm class
 class Algorithm:
-    _data = {
-        #    "algorithm_id": "string",
-        #    "summary": "string",
-        #    "display_name": "string",
-        #    "link_url": "string",
-        #    "blob": "string",
-        #    "description": "string",
-        #    "dataset_description": "string",
-    }
+    """
+    Algorithm class
+
+    Fields live in slots of every instance, compressed descriptions are kept as CompressedText
+    and decompressed only when they're read.
+    """
+    __slots__ = ('algorithm_id', 'summary', 'display_name', 'link_url', 'blob', 'description',
+                 'dataset_description', 'timestamp')
 
     def setalgorithm_id(self, algorithm_id):
-        self._data['algorithm_id'] = algorithm_id
+        self.algorithm_id = algorithm_id
 
     def getalgorithm_id(self):
-        return self._data['algorithm_id']
+        return self.algorithm_id
 
     def setsummary(self, summary):
-        self._data['summary'] = summary
+        self.summary = summary
 
     def getsummary(self):
-        return self._data['summary']
+        return self.summary
 
     def setdisplay_name(self, display_name):
-        self._data['display_name'] = display_name
+        self.display_name = display_name
 
     def getdisplay_name(self):
-        return self._data['display_name']
+        return self.display_name
 
     def setlink_url(self, link_url):
-        self._data['link_url'] = link_url
+        self.link_url = link_url
 
     def getlink_url(self):
-        return self._data['link_url']
+        return self.link_url
 
     def setblob(self, blob):
-        self._data['blob'] = blob
+        self.blob = blob
 
     def getblob(self):
-        return self._data['blob']
+        return self.blob
 
     def setdescription(self, description):
-        self._data['description'] = description
+        self.description = description
 
     def getdescription(self):
-        return self._data['description']
+        return decode_text(self.description)
 
     def setdataset_description(self, dataset_description):
-        self._data['dataset_description'] = dataset_description
+        self.dataset_description = dataset_description
 
     def getdataset_description(self):
-        return self._data['dataset_description']
+        return decode_text(self.dataset_description)
 
-    def __init__(self, dict_data):
-        self.setalgorithm_id(dict_data['algorithmId'])
-        self.setsummary(dict_data['algorithmSummary'])
-        self.setdisplay_name(dict_data['displayName'])
-        self.setlink_url(dict_data['linkURL'])
-        self.setblob(dict_data['algorithmBLOB'])
-        self.setdescription(dict_data['algorithmDescription'])
-        self.setdataset_description(dict_data['datasetDescription'])
+    def settimestamp(self, timestamp):
+        self.timestamp = timestamp
 
-    def get_dict(self):
-        algorithm_dict = {
-            'algorithmId': self.getalgorithm_id(),
-            'algorithmSummary': self.getsummary(),
-            'displayName': self.getdisplay_name(),
-            'linkURL': self.getlink_url(),
-            'algorithmBLOB': self.getblob(),
-            'algorithmDescription': self.getdescription(),
-            'datasetDescription': self.getdataset_description()
-        }
-        return algorithm_dict
+    def gettimestamp(self):
+        """Time of the last write to Datastore, None for objects which weren't read from it"""
+        return self.timestamp
+
+    def __init__(self, dict_data):
+        """
+        :param dict_data: algorithm as sent by the API or merged from 17ZSearch and Datastore
+        :type dict_data: dict
+        """
+        self.algorithm_id = dict_data['algorithmId']
+        self.summary = dict_data['algorithmSummary']
+        self.display_name = dict_data['displayName']
+        self.link_url = dict_data['linkURL']
+        self.blob = dict_data['algorithmBLOB']
+        self.description = dict_data['algorithmDescription']
+        self.dataset_description = dict_data['datasetDescription']
+        self.timestamp = dict_data.get('timestamp')
+
+    def to_dict(self, fields=None):
+        """
+        :param fields: keys to be returned, all of them by default, a compressed description is decompressed
+            only if it's returned
+        :type fields: list
+        :rtype: dict
+        """
+        if fields is None:
+            return {
+                'algorithmId': self.algorithm_id,
+                'algorithmSummary': self.summary,
+                'displayName': self.display_name,
+                'linkURL': self.link_url,
+                'algorithmBLOB': self.blob,
+                'algorithmDescription': decode_text(self.description),
+                'datasetDescription': decode_text(self.dataset_description)
+            }
+        return {field: _ALGORITHM_GETTERS[field](self) for field in fields}
+
+    def get_dict(self, fields=None):
+        return self.to_dict(fields)
+
+
+# readers of Algorithm fields by their names in the API
+_ALGORITHM_GETTERS = {
+    'algorithmId': Algorithm.getalgorithm_id,
+    'algorithmSummary': Algorithm.getsummary,
+    'displayName': Algorithm.getdisplay_name,
+    'linkURL': Algorithm.getlink_url,
+    'algorithmBLOB': Algorithm.getblob,
+    'algorithmDescription': Algorithm.getdescription,
+    'datasetDescription': Algorithm.getdataset_description
+}
 
 
 class AlgorithmDAO:
@@ -294,6 +970,21 @@ class AlgorithmDAO:
 
     aaa
     """
+    # long texts aren't searched, Datastore doesn't index them
+    unindexed = ('algorithmDescription', 'datasetDescription')
+
+    @staticmethod
+    def toindex(algorithm):
+        """
+        Creates index document of algorithm written to Full Text Search
+
+        :rtype: dict
+        """
+        index_data = {"algorithmId": algorithm.getalgorithm_id(),
+                      "algorithmSummary": algorithm.getsummary(),
+                      "displayName": algorithm.getdisplay_name(),
+                      "linkURL": algorithm.getlink_url()}
+        return index_data
 
     @staticmethod
     def setindex(algorithm):
@@ -306,18 +997,31 @@ class AlgorithmDAO:
         :rtype: int
         """
         url = get_search_url() + '/algorithms/'
-        index_data = {"algorithmId": algorithm.getalgorithm_id(),
-                      "algorithmSummary": algorithm.getsummary(),
-                      "displayName": algorithm.getdisplay_name(),
-                      "linkURL": algorithm.getlink_url()}
+        index_data = AlgorithmDAO.toindex(algorithm)
         try:
-            response = requests.post(url, json=index_data, headers={'Content-Type': 'application/json; charset=utf-8'})
-        except requests.ConnectionError:
+            response = search_sessions.post(url, json=index_data, headers={'Content-Type': 'application/json; charset=utf-8'})
+        except SEARCH_CONNECTION_ERRORS:
             return 2
         if response.status_code != 200:
             return 1
         return 0
 
+    @staticmethod
+    def toentity(algorithm):
+        """
+        Creates properties of algorithm entity with data other than BLOB, long descriptions are compressed
+
+        :param algorithm: an algorithm to be written
+        :type algorithm: Algorithm
+        :rtype: dict
+        """
+        return {
+            'algorithmDescription': encode_text(algorithm.getdescription()),
+            'datasetDescription': encode_text(algorithm.getdataset_description()),
+            'codec': _DAO_CODEC,
+            'timestamp': datetime.now(timezone.utc)
+        }
+
     @staticmethod
     def setdata(algorithm):
         """
@@ -328,41 +1032,148 @@ class AlgorithmDAO:
         :returns: 1 - Error, 0 - EOK
         :rtype: int
         """
-        ds = datastore.Client()
         try:
-            entity = datastore.Entity(key=ds.key(_DATASTORE_KIND_ALGORITHMS, algorithm.getalgorithm_id()))
-            entity.update({
-                'algorithmBLOB': algorithm.getblob(),
-                'algorithmDescription': algorithm.getdescription(),
-                'datasetDescription': algorithm.getdataset_description(),
-                'timestamp': datetime.now()
-            })
-            ds.put(entity)
-        except:
+            # BLOB goes first so that a new timestamp never comes with the previous BLOB
+            write_blob(_DATASTORE_KIND_ALGORITHM_BLOBS, algorithm.getalgorithm_id(), io.BytesIO((algorithm.getblob() or '').encode('utf-8')))
+            storage.put(_DATASTORE_KIND_ALGORITHMS, algorithm.getalgorithm_id(), AlgorithmDAO.toentity(algorithm), AlgorithmDAO.unindexed)
+        except (StorageError, BlobStoreError):
             return 1
         return 0
 
     @staticmethod
     def set(algorithm):
         """
-        Writing the whole algorithm partly to index in Full Text Search and mainly to Datastore
+        Writing the whole algorithm mainly to Datastore and partly, through index_queue, to index in Full Text Search
+
+        Index is written in background, so the algorithm shows up in searches a moment later, get sees it at once.
 
         :param algorithm: an algorithm to be written
         :type algorithm: Algorithm
-        :returns: 0 - EOK, first digit Datastore error code, second digit search GAE error code
+        :returns: 0 - EOK, first digit Datastore error code, second digit 1 - index update not enqueued
+            or 2 - not attempted
         :rtype: int
-
-        .. todo:: set digits according to returns description
         """
-        idx = AlgorithmDAO.setindex(algorithm)
-        if idx == 0:
-            dat = AlgorithmDAO.setdata(algorithm)
-        else:
-            dat = 2
+        dat = AlgorithmDAO.setdata(algorithm)
+        idx = AlgorithmDAO.enqueueindex([algorithm]) if dat == 0 else 2
+        algorithm_cache.invalidate(algorithm.getalgorithm_id())
+        algorithm_search_cache.clear()
         return 10 * dat + idx
 
+    @staticmethod
+    def enqueueindex(algorithms):
+        """
+        Enqueue index updates of algorithms to be written to Full Text Search in background
+
+        :param algorithms: algorithms whose data is already in Datastore
+        :type algorithms: list
+        :returns: 1 - Error, 0 - EOK
+        :rtype: int
+        """
+        try:
+            index_queue.enqueue_many([(_SEARCH_INDEX_ALGORITHMS, algorithm.getalgorithm_id(), ACTION_SET, AlgorithmDAO.toindex(algorithm))
+                                      for algorithm in algorithms])
+        except sqlite3.Error:
+            logging.exception('Index updates were not enqueued')
+            return 1
+        return 0
+
+    @staticmethod
+    def setdatamulti(algorithms):
+        """
+        Writing main blob data of many algorithms to Datastore with put_multi in chunks
+
+        Every chunk is a separate commit, so a failed chunk doesn't undo the ones written before it.
+        Entities of algorithms whose BLOB was not written are not written either.
+
+        :param algorithms: algorithms to be written
+        :type algorithms: list
+        :returns: list of codes in order of algorithms, 1 - Error, 0 - EOK
+        :rtype: list
+        """
+        def writeblob(algorithm):
+            try:
+                write_blob(_DATASTORE_KIND_ALGORITHM_BLOBS, algorithm.getalgorithm_id(), io.BytesIO((algorithm.getblob() or '').encode('utf-8')))
+            except BlobStoreError:
+                return 1
+            return 0
+
+        codes = list(get_lookup_executor().map(writeblob, algorithms))
+        items = [(position, algorithm.getalgorithm_id(), AlgorithmDAO.toentity(algorithm))
+                 for position, algorithm in enumerate(algorithms) if codes[position] == 0]
+        for start in range(0, len(items), _DATASTORE_MAX_BATCH):
+            chunk = items[start:start + _DATASTORE_MAX_BATCH]
+            try:
+                storage.put_multi(_DATASTORE_KIND_ALGORITHMS, [(name, entity) for position, name, entity in chunk], AlgorithmDAO.unindexed)
+            except StorageError:
+                for position, name, entity in chunk:
+                    codes[position] = 1
+        return codes
+
+    @staticmethod
+    def setmulti(algorithms):
+        """
+        Writing many items, data with put_multi to Datastore and then index updates to index_queue at once
+
+        Index updates are enqueued for all algorithms whose data was written, even when other chunks failed.
+
+        :param algorithms: algorithms to be written
+        :type algorithms: list
+        :returns: list of codes as returned by set for every algorithm
+        :rtype: list
+        """
+        codes = AlgorithmDAO.setdatamulti(algorithms)
+        written = [algorithm for algorithm, dat in zip(algorithms, codes) if dat == 0]
+        idx = AlgorithmDAO.enqueueindex(written) if written else 0
+        for algorithm in algorithms:
+            algorithm_cache.invalidate(algorithm.getalgorithm_id())
+        algorithm_search_cache.clear()
+        return [10 * dat + (idx if dat == 0 else 2) for dat in codes]
+
     @staticmethod
     def searchindex(found_algorithms_list, tags=''):
+        """
+        Search for algorithms in index from Full Text Search through the cache and write into found_algorithms_list
+
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri, 2 Connection error, 3 Application or server error
+        """
+        result_code, found, version = search_cached(algorithm_search_cache, AlgorithmDAO.searchindexuncached, tags)
+        found_algorithms_list.extend(found)
+        return result_code
+
+    @staticmethod
+    def searchindexiter(tags=''):
+        """
+        Search for algorithms in index from Full Text Search without materializing the whole result
+
+        :rtype : tuple
+        :returns: tuple (result_code, iterator of algorithm index dictionaries, version or None),
+            result_code 0 OK, 1 Malformed query in uri, 2 Connection error, 3 Application or server error
+        """
+        return iter_search(get_search_url() + '/algorithms/', algorithm_search_cache, AlgorithmDAO.searchindexuncached, tags)
+
+    @staticmethod
+    def searchindexpage(found_algorithms_list, page, tags='', limit=None, cursor=None):
+        """
+        Search for a page of algorithms in index from Full Text Search and write it into found_algorithms_list
+
+        :param page: dictionary updated with totalCount, totalPages, nextCursor and version of all results
+        :type page: dict
+        :param limit: maximum number of algorithms on a page, None means all of them
+        :type limit: int
+        :param cursor: nextCursor of the previous page or None for the first page
+        :type cursor: str
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri or cursor, 2 Connection error, 3 Application or server error
+        """
+        result_code, found_all, page['version'] = search_cached(algorithm_search_cache, AlgorithmDAO.searchindexuncached,
+                                                               tags)
+        if result_code != 0:
+            return result_code
+        return paginate(found_all, found_algorithms_list, page, limit, cursor)
+
+    @staticmethod
+    def searchindexuncached(found_algorithms_list, tags=''):
         """
         Search for algorithms in index from Full Text Search and write into found_algorithms_list
 
@@ -371,11 +1182,10 @@ class AlgorithmDAO:
         """
         url = get_search_url() + '/algorithms/'
         if tags != '':
-            query_string = ' OR '.join(tags.split(','))
-            url += '?query=' + query_string
+            url += search_query(tags)
         try:
-            response_from_url = requests.get(url)
-        except requests.ConnectionError:
+            response_from_url = search_sessions.get(url)
+        except SEARCH_CONNECTION_ERRORS:
             return 2
         if response_from_url.status_code > 499:
             # server error 500 and above
@@ -401,10 +1211,10 @@ class AlgorithmDAO:
         :rtype : dict
         :returns: dictionary of a single algorithm index
         """
-        url = get_search_url() + '/algorithms/' + algorithm_id
+        url = get_search_url() + '/algorithms/' + search_path(algorithm_id)
         try:
-            response_from_url = requests.get(url)
-        except requests.ConnectionError:
+            response_from_url = search_sessions.get(url)
+        except SEARCH_CONNECTION_ERRORS:
             return 2
         if response_from_url.status_code != 200:
             return 1
@@ -418,52 +1228,262 @@ class AlgorithmDAO:
 
         :param algorithm_id: id of an algorithm to be retrieved
         :type algorithm_id: str
-        :returns: dictionary of a single algorithm data or 1 - Error
+        :returns: dictionary of a single algorithm data with timestamp of the last write or 1 - Error
         :rtype : dict, int
         """
-        ds = datastore.Client()
         try:
-            key = ds.key(_DATASTORE_KIND_ALGORITHMS, algorithm_id)
-            entity = ds.get(key)
-            entity.pop('timestamp')
-        except:
+            entity = storage.get(_DATASTORE_KIND_ALGORITHMS, algorithm_id)
+        except StorageError:
+            return 1
+        if entity is None:
             return 1
-        return entity
+        # entities written before BLOBs got their own kind still have it inline
+        entity.pop('algorithmBLOB', None)
+        return decode_properties(entity, ('algorithmDescription', 'datasetDescription'))
 
     @staticmethod
-    def get(algorithm_id):
+    def getlegacyblob(algorithm_id):
         """
-        Get specific algorithm data
+        Get BLOB of an algorithm written inline in its Datastore entity before BLOBs got their own store
+
+        :returns: BLOB or 1 - not found or Error
+        :rtype : str, int
+        """
+        try:
+            entity = storage.get(_DATASTORE_KIND_ALGORITHMS, algorithm_id)
+        except StorageError:
+            return 1
+        if entity is None or 'algorithmBLOB' not in entity:
+            return 1
+        return entity['algorithmBLOB']
+
+    @staticmethod
+    def getblob(algorithm_id):
+        """
+        Get the whole BLOB of a single algorithm from the BLOB store
 
         :param algorithm_id: id of an algorithm to be retrieved
         :type algorithm_id: str
-        :returns: Algorithm object or 1 - GAE search Error or 2 - Datastore Error
-        :rtype : Algorithm, int
+        :returns: BLOB or 1 - Error
+        :rtype : str, int
+        """
+        try:
+            reader = blob_store.open(_DATASTORE_KIND_ALGORITHM_BLOBS, algorithm_id)
+            blob = b''.join(iter_decoded(reader, reader.codec))
+        except BlobNotFoundError:
+            return AlgorithmDAO.getlegacyblob(algorithm_id)
+        except (BlobStoreError, KeyError, zlib.error):
+            return 1
+        # BLOBs uploaded as raw bytes may not be utf-8 text
+        return blob.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def openblob(algorithm_id):
+        """
+        Open BLOB of a single algorithm for streaming, chunks are read as the returned reader is iterated over
+
+        :param algorithm_id: id of an algorithm
+        :type algorithm_id: str
+        :returns: BlobReader or 1 - not found or 2 - Error
+        :rtype : BlobReader, int
+        """
+        try:
+            return blob_store.open(_DATASTORE_KIND_ALGORITHM_BLOBS, algorithm_id)
+        except BlobNotFoundError:
+            pass
+        except BlobStoreError:
+            return 2
+        blob = AlgorithmDAO.getlegacyblob(algorithm_id)
+        if blob == 1 or blob is None:
+            return 1
+        blob = blob.encode('utf-8')
+        return BlobReader(len(blob), iter([blob]))
+
+    @staticmethod
+    def writeblob(algorithm_id, stream):
+        """
+        Write BLOB of a single algorithm read from a stream chunk by chunk, replacing the previous one
+
+        :param algorithm_id: id of an algorithm
+        :type algorithm_id: str
+        :param stream: binary file-like object with read(size)
+        :returns: 0 - EOK or 2 - Error
+        :rtype : int
+        """
+        try:
+            write_blob(_DATASTORE_KIND_ALGORITHM_BLOBS, algorithm_id, stream)
+        except BlobStoreError:
+            return 2
+        if AlgorithmDAO.touchdata(algorithm_id) != 0:
+            return 2
+        return 0
+
+    @staticmethod
+    def touchdata(algorithm_id):
+        """
+        Set timestamp of algorithm data in Datastore to now so that ETags of the algorithm change
+
+        :param algorithm_id: id of the algorithm
+        :type algorithm_id: str
+        :returns: 1 - Error, 0 - EOK
+        :rtype : int
+        """
+        try:
+            if not storage.update(_DATASTORE_KIND_ALGORITHMS, algorithm_id, {'timestamp': datetime.now(timezone.utc)}):
+                return 1
+        except StorageError:
+            return 1
+        finally:
+            algorithm_cache.invalidate(algorithm_id)
+        return 0
+
+    @staticmethod
+    def getindexmulti(algorithm_ids):
+        """
+        Get index data of many algorithms from GAE Search
+
+        :param algorithm_ids: ids of algorithms to be retrieved
+        :type algorithm_ids: list
+        :returns: dictionary of found algorithm indexes by algorithmId
+        :rtype: dict
+        """
+        return fetch_index_multi(AlgorithmDAO.searchindexuncached, AlgorithmDAO.getindex, 'algorithmId', algorithm_ids)
+
+    @staticmethod
+    def getdatamulti(algorithm_ids):
+        """
+        Get data of many algorithms from Datastore in a single get_multi round trip
+
+        :param algorithm_ids: ids of algorithms to be retrieved
+        :type algorithm_ids: list
+        :returns: dictionary of found algorithm data, the same as of getdata, by algorithmId or 1 - Error
+        :rtype : dict, int
+        """
+        try:
+            entities = storage.get_multi(_DATASTORE_KIND_ALGORITHMS, algorithm_ids)
+        except StorageError:
+            return 1
+        found = {}
+        for algorithm_id, entity in entities.items():
+            entity.pop('algorithmBLOB', None)
+            found[algorithm_id] = decode_properties(entity, ('algorithmDescription', 'datasetDescription'))
+        return found
+
+    @staticmethod
+    def getmulti(algorithm_ids):
+        """
+        Get data of many algorithms with one Datastore round trip and as few GAE search calls as possible
+
+        :param algorithm_ids: ids of algorithms to be retrieved
+        :type algorithm_ids: list
+        :returns: dictionary by algorithmId of merged index and data dictionaries without BLOB or 1 - not found in GAE search
+            or 2 - not found in Datastore, or 2 - Datastore Error
+        :rtype : dict, int
         """
-        idx = AlgorithmDAO.getindex(algorithm_id)
+        idx, dat = fetch_index_and_data(AlgorithmDAO.getindexmulti, AlgorithmDAO.getdatamulti, algorithm_ids)
+        if dat == 1:
+            return 2
+        found = {}
+        for algorithm_id in algorithm_ids:
+            if algorithm_id not in idx:
+                found[algorithm_id] = 1
+            elif algorithm_id not in dat:
+                found[algorithm_id] = 2
+            else:
+                merged = dict(idx[algorithm_id])
+                merged.update(dat[algorithm_id])
+                merged['algorithmBLOB'] = None
+                found[algorithm_id] = merged
+        return found
+
+    @staticmethod
+    def getuncached(algorithm_id):
+        """
+        Get specific algorithm data from 17ZSearch and Datastore bypassing the cache
+
+        :param algorithm_id: id of an algorithm to be retrieved
+        :type algorithm_id: str
+        :returns: merged index and data dictionary or 1 - GAE search Error or 2 - Datastore Error
+        :rtype : dict, int
+        """
+        idx, dat = fetch_index_and_data(AlgorithmDAO.getindex, AlgorithmDAO.getdata, algorithm_id)
+        idx = pending_index(_SEARCH_INDEX_ALGORITHMS, algorithm_id, idx)
         if idx in [1, 2]:
             return 1
-        dat = AlgorithmDAO.getdata(algorithm_id)
         if dat == 1:
             return 2
         idx.update(dat)
-        found_algorithm = Algorithm(idx)
+        return idx
+
+    @staticmethod
+    def get(algorithm_id, with_blob=False):
+        """
+        Get specific algorithm data
+
+        Metadata comes from the cache, BLOB is never cached and it's loaded only when asked for.
+
+        :param algorithm_id: id of an algorithm to be retrieved
+        :type algorithm_id: str
+        :param with_blob: load BLOB too, otherwise it's None
+        :type with_blob: bool
+        :returns: Algorithm object or 1 - GAE search Error or 2 - Datastore Error
+        :rtype : Algorithm, int
+        """
+        if with_blob:
+            blob_future = get_lookup_executor().submit(AlgorithmDAO.getblob, algorithm_id)
+        found = algorithm_cache.get_or_load(algorithm_id, AlgorithmDAO.getuncached, lambda value: value not in [1, 2])
+        if found in [1, 2]:
+            return found
+        blob = blob_future.result() if with_blob else None
+        if blob == 1:
+            return 2
+        found = dict(found)
+        found['algorithmBLOB'] = blob
+        found_algorithm = Algorithm(found)
         return found_algorithm
 
     @staticmethod
     def delete(algorithm_id):
-        url = get_search_url() + '/algorithms/' + algorithm_id
+        """
+        Delete algorithm from index in Full Text Search, the deletion is written in background through index_queue
+
+        :param algorithm_id: id of an algorithm to be deleted
+        :type algorithm_id: str
+        :returns: 0 - EOK, 1 - not found, 2 - Error
+        :rtype: int
+        """
         try:
-            response_from_url = requests.delete(url)
-        except requests.ConnectionError:
+            idx = pending_index(_SEARCH_INDEX_ALGORITHMS, algorithm_id, AlgorithmDAO.getindex(algorithm_id))
+            if idx in [1, 2]:
+                return idx
+            index_queue.enqueue(_SEARCH_INDEX_ALGORITHMS, algorithm_id, ACTION_DELETE)
+        except sqlite3.Error:
+            logging.exception('Index update was not enqueued')
             return 2
-        if response_from_url.status_code != 200:
-            return 1
+        finally:
+            algorithm_cache.invalidate(algorithm_id)
+            algorithm_search_cache.clear()
+        return 0
 
 class DatasetDAO:
     """
     Data Access Object Interface for Dataset
     """
+    # long texts aren't searched, Datastore doesn't index them
+    unindexed = ('datasetDescription',)
+
+    @staticmethod
+    def toindex(dataset):
+        """
+        Creates index document of dataset written to Full Text Search
+
+        :rtype: dict
+        """
+        index_data = {"datasetId": dataset.getdataset_id(),
+                      "datasetSummary": dataset.getsummary(),
+                      "displayName": dataset.getdisplay_name(),
+                      "linkURL": dataset.getlink_url()}
+        return index_data
 
     @staticmethod
     def setindex(dataset):
@@ -476,18 +1496,30 @@ class DatasetDAO:
         :rtype: int
         """
         url = get_search_url() + '/datasets/'
-        index_data = {"datasetId": dataset.getdataset_id(),
-                      "datasetSummary": dataset.getsummary(),
-                      "displayName": dataset.getdisplay_name(),
-                      "linkURL": dataset.getlink_url()}
+        index_data = DatasetDAO.toindex(dataset)
         try:
-            response = requests.post(url, json=index_data, headers={'Content-Type': 'application/json; charset=utf-8'})
-        except requests.ConnectionError:
+            response = search_sessions.post(url, json=index_data, headers={'Content-Type': 'application/json; charset=utf-8'})
+        except SEARCH_CONNECTION_ERRORS:
             return 2
         if response.status_code != 200:
             return 1
         return 0
 
+    @staticmethod
+    def toentity(dataset):
+        """
+        Creates properties of dataset entity with data other than BLOB, long descriptions are compressed
+
+        :param dataset: a dataset to be written
+        :type dataset: Dataset
+        :rtype: dict
+        """
+        return {
+            'datasetDescription': encode_text(dataset.getdescription()),
+            'codec': _DAO_CODEC,
+            'timestamp': datetime.now(timezone.utc)
+        }
+
     @staticmethod
     def setdata(dataset):
         """
@@ -498,40 +1530,148 @@ class DatasetDAO:
         :returns: 1 - Error, 0 - EOK
         :rtype: int
         """
-        ds = datastore.Client()
         try:
-            entity = datastore.Entity(key=ds.key(_DATASTORE_KIND_DATASETS, dataset.getdataset_id()))
-            entity.update({
-                'datasetBLOB': dataset.getblob(),
-                'datasetDescription': dataset.getdescription(),
-                'timestamp': datetime.now()
-            })
-            ds.put(entity)
-        except:
+            # BLOB goes first so that a new timestamp never comes with the previous BLOB
+            write_blob(_DATASTORE_KIND_DATASET_BLOBS, dataset.getdataset_id(), io.BytesIO((dataset.getblob() or '').encode('utf-8')))
+            storage.put(_DATASTORE_KIND_DATASETS, dataset.getdataset_id(), DatasetDAO.toentity(dataset), DatasetDAO.unindexed)
+        except (StorageError, BlobStoreError):
             return 1
         return 0
 
     @staticmethod
     def set(dataset):
         """
-        Writing the whole dataset partly to index in Full Text Search and mainly to Datastore
+        Writing the whole dataset mainly to Datastore and partly, through index_queue, to index in Full Text Search
+
+        Index is written in background, so the dataset shows up in searches a moment later, get sees it at once.
 
         :param dataset: a dataset to be written
         :type dataset: Dataset
-        :returns: 0 - EOK, first digit Datastore error code, second digit search GAE error code
+        :returns: 0 - EOK, first digit Datastore error code, second digit 1 - index update not enqueued
+            or 2 - not attempted
         :rtype: int
-
-        .. todo:: set digits according to returns description
         """
-        idx = DatasetDAO.setindex(dataset)
-        if idx == 0:
-            dat = DatasetDAO.setdata(dataset)
-        else:
-            dat = 2
+        dat = DatasetDAO.setdata(dataset)
+        idx = DatasetDAO.enqueueindex([dataset]) if dat == 0 else 2
+        dataset_cache.invalidate(dataset.getdataset_id())
+        dataset_search_cache.clear()
         return 10 * dat + idx
 
+    @staticmethod
+    def enqueueindex(datasets):
+        """
+        Enqueue index updates of datasets to be written to Full Text Search in background
+
+        :param datasets: datasets whose data is already in Datastore
+        :type datasets: list
+        :returns: 1 - Error, 0 - EOK
+        :rtype: int
+        """
+        try:
+            index_queue.enqueue_many([(_SEARCH_INDEX_DATASETS, dataset.getdataset_id(), ACTION_SET, DatasetDAO.toindex(dataset))
+                                      for dataset in datasets])
+        except sqlite3.Error:
+            logging.exception('Index updates were not enqueued')
+            return 1
+        return 0
+
+    @staticmethod
+    def setdatamulti(datasets):
+        """
+        Writing main blob data of many datasets to Datastore with put_multi in chunks
+
+        Every chunk is a separate commit, so a failed chunk doesn't undo the ones written before it.
+        Entities of datasets whose BLOB was not written are not written either.
+
+        :param datasets: datasets to be written
+        :type datasets: list
+        :returns: list of codes in order of datasets, 1 - Error, 0 - EOK
+        :rtype: list
+        """
+        def writeblob(dataset):
+            try:
+                write_blob(_DATASTORE_KIND_DATASET_BLOBS, dataset.getdataset_id(), io.BytesIO((dataset.getblob() or '').encode('utf-8')))
+            except BlobStoreError:
+                return 1
+            return 0
+
+        codes = list(get_lookup_executor().map(writeblob, datasets))
+        items = [(position, dataset.getdataset_id(), DatasetDAO.toentity(dataset))
+                 for position, dataset in enumerate(datasets) if codes[position] == 0]
+        for start in range(0, len(items), _DATASTORE_MAX_BATCH):
+            chunk = items[start:start + _DATASTORE_MAX_BATCH]
+            try:
+                storage.put_multi(_DATASTORE_KIND_DATASETS, [(name, entity) for position, name, entity in chunk], DatasetDAO.unindexed)
+            except StorageError:
+                for position, name, entity in chunk:
+                    codes[position] = 1
+        return codes
+
+    @staticmethod
+    def setmulti(datasets):
+        """
+        Writing many items, data with put_multi to Datastore and then index updates to index_queue at once
+
+        Index updates are enqueued for all datasets whose data was written, even when other chunks failed.
+
+        :param datasets: datasets to be written
+        :type datasets: list
+        :returns: list of codes as returned by set for every dataset
+        :rtype: list
+        """
+        codes = DatasetDAO.setdatamulti(datasets)
+        written = [dataset for dataset, dat in zip(datasets, codes) if dat == 0]
+        idx = DatasetDAO.enqueueindex(written) if written else 0
+        for dataset in datasets:
+            dataset_cache.invalidate(dataset.getdataset_id())
+        dataset_search_cache.clear()
+        return [10 * dat + (idx if dat == 0 else 2) for dat in codes]
+
     @staticmethod
     def searchindex(found_datasets_list, tags=''):
+        """
+        Search for datasets in index from Full Text Search through the cache and write into found_datasets_list
+
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri, 2 Connection error, 3 Application or server error
+        """
+        result_code, found, version = search_cached(dataset_search_cache, DatasetDAO.searchindexuncached, tags)
+        found_datasets_list.extend(found)
+        return result_code
+
+    @staticmethod
+    def searchindexiter(tags=''):
+        """
+        Search for datasets in index from Full Text Search without materializing the whole result
+
+        :rtype : tuple
+        :returns: tuple (result_code, iterator of dataset index dictionaries, version or None),
+            result_code 0 OK, 1 Malformed query in uri, 2 Connection error, 3 Application or server error
+        """
+        return iter_search(get_search_url() + '/datasets/', dataset_search_cache, DatasetDAO.searchindexuncached, tags)
+
+    @staticmethod
+    def searchindexpage(found_datasets_list, page, tags='', limit=None, cursor=None):
+        """
+        Search for a page of datasets in index from Full Text Search and write it into found_datasets_list
+
+        :param page: dictionary updated with totalCount, totalPages, nextCursor and version of all results
+        :type page: dict
+        :param limit: maximum number of datasets on a page, None means all of them
+        :type limit: int
+        :param cursor: nextCursor of the previous page or None for the first page
+        :type cursor: str
+        :rtype : int
+        :returns: 0 OK, 1 Malformed query in uri or cursor, 2 Connection error, 3 Application or server error
+        """
+        result_code, found_all, page['version'] = search_cached(dataset_search_cache, DatasetDAO.searchindexuncached,
+                                                               tags)
+        if result_code != 0:
+            return result_code
+        return paginate(found_all, found_datasets_list, page, limit, cursor)
+
+    @staticmethod
+    def searchindexuncached(found_datasets_list, tags=''):
         """
         Search for datasets in index from Full Text Search and write into found_datasets_list
 
@@ -540,11 +1680,10 @@ class DatasetDAO:
         """
         url = get_search_url() + '/datasets/'
         if tags != '':
-            query_string = ' OR '.join(tags.split(','))
-            url += '?query=' + query_string
+            url += search_query(tags)
         try:
-            response_from_url = requests.get(url)
-        except requests.ConnectionError:
+            response_from_url = search_sessions.get(url)
+        except SEARCH_CONNECTION_ERRORS:
             return 2
         if response_from_url.status_code > 499:
             # server error 500 and above
@@ -570,10 +1709,10 @@ class DatasetDAO:
         :rtype : dict
         :returns: dictionary of a single algorithm index
         """
-        url = get_search_url() + '/datasets/' + dataset_id
+        url = get_search_url() + '/datasets/' + search_path(dataset_id)
         try:
-            response_from_url = requests.get(url)
-        except requests.ConnectionError:
+            response_from_url = search_sessions.get(url)
+        except SEARCH_CONNECTION_ERRORS:
             return 2
         if response_from_url.status_code != 200:
             return 1
@@ -587,44 +1726,239 @@ class DatasetDAO:
 
         :param dataset_id: id of an dataset to be retrieved
         :type dataset_id: str
-        :returns: dictionary of a single dataset data or 1 - Error
+        :returns: dictionary of a single dataset data with timestamp of the last write or 1 - Error
         :rtype : dict, int
         """
-        ds = datastore.Client()
         try:
-            key = ds.key(_DATASTORE_KIND_DATASETS, dataset_id)
-            entity = ds.get(key)
-            entity.pop('timestamp')
-        except:
+            entity = storage.get(_DATASTORE_KIND_DATASETS, dataset_id)
+        except StorageError:
+            return 1
+        if entity is None:
             return 1
-        return entity
+        # entities written before BLOBs got their own kind still have it inline
+        entity.pop('datasetBLOB', None)
+        return decode_properties(entity, ('datasetDescription',))
 
     @staticmethod
-    def get(dataset_id):
+    def getlegacyblob(dataset_id):
         """
-        Get specific algorithm data
+        Get BLOB of a dataset written inline in its Datastore entity before BLOBs got their own store
+
+        :returns: BLOB or 1 - not found or Error
+        :rtype : str, int
+        """
+        try:
+            entity = storage.get(_DATASTORE_KIND_DATASETS, dataset_id)
+        except StorageError:
+            return 1
+        if entity is None or 'datasetBLOB' not in entity:
+            return 1
+        return entity['datasetBLOB']
+
+    @staticmethod
+    def getblob(dataset_id):
+        """
+        Get the whole BLOB of a single dataset from the BLOB store
+
+        :param dataset_id: id of a dataset to be retrieved
+        :type dataset_id: str
+        :returns: BLOB or 1 - Error
+        :rtype : str, int
+        """
+        try:
+            reader = blob_store.open(_DATASTORE_KIND_DATASET_BLOBS, dataset_id)
+            blob = b''.join(iter_decoded(reader, reader.codec))
+        except BlobNotFoundError:
+            return DatasetDAO.getlegacyblob(dataset_id)
+        except (BlobStoreError, KeyError, zlib.error):
+            return 1
+        # BLOBs uploaded as raw bytes may not be utf-8 text
+        return blob.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def openblob(dataset_id):
+        """
+        Open BLOB of a single dataset for streaming, chunks are read as the returned reader is iterated over
+
+        :param dataset_id: id of a dataset
+        :type dataset_id: str
+        :returns: BlobReader or 1 - not found or 2 - Error
+        :rtype : BlobReader, int
+        """
+        try:
+            return blob_store.open(_DATASTORE_KIND_DATASET_BLOBS, dataset_id)
+        except BlobNotFoundError:
+            pass
+        except BlobStoreError:
+            return 2
+        blob = DatasetDAO.getlegacyblob(dataset_id)
+        if blob == 1 or blob is None:
+            return 1
+        blob = blob.encode('utf-8')
+        return BlobReader(len(blob), iter([blob]))
+
+    @staticmethod
+    def writeblob(dataset_id, stream):
+        """
+        Write BLOB of a single dataset read from a stream chunk by chunk, replacing the previous one
+
+        :param dataset_id: id of a dataset
+        :type dataset_id: str
+        :param stream: binary file-like object with read(size)
+        :returns: 0 - EOK or 2 - Error
+        :rtype : int
+        """
+        try:
+            write_blob(_DATASTORE_KIND_DATASET_BLOBS, dataset_id, stream)
+        except BlobStoreError:
+            return 2
+        if DatasetDAO.touchdata(dataset_id) != 0:
+            return 2
+        return 0
+
+    @staticmethod
+    def touchdata(dataset_id):
+        """
+        Set timestamp of dataset data in Datastore to now so that ETags of the dataset change
+
+        :param dataset_id: id of the dataset
+        :type dataset_id: str
+        :returns: 1 - Error, 0 - EOK
+        :rtype : int
+        """
+        try:
+            if not storage.update(_DATASTORE_KIND_DATASETS, dataset_id, {'timestamp': datetime.now(timezone.utc)}):
+                return 1
+        except StorageError:
+            return 1
+        finally:
+            dataset_cache.invalidate(dataset_id)
+        return 0
+
+    @staticmethod
+    def getindexmulti(dataset_ids):
+        """
+        Get index data of many datasets from GAE Search
+
+        :param dataset_ids: ids of datasets to be retrieved
+        :type dataset_ids: list
+        :returns: dictionary of found dataset indexes by datasetId
+        :rtype: dict
+        """
+        return fetch_index_multi(DatasetDAO.searchindexuncached, DatasetDAO.getindex, 'datasetId', dataset_ids)
+
+    @staticmethod
+    def getdatamulti(dataset_ids):
+        """
+        Get data of many datasets from Datastore in a single get_multi round trip
+
+        :param dataset_ids: ids of datasets to be retrieved
+        :type dataset_ids: list
+        :returns: dictionary of found dataset data, the same as of getdata, by datasetId or 1 - Error
+        :rtype : dict, int
+        """
+        try:
+            entities = storage.get_multi(_DATASTORE_KIND_DATASETS, dataset_ids)
+        except StorageError:
+            return 1
+        found = {}
+        for dataset_id, entity in entities.items():
+            entity.pop('datasetBLOB', None)
+            found[dataset_id] = decode_properties(entity, ('datasetDescription',))
+        return found
+
+    @staticmethod
+    def getmulti(dataset_ids):
+        """
+        Get data of many datasets with one Datastore round trip and as few GAE search calls as possible
+
+        :param dataset_ids: ids of datasets to be retrieved
+        :type dataset_ids: list
+        :returns: dictionary by datasetId of merged index and data dictionaries without BLOB or 1 - not found in GAE search
+            or 2 - not found in Datastore, or 2 - Datastore Error
+        :rtype : dict, int
+        """
+        idx, dat = fetch_index_and_data(DatasetDAO.getindexmulti, DatasetDAO.getdatamulti, dataset_ids)
+        if dat == 1:
+            return 2
+        found = {}
+        for dataset_id in dataset_ids:
+            if dataset_id not in idx:
+                found[dataset_id] = 1
+            elif dataset_id not in dat:
+                found[dataset_id] = 2
+            else:
+                merged = dict(idx[dataset_id])
+                merged.update(dat[dataset_id])
+                merged['datasetBLOB'] = None
+                found[dataset_id] = merged
+        return found
+
+    @staticmethod
+    def getuncached(dataset_id):
+        """
+        Get specific dataset data from 17ZSearch and Datastore bypassing the cache
 
         :param dataset_id: id of an dataset to be retrieved
         :type dataset_id: str
-        :returns: Dataset object or 1 - GAE search Error or 2 - Datastore Error
-        :rtype : Dataset, int
+        :returns: merged index and data dictionary or 1 - GAE search Error or 2 - Datastore Error
+        :rtype : dict, int
         """
-        idx = DatasetDAO.getindex(dataset_id)
+        idx, dat = fetch_index_and_data(DatasetDAO.getindex, DatasetDAO.getdata, dataset_id)
+        idx = pending_index(_SEARCH_INDEX_DATASETS, dataset_id, idx)
         if idx in [1, 2]:
             return 1
-        dat = DatasetDAO.getdata(dataset_id)
         if dat == 1:
             return 2
         idx.update(dat)
-        found_dataset = Dataset(idx)
+        return idx
+
+    @staticmethod
+    def get(dataset_id, with_blob=False):
+        """
+        Get specific dataset data
+
+        Metadata comes from the cache, BLOB is never cached and it's loaded only when asked for.
+
+        :param dataset_id: id of an dataset to be retrieved
+        :type dataset_id: str
+        :param with_blob: load BLOB too, otherwise it's None
+        :type with_blob: bool
+        :returns: Dataset object or 1 - GAE search Error or 2 - Datastore Error
+        :rtype : Dataset, int
+        """
+        if with_blob:
+            blob_future = get_lookup_executor().submit(DatasetDAO.getblob, dataset_id)
+        found = dataset_cache.get_or_load(dataset_id, DatasetDAO.getuncached, lambda value: value not in [1, 2])
+        if found in [1, 2]:
+            return found
+        blob = blob_future.result() if with_blob else None
+        if blob == 1:
+            return 2
+        found = dict(found)
+        found['datasetBLOB'] = blob
+        found_dataset = Dataset(found)
         return found_dataset
 
     @staticmethod
     def delete(dataset_id):
-        url = get_search_url() + '/datasets/' + dataset_id
+        """
+        Delete dataset from index in Full Text Search, the deletion is written in background through index_queue
+
+        :param dataset_id: id of a dataset to be deleted
+        :type dataset_id: str
+        :returns: 0 - EOK, 1 - not found, 2 - Error
+        :rtype: int
+        """
         try:
-            response_from_url = requests.delete(url)
-        except requests.ConnectionError:
+            idx = pending_index(_SEARCH_INDEX_DATASETS, dataset_id, DatasetDAO.getindex(dataset_id))
+            if idx in [1, 2]:
+                return idx
+            index_queue.enqueue(_SEARCH_INDEX_DATASETS, dataset_id, ACTION_DELETE)
+        except sqlite3.Error:
+            logging.exception('Index update was not enqueued')
             return 2
-        if response_from_url.status_code != 200:
-            return 1
+        finally:
+            dataset_cache.invalidate(dataset_id)
+            dataset_search_cache.clear()
+        return 0
@@ -0,0 +1,85 @@
+"""
+Gunicorn configuration, loaded by gunicorn from the working directory or with -c gunicorn.conf.py
+
+Workers spend most of a request waiting for Datastore and 17ZSearch, so a sync worker serving one
+request at a time leaves the CPU idle. GUNICORN_WORKER_CLASS selects the worker model:
+
+gthread  (default) every worker serves GUNICORN_THREADS requests at once in threads, idle keep-alive
+         connections wait in a poller without holding a thread
+gevent   every worker serves up to GUNICORN_WORKER_CONNECTIONS requests in greenlets, the standard
+         library is monkey patched below before the app is imported, gunicorn refuses to start
+         when gevent of requirements.txt is not installed
+sync     one request at a time, only for comparison
+
+The app is imported once in the master (preload) so that static assets are encoded once and shared
+by workers copy-on-write. Connections the master opened to Datastore, 17ZSearch and the index queue
+are dropped in workers by post_fork, which also starts index queue threads of every worker. ID token
+certificates are fetched by the first request of a worker needing them.
+
+benchmarks/worker_models.py compares the worker models on the existing endpoints.
+"""
+import multiprocessing
+import os
+
+_CPUS = multiprocessing.cpu_count()
+
+# index updates waiting for 17ZSearch would be lost with a queue in a temporary file, see indexqueue.py
+if not os.environ.get('INDEX_QUEUE_PATH'):
+    raise RuntimeError('INDEX_QUEUE_PATH has to name the database file of the index queue, see app.yaml')
+
+# worker model, gthread, gevent or sync
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    try:
+        from gevent import monkey
+    except ImportError as err:
+        raise ImportError('GUNICORN_WORKER_CLASS=gevent needs gevent, install requirements.txt') from err
+    # has to happen before the preloaded app imports socket, ssl and threading
+    monkey.patch_all()
+
+bind = os.environ.get('GUNICORN_BIND', ':' + os.environ.get('PORT', '8080'))
+# processes, the default keeps every CPU busy while the others wait for I/O
+if worker_class == 'gthread':
+    workers = int(os.environ.get('WEB_CONCURRENCY', _CPUS + 1))
+elif worker_class == 'gevent':
+    workers = int(os.environ.get('WEB_CONCURRENCY', _CPUS))
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', _CPUS * 2 + 1))
+# requests served at once by a gthread worker
+threads = int(os.environ.get('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+# requests served at once by a gevent worker
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# seconds an idle keep-alive connection is kept, longer than 600 s of Google load balancers
+# so that they close idle connections and never send a request on one gunicorn is closing
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 620))
+# seconds of silence after which a worker is killed and seconds workers get to finish requests on restart
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# requests after which a worker is replaced, 0 never, the jitter keeps workers from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+accesslog = os.environ.get('GUNICORN_ACCESSLOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Drops connections inherited from the master and starts background threads of the worker"""
+    import connections
+    from dao import index_queue
+
+    # both are registered with os.register_at_fork too, they are called here explicitly
+    # so that the worker doesn't depend on import order of the preloaded app
+    connections.reinit_after_fork()
+    index_queue.reset()
+    # entries left in the queue by a previous worker are applied without waiting for a new write
+    index_queue.start()
+    server.log.info('Worker %s reinitialised after fork', worker.pid)
+
+
+def worker_exit(server, worker):
+    """Stops index queue workers, entries not applied yet stay in the queue for the next worker"""
+    from dao import index_queue
+
+    index_queue.stop()
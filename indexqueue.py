@@ -0,0 +1,352 @@
+"""
+Durable write-behind queue of 17ZSearch index updates
+
+Writes store data in Datastore and only enqueue the index document here, so their latency doesn't
+depend on 17ZSearch. The queue is a SQLite database in WAL mode on local disk, shared by all worker
+processes of the instance, and drained by background threads of each of them.
+
+INDEX_QUEUE_PATH has no default, app.yaml sets it. Updates are only as durable as the disk the file is
+on, a temporary directory cleaned on restart, or shared with other apps and tests, would lose them.
+
+Updates of a single item are applied in order: an entry is claimed only when there is no older one
+of the same item, and enqueueing an update drops older ones which aren't being applied yet because
+the newer one supersedes them. Failed updates are retried with exponential backoff, updates which
+17ZSearch rejects as malformed are dropped and logged.
+
+Usage:
+queue = IndexQueue(path, dispatcher)   # dispatcher(entries) returns HTTP status or None for each entry
+queue.enqueue('algorithms', algorithm_id, 'set', index_document)
+queue.start()
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# database file of the queue, required, ':memory:' keeps it in the process which is only meant for tests
+_INDEX_QUEUE_PATH = os.environ.get('INDEX_QUEUE_PATH', '')
+# background threads draining the queue in every process, 0 means the queue is drained only by flush()
+_INDEX_QUEUE_WORKERS = int(os.environ.get('INDEX_QUEUE_WORKERS', 1))
+# entries claimed and dispatched at once
+_INDEX_QUEUE_BATCH = int(os.environ.get('INDEX_QUEUE_BATCH', 50))
+# seconds before the first retry, doubled after every failure up to the maximum
+_INDEX_QUEUE_BACKOFF = float(os.environ.get('INDEX_QUEUE_BACKOFF', 0.5))
+_INDEX_QUEUE_MAX_BACKOFF = float(os.environ.get('INDEX_QUEUE_MAX_BACKOFF', 300))
+# seconds after which entries claimed by a worker which died are claimed again
+_INDEX_QUEUE_LEASE = float(os.environ.get('INDEX_QUEUE_LEASE', 60))
+# seconds an idle worker waits before looking for entries enqueued by other processes
+_INDEX_QUEUE_POLL = float(os.environ.get('INDEX_QUEUE_POLL', 1))
+
+ACTION_SET = 'set'
+ACTION_DELETE = 'delete'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS index_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    document TEXT,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS index_queue_item ON index_queue (kind, item_id, id);
+CREATE INDEX IF NOT EXISTS index_queue_ready ON index_queue (next_attempt, claimed_until);
+"""
+
+
+class IndexQueueEntry:
+    """Index update claimed from the queue"""
+
+    def __init__(self, entry_id, kind, item_id, action, document, enqueued_at, attempts):
+        self.entry_id = entry_id
+        self.kind = kind
+        self.item_id = item_id
+        self.action = action
+        self.document = document
+        self.enqueued_at = enqueued_at
+        self.attempts = attempts
+
+
+class IndexQueue:
+    """
+    Durable queue of index updates with background workers applying them in batches
+    """
+
+    def __init__(self, path=_INDEX_QUEUE_PATH, dispatcher=None, workers=_INDEX_QUEUE_WORKERS,
+                 batch_size=_INDEX_QUEUE_BATCH, backoff=_INDEX_QUEUE_BACKOFF, max_backoff=_INDEX_QUEUE_MAX_BACKOFF,
+                 lease=_INDEX_QUEUE_LEASE, poll_interval=_INDEX_QUEUE_POLL):
+        """
+        :param path: SQLite database file
+        :type path: str
+        :param dispatcher: function applying a list of IndexQueueEntry and returning HTTP status code
+            of 17ZSearch, or None for connection errors, for each of them
+        :param workers: background threads started by start()
+        :type workers: int
+        :param batch_size: entries claimed and dispatched at once
+        :type batch_size: int
+        :param backoff: seconds before the first retry
+        :type backoff: float
+        :param max_backoff: maximum seconds between retries
+        :type max_backoff: float
+        :param lease: seconds after which claimed entries which weren't finished are claimed again
+        :type lease: float
+        :param poll_interval: seconds an idle worker waits for entries of other processes
+        :type poll_interval: float
+        """
+        self.path = path
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._connection = None
+        self._pid = None
+        self._threads = []
+        self._counters = {}
+        self.reset()
+
+    def reset(self):
+        """Forgets connection, threads and counters, e.g. in a forked child which has none of the parent's threads"""
+        self._connection = None
+        self._pid = os.getpid()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counters = {
+            'enqueued': 0,
+            'batches': 0,
+            'succeeded': 0,
+            'retried': 0,
+            'rejected': 0,
+        }
+        self._last_error = None
+
+    def _connect(self):
+        """Returns connection of the current process, has to be called with the lock held"""
+        if self._connection is None or self._pid != os.getpid():
+            if not self.path:
+                raise sqlite3.OperationalError('INDEX_QUEUE_PATH is not set')
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            if self.path != ':memory:':
+                connection.execute('PRAGMA journal_mode=WAL')
+                # WAL with synchronous=NORMAL survives crashes of the process without an fsync per commit
+                connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def enqueue(self, kind, item_id, action, document=None):
+        """
+        Adds an index update superseding older updates of the item which aren't being applied yet
+
+        :param kind: index of the item, e.g. 'algorithms'
+        :type kind: str
+        :param item_id: id of the item
+        :type item_id: str
+        :param action: ACTION_SET or ACTION_DELETE
+        :type action: str
+        :param document: index document of ACTION_SET
+        :type document: dict
+        :raises: sqlite3.Error
+        """
+        self.enqueue_many([(kind, item_id, action, document)])
+
+    def enqueue_many(self, updates):
+        """
+        Adds many index updates in a single transaction
+
+        :param updates: tuples (kind, item_id, action, document)
+        :type updates: list
+        :raises: sqlite3.Error
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for kind, item_id, action, document in updates:
+                    connection.execute('DELETE FROM index_queue WHERE kind = ? AND item_id = ? AND claimed_until <= ?',
+                                       (kind, item_id, now))
+                    connection.execute('INSERT INTO index_queue (kind, item_id, action, document, enqueued_at, '
+                                       'next_attempt) VALUES (?, ?, ?, ?, ?, ?)',
+                                       (kind, item_id, action, None if document is None else json.dumps(document),
+                                        now, now))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            self._counters['enqueued'] += len(updates)
+        self._wakeup.set()
+        self.start()
+
+    def pending(self, kind, item_id):
+        """
+        Latest update of an item which wasn't applied yet, it lets readers see their own writes
+
+        :returns: tuple (action, document) or None
+        :rtype: tuple
+        """
+        with self._lock:
+            row = self._connect().execute('SELECT action, document FROM index_queue WHERE kind = ? AND item_id = ? '
+                                          'ORDER BY id DESC LIMIT 1', (kind, item_id)).fetchone()
+        if row is None:
+            return None
+        return row[0], None if row[1] is None else json.loads(row[1])
+
+    def _claim(self):
+        """Claims the oldest ready entries of items which have no older entries"""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute(
+                    'SELECT id, kind, item_id, action, document, enqueued_at, attempts FROM index_queue AS q '
+                    'WHERE next_attempt <= ? AND claimed_until <= ? AND NOT EXISTS ('
+                    'SELECT 1 FROM index_queue AS p WHERE p.kind = q.kind AND p.item_id = q.item_id AND p.id < q.id) '
+                    'ORDER BY id LIMIT ?', (now, now, self.batch_size)).fetchall()
+                connection.executemany('UPDATE index_queue SET claimed_until = ? WHERE id = ?',
+                                       [(now + self.lease, row[0]) for row in rows])
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return [IndexQueueEntry(row[0], row[1], row[2], row[3], None if row[4] is None else json.loads(row[4]),
+                                row[5], row[6]) for row in rows]
+
+    def _finish(self, entries, statuses):
+        """Deletes applied and rejected entries and schedules retries of failed ones"""
+        done = []
+        retries = []
+        now = time.time()
+        for entry, status in zip(entries, statuses):
+            if status is not None and (200 <= status < 300 or (entry.action == ACTION_DELETE and status == 404)):
+                done.append((entry.entry_id,))
+                self._counters['succeeded'] += 1
+            elif status is not None and 400 <= status < 500:
+                # a document 17ZSearch doesn't accept won't be accepted by a retry either
+                logging.error('Index update %s of %s/%s rejected with status %s',
+                              entry.action, entry.kind, entry.item_id, status)
+                done.append((entry.entry_id,))
+                self._counters['rejected'] += 1
+            else:
+                error = 'connection error' if status is None else 'status ' + str(status)
+                delay = min(self.max_backoff, self.backoff * 2 ** entry.attempts)
+                retries.append((now + delay, error, entry.entry_id))
+                self._counters['retried'] += 1
+                self._last_error = error
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('DELETE FROM index_queue WHERE id = ?', done)
+            connection.executemany('UPDATE index_queue SET attempts = attempts + 1, next_attempt = ?, '
+                                   'claimed_until = 0, last_error = ? WHERE id = ?', retries)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def process_batch(self):
+        """
+        Claims a batch of ready entries and applies it with the dispatcher in the calling thread
+
+        :returns: number of entries in the batch
+        :rtype: int
+        """
+        entries = self._claim()
+        if not entries:
+            return 0
+        try:
+            statuses = self.dispatcher(entries)
+        except Exception as err:
+            logging.exception('Dispatching index updates failed')
+            statuses = [None] * len(entries)
+            self._last_error = repr(err)
+        with self._lock:
+            self._counters['batches'] += 1
+            self._finish(entries, statuses)
+        return len(entries)
+
+    def flush(self, timeout=10):
+        """
+        Applies ready entries in the calling thread until there are none left or timeout passes
+
+        :returns: True if the queue is empty
+        :rtype: bool
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process_batch() == 0:
+                if self.stats()['depth'] == 0:
+                    return True
+                time.sleep(0.01)
+        return self.stats()['depth'] == 0
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = self.process_batch()
+            except sqlite3.Error:
+                logging.exception('Index queue is not available')
+                processed = 0
+            if processed == 0:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def start(self):
+        """Starts background workers of the current process unless they are running"""
+        if self.workers < 1 or self.dispatcher is None:
+            return
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._connection = None
+                self._pid = os.getpid()
+                self._threads = []
+            if self._threads:
+                return
+            self._stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name='index-queue-' + str(number), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Stops background workers, entries not applied yet stay in the queue"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        """
+        Depth of the queue, lag of its oldest entry in seconds and counters of the current process
+
+        :rtype: dict
+        """
+        now = time.time()
+        with self._lock:
+            depth, ready, retrying, oldest = self._connect().execute(
+                'SELECT COUNT(*), SUM(next_attempt <= ? AND claimed_until <= ?), SUM(attempts > 0), '
+                'MIN(enqueued_at) FROM index_queue', (now, now)).fetchone()
+            stats = dict(self._counters)
+        stats['depth'] = depth
+        stats['ready'] = ready or 0
+        stats['retrying'] = retrying or 0
+        stats['lag'] = now - oldest if oldest is not None else 0.0
+        stats['workers'] = len(self._threads) if self._pid == os.getpid() else 0
+        stats['last_error'] = self._last_error
+        return stats
@@ -0,0 +1,145 @@
+"""
+Incremental parsing of JSON arrays and NDJSON from file-like streams
+
+Items are yielded as soon as they are complete so that memory use is bounded by the size of
+a single item and the read buffer, not by the size of the whole document.
+"""
+import codecs
+import json
+import re
+
+# bytes read from a stream at once
+_READ_SIZE = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+# what raw_decode may fail at when a chunk ends inside a value: a number, a literal or a \\u escape
+_NUMBER_TAIL = re.compile(r'[-+.eE0-9]*$')
+_ESCAPE_TAIL = re.compile(r'u[0-9a-fA-F]{0,4}$')
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+class JSONStreamError(ValueError):
+    """Exception raised when a stream doesn't contain a JSON array or NDJSON"""
+    pass
+
+
+def _read_text(stream, read_size):
+    """Yields decoded utf-8 text read from a binary stream"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+
+def _is_truncated(err, text):
+    """
+    Tells if raw_decode failed only because text ends before the value does
+
+    :param err: error raised by raw_decode of text
+    :type err: json.JSONDecodeError
+    :rtype: bool
+    """
+    if err.msg.startswith('Unterminated string'):
+        return True
+    rest = text[err.pos:]
+    return (_NUMBER_TAIL.match(rest) is not None or _ESCAPE_TAIL.match(rest) is not None
+            or any(literal.startswith(rest) for literal in _LITERALS))
+
+
+def iter_ndjson(stream, read_size=_READ_SIZE):
+    """
+    Yields values of a stream of newline delimited JSON, empty lines are skipped
+
+    :param stream: binary file-like object with read(size)
+    :raises: JSONStreamError
+    """
+    pending = ''
+    for text in _read_text(stream, read_size):
+        lines = (pending + text).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    raise JSONStreamError('Malformed NDJSON line') from None
+    if pending.strip():
+        try:
+            yield json.loads(pending)
+        except ValueError:
+            raise JSONStreamError('Malformed NDJSON line') from None
+
+
+def iter_json_array(stream, read_size=_READ_SIZE):
+    """
+    Yields items of a JSON array read from a stream without loading the whole array
+
+    :param stream: binary file-like object with read(size)
+    :raises: JSONStreamError
+    """
+    decoder = json.JSONDecoder()
+    texts = _read_text(stream, read_size)
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def more():
+        """Appends next text to the buffer dropping what's already parsed, False at the end of stream"""
+        nonlocal buffer, pos, eof
+        text = next(texts, None)
+        if text is None:
+            eof = True
+            return False
+        buffer = buffer[pos:] + text
+        pos = 0
+        return True
+
+    started = False
+    count = 0
+    expect_item = True
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buffer):
+            if not more():
+                raise JSONStreamError('Unexpected end of JSON array')
+            continue
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise JSONStreamError('JSON array expected')
+            started = True
+            pos += 1
+        elif char == ']' and (not expect_item or count == 0):
+            pos += 1
+            break
+        elif char == ',' and not expect_item:
+            expect_item = True
+            pos += 1
+        elif not expect_item:
+            raise JSONStreamError('Coma expected between JSON array items')
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as err:
+                # only an item cut by the end of the buffer is parsed again with the next chunk
+                if _is_truncated(err, buffer) and more():
+                    continue
+                raise JSONStreamError('Malformed JSON array item') from None
+            # a number at the end of the buffer may continue in the next chunk
+            if not eof and _NUMBER_TAIL.match(buffer, end) is not None and more():
+                continue
+            pos = end
+            count += 1
+            expect_item = False
+            yield item
+    while pos < len(buffer) or more():
+        if buffer[pos] not in _WHITESPACE:
+            raise JSONStreamError('Unexpected data after JSON array')
+        pos += 1
@@ -1,14 +1,44 @@
 # [START app]
+import hashlib
 import logging
 import os
-from dao import Algorithm, AlgorithmDAO, User, UserDAO, Dataset, DatasetDAO
-from flask import Flask, send_from_directory, url_for, redirect, json, \
-    Response, request, render_template
-from authentication import authenticated, get_user_from_id_token
+from datetime import timezone
+from dao import Algorithm, AlgorithmDAO, User, UserDAO, Dataset, DatasetDAO, algorithm_cache, dataset_cache, \
+    algorithm_search_cache, dataset_search_cache, get_codec, iter_decoded, index_queue, storage
+from flask import Flask, url_for, redirect, json, Response, request, render_template, g, abort
+from authentication import authenticated, get_user_from_claims, id_token_cache, certificate_cache
+from connections import datastore_clients, search_sessions
+from jsonstream import iter_json_array, iter_ndjson, JSONStreamError
+from blobstore import BlobReader
+from responses import json_response, status_response, encode_json
+from assets import FileDocument, StaticDirectory
+from compression import CompressionMiddleware
 import string
 
 app = Flask(__name__)
 
+# compress responses for clients accepting gzip or deflate, 0 when a proxy in front compresses them
+_RESPONSE_COMPRESSION = int(os.environ.get('RESPONSE_COMPRESSION', 1))
+# maximum number of ids in a single batch request
+_BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', 100))
+# fields of algorithms and datasets in responses, BLOBs are returned only when asked for in fields parameter
+_ALGORITHM_FIELDS = ('algorithmId', 'algorithmSummary', 'displayName', 'linkURL', 'algorithmBLOB',
+                     'algorithmDescription', 'datasetDescription')
+_DATASET_FIELDS = ('datasetId', 'datasetSummary', 'displayName', 'linkURL', 'datasetBLOB', 'datasetDescription')
+# number of items on a page when only cursor is given and maximum allowed limit
+_PAGE_DEFAULT_LIMIT = int(os.environ.get('PAGE_DEFAULT_LIMIT', 100))
+_PAGE_MAX_LIMIT = int(os.environ.get('PAGE_MAX_LIMIT', 1000))
+# number of items written by a single DAO call during bulk import
+_IMPORT_CHUNK = int(os.environ.get('IMPORT_CHUNK', 500))
+# seconds browsers may keep static assets requested without version, 0 makes them revalidate every time
+_STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 0))
+# coma delimited list of subs or emails of users allowed to read /stats/, empty allows every authenticated user
+_STATS_USERS = frozenset(user.strip() for user in os.environ.get('STATS_USERS', '').split(',') if user.strip())
+
+compression_middleware = CompressionMiddleware(app.wsgi_app, url_map=app.url_map)
+if _RESPONSE_COMPRESSION:
+    app.wsgi_app = compression_middleware
+
 
 def has_no_whitespaces(my_string):
     for my_char in my_string:
@@ -17,6 +47,301 @@ def has_no_whitespaces(my_string):
     return True
 
 
+def get_fields(args, all_fields, blob_field):
+    """
+    Extracts fields parameter, a coma delimited list of fields to be returned
+    :param args: request.args
+    :param all_fields: all fields of an item
+    :param blob_field: field which is heavy to load and isn't returned by default
+    :return: list of fields, by default all but blob_field, or None if there is an unknown field
+    """
+    if 'fields' not in args:
+        return [field for field in all_fields if field != blob_field]
+    fields = []
+    for field in args['fields'].replace(', ', ',').split(','):
+        if field not in all_fields:
+            return None
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def get_tags(args):
+    """
+    Extracts tags parameter of listings
+    Tags have to be a coma delimited list of words (one space is acceptable only after coma)
+    :param args: request.args
+    :return: tags with spaces after comas removed, '' if there are no tags or None if tags are wrong
+    """
+    if 'tags' not in args:
+        return ''
+    tags = args['tags']
+    if not isinstance(tags, str):
+        return None
+    tags = tags.replace(', ', ',')
+    for tag in tags.split(','):
+        if not has_no_whitespaces(tag):
+            return None
+    return tags
+
+
+def make_etag(*versions):
+    """
+    Strong ETag of a representation made from stored data of the given versions
+
+    :param versions: anything identifying stored data and the way it's represented, e.g. timestamp and fields
+    :rtype: str
+    """
+    return hashlib.sha1('|'.join(str(version) for version in versions).encode('utf-8')).hexdigest()
+
+
+def set_validators(resp, etag, last_modified=None):
+    """
+    Sets ETag and Last-Modified headers
+
+    :param last_modified: time of the last write of stored data, naive times are UTC as in Datastore
+    :type last_modified: datetime
+    """
+    resp.set_etag(etag)
+    if last_modified is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        resp.last_modified = last_modified
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Checks If-None-Match, or If-Modified-Since when there is no If-None-Match, of a GET request
+
+    :param etag: current ETag of the requested representation
+    :type etag: str
+    :param last_modified: time of the last write of stored data or None if it's unknown
+    :type last_modified: datetime
+    :return: 304 Response if the client's copy is current, otherwise None
+    """
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        # Last-Modified has whole seconds
+        current = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        current = False
+    if not current:
+        return None
+    resp = Response(status=304)
+    set_validators(resp, etag, last_modified)
+    return resp
+
+
+def wants_ndjson():
+    """Checks if client prefers NDJSON to JSON array in Accept header"""
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+
+def listing_etag(version, *args):
+    """ETag of a listing, it differs for JSON array and NDJSON, None if version of search results is unknown"""
+    if version is None:
+        return None
+    return make_etag(version, wants_ndjson(), *args)
+
+
+def stream_listing(items, etag=None):
+    """
+    Streams listing items as JSON array or, if client prefers it in Accept header, as NDJSON
+
+    Every item is encoded separately as it comes so the whole listing is never held in memory.
+    :param items: iterator of dictionaries
+    :param etag: ETag of the listing or None
+    :return: Response
+    """
+    if wants_ndjson():
+        def generate():
+            for item in items:
+                yield json.dumps(item) + '\n'
+        resp = Response(generate(), status=200, mimetype='application/x-ndjson')
+        resp.headers['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+    else:
+        def generate():
+            separator = '['
+            for item in items:
+                yield separator + json.dumps(item)
+                separator = ', '
+            yield '[]' if separator == '[' else ']'
+        resp = Response(generate(), status=200, mimetype='application/json')
+        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+    resp.headers['Vary'] = 'Accept'
+    if etag is not None:
+        set_validators(resp, etag)
+    return resp
+
+
+def get_page_args(args):
+    """
+    Extracts limit and cursor parameters of listings
+
+    Without both of them the whole listing is returned as before pagination was introduced.
+    :param args: request.args
+    :return: tuple (limit, cursor) with None for missing parameters or None if they are malformed
+    """
+    cursor = args.get('cursor')
+    if 'limit' not in args:
+        limit = _PAGE_DEFAULT_LIMIT if cursor is not None else None
+    elif not args['limit'].isdigit():
+        return None
+    else:
+        limit = int(args['limit'])
+        if limit < 1 or limit > _PAGE_MAX_LIMIT:
+            return None
+    if cursor == '':
+        return None
+    return limit, cursor
+
+
+def set_page_headers(resp, page):
+    """
+    Sets Total-Count and Total-Pages headers, advertised in CORS config of swagger(), and Next-Cursor
+    :param resp: Response of a listing
+    :param page: page description from searchindexpage
+    """
+    resp.headers['Total-Count'] = str(page['totalCount'])
+    resp.headers['Total-Pages'] = str(page['totalPages'])
+    if page['nextCursor'] is not None:
+        resp.headers['Next-Cursor'] = page['nextCursor']
+        resp.headers['Access-Control-Expose-Headers'] = 'Total-Count, Total-Pages, Next-Cursor'
+    else:
+        resp.headers['Access-Control-Expose-Headers'] = 'Total-Count, Total-Pages'
+
+
+def get_batch_ids(args):
+    """
+    Extracts coma delimited list of ids from ids parameter of batch requests
+
+    Duplicates are removed keeping order of the first appearance.
+    :param args: request.args
+    :return: list of ids or None if ids are missing, malformed or there are too many of them
+    """
+    if 'ids' not in args:
+        return None
+    ids = []
+    for item_id in args['ids'].replace(', ', ',').split(','):
+        if item_id == '' or not has_no_whitespaces(item_id):
+            return None
+        if item_id not in ids:
+            ids.append(item_id)
+    if len(ids) > _BATCH_MAX_IDS:
+        return None
+    return ids
+
+
+def import_items(item_class, dao_class, id_field):
+    """
+    Writes algorithms or datasets streamed in request body in chunks
+
+    Body is a JSON array (Content-Type: application/json) or NDJSON (application/x-ndjson)
+    and it's parsed incrementally so only a single chunk of items is kept in memory.
+    :param item_class: Algorithm or Dataset
+    :param dao_class: AlgorithmDAO or DatasetDAO
+    :param id_field: name of id field in items, e.g. 'algorithmId'
+    :return: Response with a list of statuses in order of items
+    """
+    if request.mimetype == 'application/json':
+        items = iter_json_array(request.stream)
+    elif request.mimetype == 'application/x-ndjson':
+        items = iter_ndjson(request.stream)
+    else:
+        return status_response(400, 'Content-Type')
+    statuses = []
+    chunk = []
+    chunk_ids = set()
+
+    def write_chunk():
+        returned_codes = dao_class.setmulti([item for position, item in chunk])
+        for (position, item), returned_code in zip(chunk, returned_codes):
+            if returned_code == 0:
+                statuses[position] = {id_field: item.get_dict()[id_field], "code": 200, "fields": "", "message": "OK"}
+            else:
+                # items were valid, Datastore, BLOB store or index queue failed, so the client may retry them
+                statuses[position] = {id_field: item.get_dict()[id_field], "code": 503, "fields": "string",
+                                      "message": "Service Unavailable"}
+        chunk.clear()
+        chunk_ids.clear()
+
+    status = 200
+    try:
+        for dict_data in items:
+            try:
+                item = item_class(dict_data)
+            except (KeyError, TypeError):
+                statuses.append({"code": 400, "fields": "string", "message": "Malformed Data"})
+                continue
+            item_id = item.get_dict()[id_field]
+            # the same entity can't be written twice by a single Datastore commit
+            if item_id in chunk_ids or len(chunk) >= _IMPORT_CHUNK:
+                write_chunk()
+            statuses.append(None)
+            chunk.append((len(statuses) - 1, item))
+            chunk_ids.add(item_id)
+    except JSONStreamError:
+        status = 400
+    if chunk:
+        write_chunk()
+    if status != 200:
+        statuses.append({"code": 400, "fields": "body", "message": "Malformed Data"})
+    return json_response(statuses, status)
+
+
+def blob_store_error():
+    """Response when the BLOB store failed"""
+    return status_response(503)
+
+
+def stream_blob(dao_class, item_id):
+    """
+    Streams BLOB of an item chunk by chunk as it's read from the BLOB store
+
+    A compressed BLOB is sent as it's stored with Content-Encoding if the client accepts it,
+    otherwise it's decompressed on the fly.
+
+    :param dao_class: AlgorithmDAO or DatasetDAO
+    :param item_id: id of the item
+    :return: Response
+    """
+    reader = dao_class.openblob(item_id)
+    if reader == 1:
+        return status_response(404)
+    if reader == 2:
+        return blob_store_error()
+    codec = get_codec(reader.codec)
+    if codec.content_encoding is None:
+        resp = Response(iter(reader), status=200, mimetype='application/octet-stream')
+        resp.headers['Content-Length'] = str(reader.size)
+    elif request.accept_encodings[codec.content_encoding]:
+        resp = Response(iter(reader), status=200, mimetype='application/octet-stream')
+        resp.headers['Content-Encoding'] = codec.content_encoding
+        resp.headers['Content-Length'] = str(reader.size)
+    else:
+        resp = Response(iter_decoded(reader, codec), status=200, mimetype='application/octet-stream')
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+def upload_blob(dao_class, item_id):
+    """
+    Writes BLOB of an existing item from the request body without buffering the whole of it
+
+    :param dao_class: AlgorithmDAO or DatasetDAO
+    :param item_id: id of the item
+    :return: Response
+    """
+    if dao_class.get(item_id) in [1, 2]:
+        return status_response(404)
+    if dao_class.writeblob(item_id, request.stream) != 0:
+        return blob_store_error()
+    return status_response(200)
+
+
 def get_flexible_url():
     """this gets address of flexible app for jinja"""
     _FLEXIBLE_PROJECT_NAME = 'zflexible1'
@@ -27,6 +352,60 @@ def get_flexible_url():
     return url
 
 
+def set_swagger_host(body):
+    """swagger.json with schemes and host changed to get_flexible_url()"""
+    data = json.loads(body)
+    url = get_flexible_url()
+    data['host'] = url.split('://')[1]
+    data['schemes'] = [url.split('://')[0]]
+    return encode_json(data)
+
+
+swagger_document = FileDocument(os.path.join(app.root_path, 'static', 'swagger.json'),
+                                'application/json; charset=utf-8', transform=set_swagger_host)
+favicon_document = FileDocument(os.path.join(app.root_path, 'static', 'favicon.ico'), 'image/vnd.microsoft.icon')
+swaggerui_assets = StaticDirectory(os.path.join(app.root_path, 'static', 'swaggerui'))
+
+
+def send_encoded(encoded, cache_control=None):
+    """
+    Sends a document kept encoded in memory, compressed variant to clients accepting it
+
+    :param encoded: EncodedDocument
+    :param cache_control: value of Cache-Control header or None
+    :type cache_control: str
+    :return: Response, 304 if the client's copy is current
+    """
+    encoding, body, etag = encoded.select(request.accept_encodings)
+    resp = not_modified(etag)
+    if resp is None:
+        resp = Response(body, status=200, content_type=encoded.mimetype)
+        if encoding is not None:
+            resp.headers['Content-Encoding'] = encoding
+        set_validators(resp, etag)
+    if encoded.variants:
+        resp.headers['Vary'] = 'Accept-Encoding'
+    if cache_control is not None:
+        resp.headers['Cache-Control'] = cache_control
+    return resp
+
+
+def send_asset(encoded):
+    """
+    Sends a static asset, versioned URL (?v=<version of the asset>) can be cached forever
+
+    :param encoded: EncodedDocument or None if there's no such asset
+    :return: Response
+    """
+    if encoded is None:
+        abort(404)
+    if request.args.get('v') == encoded.version:
+        return send_encoded(encoded, 'public, max-age=31536000, immutable')
+    if _STATIC_MAX_AGE == 0:
+        return send_encoded(encoded, 'no-cache')
+    return send_encoded(encoded, 'public, max-age=' + str(_STATIC_MAX_AGE))
+
+
 @app.route('/')
 def hello():
     """Return a human readable site in HTML."""
@@ -50,14 +429,13 @@ def environment_html():
 @app.route('/favicon.ico')
 def favicon():
     """Icon for browsers"""
-    return send_from_directory(os.path.join(app.root_path, 'static'),
-                               'favicon.ico', mimetype='image/vnd.microsoft.icon')
+    return send_asset(favicon_document.get())
 
 
 @app.route('/swaggerui/<path:path>', methods=['GET'])
 def swaggerui(path):
-    """Main directory for swaggerui"""
-    return send_from_directory('static/swaggerui', path)
+    """Main directory for swaggerui, files are compressed once and links of index.html carry their versions"""
+    return send_asset(swaggerui_assets.get(path))
 
 
 @app.route('/doc/', methods=['GET'])
@@ -68,16 +446,8 @@ def doc():
 
 @app.route('/swagger.json', methods=['GET'])
 def swagger():
-    """Main file for SwaggerUI prepared for automatic generation of data"""
-    data = json.load(open('static/swagger.json'))
-    # changing schemes and host in swagger.json to get_flexible_url()
-    url = get_flexible_url()
-    data['host'] = url.split('://')[1]
-    data['schemes'].clear()
-    data['schemes'].append(url.split('://')[0])
-    js = json.dumps(data)
-    resp = Response(js, status=200, mimetype='application/json')
-    resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+    """Main file for SwaggerUI prepared for automatic generation of data, it's built once and kept in memory"""
+    resp = send_encoded(swagger_document.get())
     resp.headers.add_header('Access-Control-Allow-Origin', '*')
     resp.headers.add_header('Access-Control-Allow-Methods', 'POST, GET, DELETE, PUT, OPTIONS')
     resp.headers.add_header(
@@ -105,41 +475,44 @@ def api_datasets_get():
         2 Connection error
         3 Application or server error
         4 Wrong tags parameter
+        5 Wrong limit or cursor parameter
+    Optional limit and cursor parameters return a single page, Next-Cursor header holds cursor of the next one.
+    Without them the whole listing is streamed as JSON array or NDJSON (Accept: application/x-ndjson).
     """
     datasets_list = []
-    if 'tags' in request.args:
-        tags = request.args['tags']
-        # check if tags is a string and a coma delimited list of words (one space is acceptable only after coma)
-        if not isinstance(tags, str):
-            result_code = 4
-        else:
-            tags = tags.replace(', ', ',')
-            tags_are_ok = True
-            for tag in tags.split(','):
-                if not has_no_whitespaces(tag):
-                    tags_are_ok = False
-                    break
-            if not tags_are_ok:
-                result_code = 4
-            else:
-                result_code = DatasetDAO.searchindex(tags=tags, found_datasets_list=datasets_list)
+    page = {}
+    page_args = get_page_args(request.args)
+    tags = get_tags(request.args)
+    if page_args is None:
+        result_code = 5
+    elif tags is None:
+        result_code = 4
+    elif page_args == (None, None):
+        result_code, datasets, version = DatasetDAO.searchindexiter(tags=tags)
+        if result_code == 0:
+            etag = listing_etag(version)
+            resp = not_modified(etag) if etag is not None else None
+            if resp is not None:
+                resp.headers['Vary'] = 'Accept'
+                return resp
+            return stream_listing(datasets, etag)
     else:
-        result_code = DatasetDAO.searchindex(found_datasets_list=datasets_list)
+        result_code = DatasetDAO.searchindexpage(datasets_list, page, tags=tags,
+                                                 limit=page_args[0], cursor=page_args[1])
     if result_code == 0:
-        js = json.dumps(datasets_list)
-        resp = Response(js, status=200, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        etag = listing_etag(page['version'], page_args)
+        resp = not_modified(etag) if etag is not None else None
+        if resp is not None:
+            resp.headers['Vary'] = 'Accept'
+            set_page_headers(resp, page)
+            return resp
+        resp = json_response(datasets_list)
+        set_page_headers(resp, page)
+        if etag is not None:
+            set_validators(resp, etag)
         return resp
     else:
-        data = [{
-            "code": 400,
-            "fields": "string",
-            "message": "Malformed Data"
-        }]
-        js = json.dumps(data)
-        resp = Response(js, status=400, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return resp
+        return status_response(400, in_list=True)
 
 @app.route('/datasets', methods=['POST'])
 @authenticated
@@ -150,24 +523,20 @@ def api_datasets_post(user_id=None):
         dataset = Dataset(dict_data)
         returned_code = DatasetDAO.set(dataset)
         if returned_code == 0:
-            data = {
-                "code": 200,
-                "fields": "string",
-                "message": "OK"
-            }
-            js = json.dumps(data)
-            resp = Response(js, status=200, mimetype='application/json')
-            resp.headers['Content-Type'] = 'application/json; charset=utf-8'
-            return resp
-    data = {
-        "code": 400,
-        "fields": "string",
-        "message": "Malformed Data"
-    }
-    js = json.dumps(data)
-    resp = Response(js, status=400, mimetype='application/json')
-    resp.headers['Content-Type'] = 'application/json; charset=utf-8'
-    return resp
+            return status_response(200)
+        # Datastore or the index queue is not available
+        return status_response(503)
+    return status_response(400)
+
+
+@app.route('/datasets/import', methods=['POST'])
+@authenticated
+def api_datasets_import(user_id=None):
+    """
+    Bulk import of datasets from a streamed JSON array or NDJSON body
+    Returns a list with status of every dataset in order of the body
+    """
+    return import_items(Dataset, DatasetDAO, 'datasetId')
 
 
 @app.route('/datasets/<dataset_id>', methods=['DELETE'])
@@ -181,37 +550,67 @@ def api_dataset_delete(dataset_id, user_id=None):
         resp = Response(status=200, mimetype='application/json')
         resp.headers['Content-Type'] = 'application/json; charset=utf-8'
     else:
-        data = {
-            "code": 404,
-            "fields": "string",
-            "message": "Not Found"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=404, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(404)
     return resp
 
+@app.route('/datasets/batch', methods=['GET'])
+def api_datasets_batch_get():
+    """
+     Get many datasets detailed information in a single call
+     ids: coma delimited list of dataset ids
+     Returns a list in order of ids, datasets which were not found are marked with code 404
+     fields: optional coma delimited list of fields to be returned, datasetBLOB is never returned
+    """
+    dataset_ids = get_batch_ids(request.args)
+    fields = get_fields(request.args, _DATASET_FIELDS, 'datasetBLOB')
+    if fields is None or 'datasetBLOB' in fields:
+        return status_response(400, 'fields')
+    if dataset_ids is None:
+        return status_response(400, 'ids')
+    result = DatasetDAO.getmulti(dataset_ids)
+    if result not in [1, 2]:
+        datasets_list = []
+        for dataset_id in dataset_ids:
+            if result[dataset_id] not in [1, 2]:
+                datasets_list.append(Dataset(result[dataset_id]).get_dict(fields))
+            else:
+                datasets_list.append({
+                    "datasetId": dataset_id,
+                    "code": 404,
+                    "fields": "string",
+                    "message": "Not Found"
+                })
+        resp = json_response(datasets_list)
+    else:
+        resp = status_response(404)
+    return resp
+
+
 @app.route('/datasets/<dataset_id>', methods=['GET'])
 def api_dataset_get(dataset_id):
     """
      Get a single dataset detailed information
-     Everything but algorithmBLOB
+     Everything but datasetBLOB unless fields parameter, a coma delimited list of fields, says otherwise
     """
+    fields = get_fields(request.args, _DATASET_FIELDS, 'datasetBLOB')
+    if fields is None:
+        return status_response(400, 'fields')
     result = DatasetDAO.get(dataset_id)
     if result not in [1, 2]:
-        dataset = result.get_dict()
-        js = json.dumps(dataset)
-        resp = Response(js, status=200, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        # BLOB writes update the timestamp too
+        etag = make_etag(result.gettimestamp(), fields)
+        resp = not_modified(etag, result.gettimestamp())
+        if resp is not None:
+            return resp
+        if 'datasetBLOB' in fields:
+            # metadata comes from the cache again, BLOB is loaded only for responses returning it
+            result = DatasetDAO.get(dataset_id, with_blob=True)
+    if result not in [1, 2]:
+        dataset = result.get_dict(fields)
+        resp = json_response(dataset)
+        set_validators(resp, etag, result.gettimestamp())
     else:
-        data = {
-            "code": 404,
-            "fields": "string",
-            "message": "Not Found"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=404, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(404)
     return resp
 
 "Algorithm API"
@@ -228,41 +627,61 @@ def api_algorithms_get():
         2 Connection error
         3 Application or server error
         4 Wrong tags parameter
+        5 Wrong limit or cursor parameter
+    Optional limit and cursor parameters return a single page, Next-Cursor header holds cursor of the next one.
+    Without them the whole listing is streamed as JSON array or NDJSON (Accept: application/x-ndjson).
     """
     algorithms_list = []
-    if 'tags' in request.args:
-        tags = request.args['tags']
-        # check if tags is a string and a coma delimited list of words (one space is acceptable only after coma)
-        if not isinstance(tags, str):
-            result_code = 4
-        else:
-            tags = tags.replace(', ', ',')
-            tags_are_ok = True
-            for tag in tags.split(','):
-                if not has_no_whitespaces(tag):
-                    tags_are_ok = False
-                    break
-            if not tags_are_ok:
-                result_code = 4
-            else:
-                result_code = AlgorithmDAO.searchindex(tags=tags, found_algorithms_list=algorithms_list)
+    page = {}
+    page_args = get_page_args(request.args)
+    tags = get_tags(request.args)
+    if page_args is None:
+        result_code = 5
+    elif tags is None:
+        result_code = 4
+    elif page_args == (None, None):
+        result_code, algorithms, version = AlgorithmDAO.searchindexiter(tags=tags)
+        if result_code == 0:
+            etag = listing_etag(version)
+            resp = not_modified(etag) if etag is not None else None
+            if resp is not None:
+                resp.headers['Vary'] = 'Accept'
+                return resp
+            return stream_listing(algorithms, etag)
     else:
-        result_code = AlgorithmDAO.searchindex(found_algorithms_list=algorithms_list)
+        result_code = AlgorithmDAO.searchindexpage(algorithms_list, page, tags=tags,
+                                                   limit=page_args[0], cursor=page_args[1])
     if result_code == 0:
-        js = json.dumps(algorithms_list)
-        resp = Response(js, status=200, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        etag = listing_etag(page['version'], page_args)
+        resp = not_modified(etag) if etag is not None else None
+        if resp is not None:
+            resp.headers['Vary'] = 'Accept'
+            set_page_headers(resp, page)
+            return resp
+        resp = json_response(algorithms_list)
+        set_page_headers(resp, page)
+        if etag is not None:
+            set_validators(resp, etag)
         return resp
     else:
-        data = [{
-            "code": 400,
-            "fields": "string",
-            "message": "Malformed Data"
-        }]
-        js = json.dumps(data)
-        resp = Response(js, status=400, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return resp
+        return status_response(400, in_list=True)
+
+
+@app.route('/datasets/<dataset_id>/blob', methods=['GET'])
+def api_dataset_blob_get(dataset_id):
+    """
+     Download BLOB of a single dataset, it's streamed chunk by chunk
+    """
+    return stream_blob(DatasetDAO, dataset_id)
+
+
+@app.route('/datasets/<dataset_id>/blob', methods=['PUT'])
+@authenticated
+def api_dataset_blob_put(dataset_id, user_id=None):
+    """
+     Upload BLOB of an existing dataset, the request body is streamed into the BLOB store
+    """
+    return upload_blob(DatasetDAO, dataset_id)
 
 
 @app.route('/algorithms/<algorithm_id>', methods=['DELETE'])
@@ -276,14 +695,7 @@ def api_algorithm_delete(algorithm_id, user_id=None):
         resp = Response(status=200, mimetype='application/json')
         resp.headers['Content-Type'] = 'application/json; charset=utf-8'
     else:
-        data = {
-            "code": 404,
-            "fields": "string",
-            "message": "Not Found"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=404, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(404)
     return resp
 
 @app.route('/algorithms/', methods=['POST'])
@@ -295,50 +707,100 @@ def api_algorithms_post(user_id=None):
         algorithm = Algorithm(dict_data)
         returned_code = AlgorithmDAO.set(algorithm)
         if returned_code == 0:
-            data = {
-                "code": 200,
-                "fields": "string",
-                "message": "OK"
-            }
-            js = json.dumps(data)
-            resp = Response(js, status=200, mimetype='application/json')
-            resp.headers['Content-Type'] = 'application/json; charset=utf-8'
-            return resp
-    data = {
-        "code": 400,
-        "fields": "string",
-        "message": "Malformed Data"
-    }
-    js = json.dumps(data)
-    resp = Response(js, status=400, mimetype='application/json')
-    resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+            return status_response(200)
+        # Datastore or the index queue is not available
+        return status_response(503)
+    return status_response(400)
+
+
+@app.route('/algorithms/batch', methods=['GET'])
+def api_algorithms_batch_get():
+    """
+     Get many algorithms detailed information in a single call
+     ids: coma delimited list of algorithm ids
+     Returns a list in order of ids, algorithms which were not found are marked with code 404
+     fields: optional coma delimited list of fields to be returned, algorithmBLOB is never returned
+    """
+    algorithm_ids = get_batch_ids(request.args)
+    fields = get_fields(request.args, _ALGORITHM_FIELDS, 'algorithmBLOB')
+    if fields is None or 'algorithmBLOB' in fields:
+        return status_response(400, 'fields')
+    if algorithm_ids is None:
+        return status_response(400, 'ids')
+    result = AlgorithmDAO.getmulti(algorithm_ids)
+    if result not in [1, 2]:
+        algorithms_list = []
+        for algorithm_id in algorithm_ids:
+            if result[algorithm_id] not in [1, 2]:
+                algorithms_list.append(Algorithm(result[algorithm_id]).get_dict(fields))
+            else:
+                algorithms_list.append({
+                    "algorithmId": algorithm_id,
+                    "code": 404,
+                    "fields": "string",
+                    "message": "Not Found"
+                })
+        resp = json_response(algorithms_list)
+    else:
+        resp = status_response(404)
     return resp
 
 
+@app.route('/algorithms/import', methods=['POST'])
+@authenticated
+def api_algorithms_import(user_id=None):
+    """
+    Bulk import of algorithms from a streamed JSON array or NDJSON body
+    Returns a list with status of every algorithm in order of the body
+    """
+    return import_items(Algorithm, AlgorithmDAO, 'algorithmId')
+
+
 @app.route('/algorithms/<algorithm_id>', methods=['GET'])
 def api_algorithm_get(algorithm_id):
     """
      Get a single algorithm detailed information
-     Everything but algorithmBLOB
+     Everything but algorithmBLOB unless fields parameter, a coma delimited list of fields, says otherwise
     """
+    fields = get_fields(request.args, _ALGORITHM_FIELDS, 'algorithmBLOB')
+    if fields is None:
+        return status_response(400, 'fields')
     result = AlgorithmDAO.get(algorithm_id)
     if result not in [1, 2]:
-        algorithm = result.get_dict()
-        js = json.dumps(algorithm)
-        resp = Response(js, status=200, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        # BLOB writes update the timestamp too
+        etag = make_etag(result.gettimestamp(), fields)
+        resp = not_modified(etag, result.gettimestamp())
+        if resp is not None:
+            return resp
+        if 'algorithmBLOB' in fields:
+            # metadata comes from the cache again, BLOB is loaded only for responses returning it
+            result = AlgorithmDAO.get(algorithm_id, with_blob=True)
+    if result not in [1, 2]:
+        algorithm = result.get_dict(fields)
+        resp = json_response(algorithm)
+        set_validators(resp, etag, result.gettimestamp())
     else:
-        data = {
-            "code": 404,
-            "fields": "string",
-            "message": "Not Found"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=404, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(404)
     return resp
 
 
+@app.route('/algorithms/<algorithm_id>/blob', methods=['GET'])
+def api_algorithm_blob_get(algorithm_id):
+    """
+     Download BLOB of a single algorithm, it's streamed chunk by chunk
+    """
+    return stream_blob(AlgorithmDAO, algorithm_id)
+
+
+@app.route('/algorithms/<algorithm_id>/blob', methods=['PUT'])
+@authenticated
+def api_algorithm_blob_put(algorithm_id, user_id=None):
+    """
+     Upload BLOB of an existing algorithm, the request body is streamed into the BLOB store
+    """
+    return upload_blob(AlgorithmDAO, algorithm_id)
+
+
 @app.route('/user/', methods=['POST'])
 @authenticated
 def create_user(user_id=None):
@@ -360,34 +822,12 @@ def create_user(user_id=None):
         dict_data.update(dict_data1)
         user = User(dict_data)
     else:
-        data = {
-            "code": 400,
-            "fields": "Content-Type",
-            "message": "Malformed Data"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=400, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return resp
+        return status_response(400, 'Content-Type')
     returned_code = UserDAO.set(user)
     if returned_code == 0:
-        data = {
-            "code": 200,
-            "fields": "",
-            "message": "OK"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=200, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(200, '')
     else:
-        data = {
-            "code": 400,
-            "fields": "returned_code",
-            "message": "Malformed Data"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=400, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(400, 'returned_code')
     return resp
 
 
@@ -398,26 +838,12 @@ def self_sign_up(user_id=None):
     :param user_id: 'sub' field from Google id_token supplied in header Authenticate: Bearer <id_token>  
     :return: OK
     """
-    user = get_user_from_id_token(request.headers['Authorization'].split(" ")[1])
+    user = get_user_from_claims(g.id_token_claims)
     returned_code = UserDAO.set(user)
     if returned_code == 0:
-        data = {
-            "code": 200,
-            "fields": "",
-            "message": "OK"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=200, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(200, '')
     else:
-        data = {
-            "code": 400,
-            "fields": "string",
-            "message": "Malformed Data"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=400, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(400)
     return resp
 
 
@@ -432,23 +858,54 @@ def get_user_by_id(uid, user_id=None):
     """
     result = UserDAO.get(uid)
     if result != 1:
-        user = result.get_dict()
-        js = json.dumps(user)
-        user_data = Response(js, status=200, mimetype='application/json')
-        resp = user_data
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        etag = make_etag(result.gettimestamp())
+        resp = not_modified(etag, result.gettimestamp())
+        if resp is not None:
+            return resp
+        resp = json_response(result.to_dict())
+        set_validators(resp, etag, result.gettimestamp())
     else:
-        data = {
-            "code": 404,
-            "fields": "string",
-            "message": "Not Found"
-        }
-        js = json.dumps(data)
-        resp = Response(js, status=404, mimetype='application/json')
-        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+        resp = status_response(404)
     return resp
 
 
+@app.route('/stats/', methods=['GET'])
+@authenticated
+def stats(user_id=None):
+    """
+    Runtime counters of this worker process for monitoring, only for users of STATS_USERS
+
+    A section whose backend fails is null, the others are still returned.
+    """
+    if _STATS_USERS and user_id not in _STATS_USERS and g.id_token_claims.get('email') not in _STATS_USERS:
+        abort(403)
+    sections = {
+        'datastore': datastore_clients.stats,
+        'storage': storage.stats,
+        'search': search_sessions.stats,
+        'index_queue': index_queue.stats,
+        'id_tokens': id_token_cache.stats,
+        'id_token_certs': certificate_cache.stats,
+        'swagger': swagger_document.stats,
+        'swaggerui': swaggerui_assets.stats,
+        'compression': compression_middleware.stats,
+        'cache': lambda: {
+            'algorithms': algorithm_cache.stats(),
+            'datasets': dataset_cache.stats(),
+            'algorithms_search': algorithm_search_cache.stats(),
+            'datasets_search': dataset_search_cache.stats()
+        }
+    }
+    data = {}
+    for name, get_stats in sections.items():
+        try:
+            data[name] = get_stats()
+        except Exception:
+            logging.exception('Stats of %s failed', name)
+            data[name] = None
+    return json_response(data)
+
+
 @app.errorhandler(404)
 def error404(e):
     return """
@@ -468,6 +925,8 @@ def server_error(e):
 if __name__ == '__main__':
     # This is used when running locally. Gunicorn is used to run the
     # application on Google App Engine. See entry point in app.yaml.
+    if not index_queue.path:
+        raise RuntimeError('INDEX_QUEUE_PATH has to name the database file of the index queue, see app.yaml')
     #    app.run(host='0.0.0.0', port=5000, debug=True)
     app.run(host='localhost', port=5000, debug=False)
     # app.run(host='localhost', port=8080, debug=True)
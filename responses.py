@@ -0,0 +1,133 @@
+"""
+JSON responses of the API
+
+Bodies are encoded to bytes once and handed to Response as they are. Status bodies such as
+{"code": 404, "fields": "string", "message": "Not Found"} are the same in every response, so they
+are encoded only the first time and later responses just wrap the same bytes. Other data is encoded
+with orjson when it's installed, unless JSON_ENCODER=json, otherwise with json module of the standard
+library set up like the JSON provider of Flask. Keys are sorted by both encoders.
+
+Usage:
+return json_response(algorithm.to_dict(fields))
+return status_response(404)
+"""
+import json
+import os
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# encoder of dynamic payloads, orjson or json, orjson falls back to json when it isn't installed
+_JSON_ENCODER = os.environ.get('JSON_ENCODER', 'orjson')
+_CONTENT_TYPE = 'application/json; charset=utf-8'
+# messages of status bodies by their codes
+_STATUS_MESSAGES = {
+    200: 'OK',
+    400: 'Malformed Data',
+    404: 'Not Found',
+    503: 'Service Unavailable'
+}
+
+
+def encode_json(data):
+    """
+    Encodes data like flask.json.dumps with the default JSON provider
+
+    :rtype: bytes
+    """
+    return json.dumps(data, default=DefaultJSONProvider.default, ensure_ascii=True, sort_keys=True).encode('utf-8')
+
+
+if orjson is not None:
+    # dates are passed to the default function to be formatted as HTTP dates like by Flask
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def encode_orjson(data):
+        """
+        Encodes data with orjson, values it doesn't support, like integers over 64 bits, with json module
+
+        :rtype: bytes
+        """
+        try:
+            return orjson.dumps(data, default=DefaultJSONProvider.default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return encode_json(data)
+
+
+def get_encoder(name):
+    """
+    Gets a function encoding data to JSON bytes
+
+    :param name: orjson or json, json is returned for orjson when it isn't installed
+    :type name: str
+    :raises: ValueError for unknown names
+    """
+    if name == 'orjson':
+        return encode_orjson if orjson is not None else encode_json
+    if name == 'json':
+        return encode_json
+    raise ValueError('Unknown JSON encoder ' + name)
+
+
+encode = get_encoder(_JSON_ENCODER)
+# encoded status bodies by code, fields and whether they are wrapped in a list
+_status_bodies = {}
+
+
+def status_body(code, fields='string', in_list=False):
+    """
+    Encoded body of a status such as {"code": 400, "fields": "string", "message": "Malformed Data"}
+
+    :param code: HTTP status code, one of _STATUS_MESSAGES
+    :type code: int
+    :param fields: fields the status is about
+    :type fields: str
+    :param in_list: wrap the status in a list like listings do
+    :type in_list: bool
+    :rtype: bytes
+    """
+    key = (code, fields, in_list)
+    body = _status_bodies.get(key)
+    if body is None:
+        data = {"code": code, "fields": fields, "message": _STATUS_MESSAGES[code]}
+        body = encode_json([data] if in_list else data)
+        _status_bodies[key] = body
+    return body
+
+
+def bytes_response(body, status=200):
+    """
+    Response with an already encoded JSON body
+
+    :type body: bytes
+    :rtype: Response
+    """
+    return Response(body, status=status, content_type=_CONTENT_TYPE)
+
+
+def json_response(data, status=200):
+    """
+    Response with JSON encoded data
+
+    :rtype: Response
+    """
+    return Response(encode(data), status=status, content_type=_CONTENT_TYPE)
+
+
+def status_response(code, fields='string', in_list=False):
+    """
+    Response with a status body, see status_body
+
+    :rtype: Response
+    """
+    return Response(status_body(code, fields, in_list), status=code, content_type=_CONTENT_TYPE)
+
+
+# status bodies of the most frequent responses
+for _status in [(200, 'string', False), (200, '', False), (400, 'string', False), (400, 'fields', False),
+                (400, 'string', True), (404, 'string', False), (503, 'string', False)]:
+    status_body(*_status)
@@ -0,0 +1,439 @@
+"""
+Storage backends of the users, algorithms and datasets kinds
+
+DAOs keep entities through a backend chosen by STORAGE_URL, every entity is a dictionary of
+properties stored under a kind and a name (the id of the item):
+
+''                  DatastoreStorage, Google Cloud Datastore through connections.datastore_clients
+memory://           MemoryStorage, dictionaries of the current process, for tests and benchmarks
+sqlite:///path      SQLiteStorage, a local SQLite database shared by all processes of the machine
+
+Backends without a cloud dependency are meant for single machine deployments and benchmarks,
+BLOBs are kept apart by blobstore.py, so such deployments set BLOB_STORE_URL=file:///path too,
+dao.py refuses to start without it.
+
+Every backend has get(kind, name), get_multi(kind, names), put(kind, name, properties, unindexed),
+put_multi(kind, items, unindexed), update(kind, name, changes), delete(kind, name),
+delete_multi(kind, names) and stats(). Property values are str, bytes, int, float, bool, None or
+datetime, errors are raised as StorageError.
+
+Usage:
+storage = get_storage()
+storage.put('algorithms', algorithm_id, {'timestamp': datetime.now(timezone.utc)}, unindexed=('algorithmDescription',))
+properties = storage.get('algorithms', algorithm_id)
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+from google.api_core import exceptions as api_exceptions
+from google.cloud import datastore
+from connections import datastore_clients
+
+# '' for Datastore, memory:// or sqlite:///path
+_STORAGE_URL = os.environ.get('STORAGE_URL', '')
+# seconds a SQLite connection waits for a write lock held by another connection
+_SQLITE_TIMEOUT = float(os.environ.get('SQLITE_TIMEOUT', 30))
+# attempts of a Datastore update whose transaction conflicted with another one
+_DATASTORE_UPDATE_ATTEMPTS = int(os.environ.get('DATASTORE_UPDATE_ATTEMPTS', 3))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    properties TEXT NOT NULL,
+    PRIMARY KEY (kind, name)
+) WITHOUT ROWID;
+"""
+# statements have constant text so that the statement cache of sqlite3 prepares each of them once per connection
+_SELECT = 'SELECT properties FROM entities WHERE kind = ? AND name = ?'
+_UPSERT = 'INSERT OR REPLACE INTO entities (kind, name, properties) VALUES (?, ?, ?)'
+_DELETE = 'DELETE FROM entities WHERE kind = ? AND name = ?'
+
+
+class StorageError(Exception):
+    """Exception raised when entities can't be read or written"""
+    pass
+
+
+def _counters():
+    return {'reads': 0, 'writes': 0, 'deletes': 0, 'errors': 0}
+
+
+class DatastoreStorage:
+    """Keeps entities in Google Cloud Datastore, properties named in unindexed are excluded from indexes"""
+
+    def __init__(self, clients=datastore_clients):
+        """
+        :param clients: manager of Datastore clients
+        :type clients: connections.DatastoreClientManager
+        """
+        self.clients = clients
+        self._lock = threading.Lock()
+        self._counters = _counters()
+
+    def _count(self, name, number=1):
+        with self._lock:
+            self._counters[name] += number
+
+    def _fail(self, err, action):
+        self._count('errors')
+        self.clients.report_failure(err)
+        return StorageError(action + ' failed')
+
+    def get(self, kind, name):
+        """
+        :returns: properties or None if there is no such entity
+        :rtype: dict
+        :raises: StorageError
+        """
+        self._count('reads')
+        ds = self.clients.get()
+        try:
+            return ds.get(ds.key(kind, name))
+        except Exception as err:
+            raise self._fail(err, 'Reading ' + kind + ' ' + name) from err
+
+    def get_multi(self, kind, names):
+        """
+        Gets many entities with a single lookup
+
+        :returns: properties of found entities by name
+        :rtype: dict
+        :raises: StorageError
+        """
+        self._count('reads', len(names))
+        ds = self.clients.get()
+        try:
+            entities = ds.get_multi([ds.key(kind, name) for name in names])
+        except Exception as err:
+            raise self._fail(err, 'Reading ' + kind) from err
+        return {entity.key.name: entity for entity in entities}
+
+    def put(self, kind, name, properties, unindexed=()):
+        """
+        Writes an entity replacing the previous one
+
+        :param unindexed: names of properties excluded from indexes, e.g. long texts
+        :type unindexed: tuple
+        :raises: StorageError
+        """
+        self.put_multi(kind, [(name, properties)], unindexed)
+
+    def put_multi(self, kind, items, unindexed=()):
+        """
+        Writes many entities with a single commit
+
+        :param items: tuples (name, properties)
+        :type items: list
+        :raises: StorageError
+        """
+        self._count('writes', len(items))
+        ds = self.clients.get()
+        try:
+            entities = []
+            for name, properties in items:
+                entity = datastore.Entity(key=ds.key(kind, name), exclude_from_indexes=unindexed)
+                entity.update(properties)
+                entities.append(entity)
+            if len(entities) == 1:
+                ds.put(entities[0])
+            else:
+                ds.put_multi(entities)
+        except Exception as err:
+            raise self._fail(err, 'Writing ' + kind) from err
+
+    def update(self, kind, name, changes):
+        """
+        Changes some properties of an existing entity, the others and their indexing are kept
+
+        The entity is read and written in a transaction, so concurrent updates don't overwrite each other,
+        one conflicting with another is attempted again up to DATASTORE_UPDATE_ATTEMPTS times.
+
+        :param changes: new values of properties
+        :type changes: dict
+        :returns: False if there is no such entity
+        :rtype: bool
+        :raises: StorageError
+        """
+        self._count('writes')
+        ds = self.clients.get()
+        for attempt in range(1, _DATASTORE_UPDATE_ATTEMPTS + 1):
+            try:
+                with ds.transaction():
+                    entity = ds.get(ds.key(kind, name))
+                    if entity is None:
+                        return False
+                    entity.update(changes)
+                    ds.put(entity)
+                return True
+            except api_exceptions.Conflict as err:
+                if attempt == _DATASTORE_UPDATE_ATTEMPTS:
+                    raise self._fail(err, 'Updating ' + kind + ' ' + name) from err
+            except Exception as err:
+                raise self._fail(err, 'Updating ' + kind + ' ' + name) from err
+
+    def delete(self, kind, name):
+        """:raises: StorageError"""
+        self.delete_multi(kind, [name])
+
+    def delete_multi(self, kind, names):
+        """:raises: StorageError"""
+        self._count('deletes', len(names))
+        ds = self.clients.get()
+        try:
+            ds.delete_multi([ds.key(kind, name) for name in names])
+        except Exception as err:
+            raise self._fail(err, 'Deleting ' + kind) from err
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['backend'] = 'datastore'
+        return stats
+
+
+class MemoryStorage:
+    """
+    Keeps entities in a dictionary of the current process
+
+    Properties are copied on the way in and out, so callers may modify what they get.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entities = {}
+        self._counters = _counters()
+
+    def get(self, kind, name):
+        with self._lock:
+            self._counters['reads'] += 1
+            properties = self._entities.get((kind, name))
+        return dict(properties) if properties is not None else None
+
+    def get_multi(self, kind, names):
+        found = {}
+        with self._lock:
+            self._counters['reads'] += len(names)
+            for name in names:
+                properties = self._entities.get((kind, name))
+                if properties is not None:
+                    found[name] = properties
+        return {name: dict(properties) for name, properties in found.items()}
+
+    def put(self, kind, name, properties, unindexed=()):
+        self.put_multi(kind, [(name, properties)], unindexed)
+
+    def put_multi(self, kind, items, unindexed=()):
+        with self._lock:
+            for name, properties in items:
+                self._entities[(kind, name)] = dict(properties)
+            self._counters['writes'] += len(items)
+
+    def update(self, kind, name, changes):
+        with self._lock:
+            properties = self._entities.get((kind, name))
+            if properties is None:
+                return False
+            self._entities[(kind, name)] = dict(properties, **changes)
+            self._counters['writes'] += 1
+        return True
+
+    def delete(self, kind, name):
+        self.delete_multi(kind, [name])
+
+    def delete_multi(self, kind, names):
+        with self._lock:
+            for name in names:
+                self._entities.pop((kind, name), None)
+            self._counters['deletes'] += len(names)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entities'] = len(self._entities)
+        stats['backend'] = 'memory'
+        return stats
+
+
+def _encode_value(value):
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError('Property of type ' + type(value).__name__ + ' can not be stored')
+
+
+def _decode_value(value):
+    if '$bytes' in value:
+        return base64.b64decode(value['$bytes'])
+    if '$datetime' in value:
+        return datetime.fromisoformat(value['$datetime'])
+    return value
+
+
+def serialize_properties(properties):
+    """
+    Serializes properties to JSON, bytes and datetime values are tagged so that they are read back as they were
+
+    :rtype: str
+    """
+    return json.dumps(properties, default=_encode_value, separators=(',', ':'))
+
+
+def deserialize_properties(text):
+    """
+    Reads properties serialized by serialize_properties
+
+    :rtype: dict
+    """
+    return json.loads(text, object_hook=_decode_value)
+
+
+class SQLiteStorage:
+    """
+    Keeps entities in a SQLite database file, one row per entity with properties serialized as JSON
+
+    The database is in WAL mode, so readers never wait for the writer and every process or thread
+    reads through its own connection. Statements are prepared once per connection and reused, writes
+    of many entities go in a single transaction.
+    """
+
+    def __init__(self, path, timeout=_SQLITE_TIMEOUT):
+        """
+        :param path: database file, it's created if it doesn't exist
+        :type path: str
+        :param timeout: seconds a write waits for the lock held by another connection
+        :type timeout: float
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._counters = _counters()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        """Connection of the current thread, connections of the parent process are never used in a forked child"""
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # WAL with synchronous=NORMAL survives crashes of the process without an fsync per commit
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _count(self, name, number=1):
+        with self._lock:
+            self._counters[name] += number
+
+    def _fail(self, err, action):
+        self._count('errors')
+        return StorageError(action + ' failed')
+
+    def get(self, kind, name):
+        self._count('reads')
+        try:
+            row = self._connect().execute(_SELECT, (kind, name)).fetchone()
+        except sqlite3.Error as err:
+            raise self._fail(err, 'Reading ' + kind + ' ' + name) from err
+        return deserialize_properties(row[0]) if row is not None else None
+
+    def get_multi(self, kind, names):
+        self._count('reads', len(names))
+        connection = self._connect()
+        found = {}
+        try:
+            # a single read transaction sees all entities as of the same moment
+            connection.execute('BEGIN')
+            try:
+                for name in names:
+                    row = connection.execute(_SELECT, (kind, name)).fetchone()
+                    if row is not None:
+                        found[name] = row[0]
+            finally:
+                connection.execute('COMMIT')
+        except sqlite3.Error as err:
+            raise self._fail(err, 'Reading ' + kind) from err
+        return {name: deserialize_properties(text) for name, text in found.items()}
+
+    def _write(self, statement, rows, action):
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(statement, rows)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as err:
+            raise self._fail(err, action) from err
+
+    def put(self, kind, name, properties, unindexed=()):
+        self.put_multi(kind, [(name, properties)], unindexed)
+
+    def put_multi(self, kind, items, unindexed=()):
+        rows = [(kind, name, serialize_properties(properties)) for name, properties in items]
+        self._write(_UPSERT, rows, 'Writing ' + kind)
+        self._count('writes', len(rows))
+
+    def update(self, kind, name, changes):
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(_SELECT, (kind, name)).fetchone()
+                if row is not None:
+                    properties = deserialize_properties(row[0])
+                    properties.update(changes)
+                    connection.execute(_UPSERT, (kind, name, serialize_properties(properties)))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as err:
+            raise self._fail(err, 'Updating ' + kind + ' ' + name) from err
+        if row is None:
+            return False
+        self._count('writes')
+        return True
+
+    def delete(self, kind, name):
+        self.delete_multi(kind, [name])
+
+    def delete_multi(self, kind, names):
+        self._write(_DELETE, [(kind, name) for name in names], 'Deleting ' + kind)
+        self._count('deletes', len(names))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['backend'] = 'sqlite'
+        stats['path'] = self.path
+        return stats
+
+
+def get_storage(url=_STORAGE_URL):
+    """
+    Creates storage backend for url
+
+    :param url: '' for DatastoreStorage, memory:// for MemoryStorage or sqlite:///path for SQLiteStorage
+    :type url: str
+    """
+    if url == '':
+        return DatastoreStorage()
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryStorage()
+    if parsed.scheme == 'sqlite' and parsed.path:
+        return SQLiteStorage(parsed.path)
+    raise ValueError('Unsupported STORAGE_URL ' + url)
@@ -0,0 +1,154 @@
+import asyncio
+import atexit
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+# the index queue of dao.py is kept in a temporary directory of this test run
+_QUEUE_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _QUEUE_DIR, True)
+os.environ.setdefault('INDEX_QUEUE_PATH', os.path.join(_QUEUE_DIR, 'index-queue.sqlite3'))
+
+import asgi
+import asyncdao
+import dao
+import main
+
+
+class FakeSearchHandler(BaseHTTPRequestHandler):
+    """Answers every search with the same two algorithms"""
+    protocol_version = 'HTTP/1.1'
+    requests_count = 0
+
+    def do_GET(self):
+        FakeSearchHandler.requests_count += 1
+        body = json.dumps([{'algorithmId': 'a' + str(number)} for number in range(2)]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def call(path, query_string=b'', headers=()):
+    """Sends a GET through the ASGI app, returns status, headers and body"""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string,
+             'headers': list(headers), 'http_version': '1.1', 'scheme': 'http'}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    response_headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in messages[0]['headers']}
+    return messages[0]['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+class AsgiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSearchHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:' + str(self.server.server_port)
+        self.patch = mock.patch('asyncdao.get_search_url', return_value=url)
+        self.patch.start()
+        dao.algorithm_search_cache.clear()
+        FakeSearchHandler.requests_count = 0
+
+    def tearDown(self):
+        self.patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        dao.algorithm_search_cache.clear()
+
+    def test_algorithms_GET(self):
+        """listing is served by a coroutine, the second one comes from the shared cache"""
+        status, headers, body = call('/algorithms/')
+        self.assertEqual(200, status)
+        self.assertEqual([{'algorithmId': 'a0'}, {'algorithmId': 'a1'}], json.loads(body.decode('utf-8')))
+        status, headers, body = call('/algorithms/', headers=[(b'if-none-match', headers['etag'].encode())])
+        self.assertEqual(304, status)
+        self.assertEqual(1, FakeSearchHandler.requests_count)
+
+    def test_algorithms_GET_Page(self):
+        """a page has the same headers as from main.py"""
+        status, headers, body = call('/algorithms/', b'limit=1')
+        self.assertEqual(200, status)
+        self.assertEqual('2', headers['total-count'])
+        self.assertEqual([{'algorithmId': 'a0'}], json.loads(body.decode('utf-8')))
+
+    def test_algorithms_GET_Gzip(self):
+        """responses of coroutines are compressed like those of the Flask app"""
+        with mock.patch.object(main.compression_middleware, 'min_size', 0):
+            status, headers, body = call('/algorithms/', headers=[(b'accept-encoding', b'gzip')])
+        self.assertEqual(200, status)
+        self.assertEqual('gzip', headers['content-encoding'])
+        self.assertIn('Accept-Encoding', headers['vary'])
+        self.assertTrue(headers['etag'].startswith('W/'))
+        self.assertEqual([{'algorithmId': 'a0'}, {'algorithmId': 'a1'}], json.loads(gzip.decompress(body)))
+
+    def test_algorithms_GET_WrongTags(self):
+        status, headers, body = call('/algorithms/', b'tags=%20')
+        self.assertEqual(400, status)
+        self.assertEqual(0, FakeSearchHandler.requests_count)
+
+    def test_getindex_MalformedResponse(self):
+        """a body 17ZSearch answered with which isn't JSON is a server error, not an exception"""
+        with mock.patch('asyncdao.search_get', mock.AsyncMock(return_value=(200, '<html>'))):
+            self.assertEqual(3, asyncio.run(asyncdao.AsyncAlgorithmDAO.getindex('a1')))
+
+    def test_other_routes_Delegated(self):
+        """requests without a coroutine are served by the Flask app"""
+        status, headers, body = call('/doc/')
+        self.assertEqual(302, status)
+        status, headers, body = call('/nothing-here')
+        self.assertEqual(404, status)
+
+    def test_batch_GET_Delegated(self):
+        """batch requests are served by the Flask app and don't match the item coroutines"""
+        for path in ['/algorithms/batch', '/datasets/batch']:
+            status, headers, body = call(path)
+            self.assertEqual(400, status)
+            self.assertEqual('ids', json.loads(body.decode('utf-8'))['fields'])
+
+
+    def test_other_routes_StreamedBody(self):
+        """the body of a delegated request is received while the WSGI app reads it, not before"""
+        chunks = [b'first ', b'second ', b'third']
+        received = []
+
+        def wsgi_app(environ, start_response):
+            received_before = len(received)
+            body = environ['wsgi.input'].read()
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [str(received_before).encode() + b' ' + body]
+
+        async def receive():
+            received.append(chunks[len(received)])
+            return {'type': 'http.request', 'body': received[-1], 'more_body': len(received) < len(chunks)}
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'PUT', 'path': '/algorithms/a1/blob', 'query_string': b'',
+                 'headers': [], 'http_version': '1.1', 'scheme': 'http'}
+        asyncio.run(asgi.AsyncApp(wsgi_app, asgi.async_routes)(scope, receive, send))
+        self.assertEqual(200, messages[0]['status'])
+        self.assertEqual(b'0 first second third', b''.join(message.get('body', b'') for message in messages[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import assets
+
+
+class FileDocumentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'document.json')
+        with open(self.path, 'wb') as document_file:
+            document_file.write(b'{"version": 1, "paths": "' + b'/algorithms/' * 100 + b'"}')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_BuiltOnce(self):
+        document = assets.FileDocument(self.path, 'application/json', transform=lambda body: body.upper())
+        encoded = document.get()
+        self.assertTrue(encoded.body.startswith(b'{"VERSION": 1, "PATHS": "/ALGORITHMS/'))
+        self.assertEqual(encoded.body, gzip.decompress(encoded.gzip_body))
+        self.assertIs(encoded, document.get())
+        self.assertEqual(1, document.stats()['builds'])
+
+    def test_get_RebuiltOnChange(self):
+        """a changed file is read again and gets a different ETag"""
+        document = assets.FileDocument(self.path, 'application/json')
+        etag = document.get().etag
+        with open(self.path, 'wb') as document_file:
+            document_file.write(b'{"version": 22}')
+        self.assertEqual(b'{"version": 22}', document.get().body)
+        self.assertNotEqual(etag, document.get().etag)
+        self.assertEqual(2, document.stats()['builds'])
+
+
+class StaticDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        files = {
+            'index.html': b'<link href="./style.css" ><script src="./missing.js"></script>' + b' ' * 200,
+            'style.css': b'body { margin: 0; }\n' * 50,
+            'image.png': os.urandom(500),
+        }
+        for name, body in files.items():
+            with open(os.path.join(self.root, name), 'wb') as asset_file:
+                asset_file.write(body)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_LinksVersioned(self):
+        """links of HTML pages to assets of the directory carry their versions"""
+        assets_dir = assets.StaticDirectory(self.root, preload=True)
+        style = assets_dir.get('style.css')
+        self.assertEqual('text/css; charset=utf-8', style.mimetype)
+        index = assets_dir.get('index.html')
+        self.assertIn(b'href="./style.css?v=' + style.version.encode() + b'"', index.body)
+        self.assertIn(b'src="./missing.js"', index.body)
+        self.assertEqual(3, assets_dir.stats()['assets'])
+
+    def test_get_Variants(self):
+        """incompressible assets are kept only as they are"""
+        assets_dir = assets.StaticDirectory(self.root, preload=False)
+        self.assertEqual(['gzip'], list(assets_dir.get('style.css').variants))
+        self.assertEqual({}, assets_dir.get('image.png').variants)
+
+    def test_get_Missing(self):
+        assets_dir = assets.StaticDirectory(self.root, preload=False)
+        self.assertIsNone(assets_dir.get('nothing.js'))
+        self.assertIsNone(assets_dir.get('../' + os.path.basename(self.root) + '/style.css'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from flask import Flask, g
+from oauth2client import crypt
+import authentication
+
+# local key set, id_token_certs.json holds the certificate of id_token_key.pem under key id 'test'
+_TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+_CERTS_URL = 'file://' + os.path.join(_TESTDATA, 'id_token_certs.json')
+
+
+def make_claims(exp):
+    return {'iss': 'accounts.google.com', 'sub': '1234', 'aud': 'test', 'iat': int(time.time()), 'exp': exp,
+            'given_name': 'Test', 'family_name': 'User', 'email': 'testuser@gmail.com'}
+
+
+def make_token(claims):
+    """ID token signed with the local test key"""
+    with open(os.path.join(_TESTDATA, 'id_token_key.pem')) as key_file:
+        signer = crypt.Signer.from_string(key_file.read())
+    return crypt.make_signed_jwt(signer, claims, key_id='test').decode('ascii')
+
+
+class CertsHandler(BaseHTTPRequestHandler):
+    """Serves the local key set like Google does, with Cache-Control and Age"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with open(os.path.join(_TESTDATA, 'id_token_certs.json'), 'rb') as certs_file:
+            body = certs_file.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'public, max-age=120, must-revalidate, no-transform')
+        self.send_header('Age', '20')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class IdTokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        authentication.id_token_cache.clear()
+        self.certs_patch = mock.patch.object(authentication, 'certificate_cache',
+                                             authentication.CertificateCache(_CERTS_URL, path=None))
+        self.certs_patch.start()
+        self.patch = mock.patch('authentication.crypt.verify_signed_jwt_with_certs',
+                                wraps=crypt.verify_signed_jwt_with_certs)
+        self.verify_id_token = self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.certs_patch.stop()
+        authentication.id_token_cache.clear()
+
+    def test_verify_Cached(self):
+        """a token is verified once, then its claims come from the cache"""
+        token = make_token(make_claims(int(time.time()) + 600))
+        self.assertEqual('1234', authentication.verify_google_id_token(token))
+        self.assertEqual('1234', authentication.verify_google_id_token(token))
+        self.assertEqual(1, self.verify_id_token.call_count)
+
+    def test_verify_ExpiredNotCached(self):
+        """claims of a token past its exp are not kept"""
+        self.verify_id_token.return_value = make_claims(int(time.time()) - 1)
+        authentication.verify_google_id_token('token')
+        authentication.verify_google_id_token('token')
+        self.assertEqual(2, self.verify_id_token.call_count)
+
+    def test_verify_InvalidNotCached(self):
+        """tokens with a wrong signature are rejected every time"""
+        token = make_token(make_claims(int(time.time()) + 600))
+        token = token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB')
+        self.assertIsNone(authentication.verify_google_id_token(token))
+        self.assertIsNone(authentication.verify_google_id_token(token))
+        self.assertEqual(2, self.verify_id_token.call_count)
+
+    def test_authenticated_PassesClaims(self):
+        """the decorator passes sub and leaves claims in g for the view"""
+        token = make_token(make_claims(int(time.time()) + 600))
+        app = Flask(__name__)
+
+        @app.route('/')
+        @authentication.authenticated
+        def view(user_id=None):
+            return authentication.get_user_from_claims(g.id_token_claims).getemail() + ' ' + user_id
+
+        response = app.test_client().get('/', headers={'Authorization': 'Bearer ' + token})
+        self.assertEqual(b'testuser@gmail.com 1234', response.data)
+        self.assertEqual(1, self.verify_id_token.call_count)
+
+
+class CertificateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'certs.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_max_age(self):
+        self.assertEqual(120, authentication.get_max_age('public, max-age=120, must-revalidate'))
+        self.assertEqual(0, authentication.get_max_age('no-cache, max-age=120'))
+        self.assertIsNone(authentication.get_max_age('public'))
+        self.assertIsNone(authentication.get_max_age(None))
+
+    def test_get_HonoursMaxAge(self):
+        """certificates expire after max-age less Age of the response"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CertsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            certs = authentication.CertificateCache('http://127.0.0.1:' + str(server.server_port) + '/certs',
+                                                    self.path)
+            self.assertEqual(['test'], list(certs.get()))
+            self.assertAlmostEqual(100, certs.stats()['expires_in'], delta=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_get_FromDisk(self):
+        """a restarted worker takes the copy on disk without fetching"""
+        authentication.CertificateCache(_CERTS_URL, self.path).get()
+        certs = authentication.CertificateCache('http://127.0.0.1:1/certs', self.path)
+        self.assertEqual(['test'], list(certs.get()))
+        stats = certs.stats()
+        self.assertEqual(0, stats['fetches'])
+        self.assertEqual(1, stats['disk_loads'])
+
+    def test_get_FromDisk_WritableByOthers(self):
+        """a copy other users can write is never loaded"""
+        authentication.CertificateCache(_CERTS_URL, self.path).get()
+        os.chmod(self.path, 0o666)
+        certs = authentication.CertificateCache(_CERTS_URL, self.path)
+        certs.get()
+        stats = certs.stats()
+        self.assertEqual(1, stats['fetches'])
+        self.assertEqual(0, stats['disk_loads'])
+
+    def test_get_StaleWhenRefreshFails(self):
+        """expired certificates are used while they can't be refreshed"""
+        with open(self.path, 'w') as certs_file:
+            json.dump({'expires_at': time.time() - 1, 'certs': {'old': 'pem'}}, certs_file)
+        certs = authentication.CertificateCache('http://127.0.0.1:1/certs', self.path)
+        self.assertEqual({'old': 'pem'}, certs.get())
+        self.assertEqual({'old': 'pem'}, certs.get())
+        self.assertEqual(1, certs.stats()['fetch_errors'])
+
+    def test_refresh_delay_ShortMaxAge(self):
+        """certificates expiring within refresh_margin are refreshed every retry_interval, not in a loop"""
+        certs = authentication.CertificateCache(_CERTS_URL, None, refresh_margin=300, retry_interval=30)
+        certs._expires_at = time.time() + 10
+        self.assertEqual(30, certs._refresh_delay())
+        certs._expires_at = time.time() + 3900
+        self.assertAlmostEqual(3600, certs._refresh_delay(), delta=5)
+
+    def test_get_NoCertificates(self):
+        certs = authentication.CertificateCache('http://127.0.0.1:1/certs', None)
+        with self.assertRaises(authentication.CertificateError):
+            certs.get()
+
+
+if __name__ == '__main__':
+    unittest.main()
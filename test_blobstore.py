@@ -0,0 +1,121 @@
+import io
+import shutil
+import tempfile
+import unittest
+from google.cloud import datastore
+import blobstore
+import connections
+
+
+class FakeDatastoreClient:
+    """Keeps entities in a dictionary by key, puts fail once `failing_puts` is down to 0"""
+    def __init__(self):
+        self.entities = {}
+        self.failing_puts = None
+
+    def key(self, *path):
+        return datastore.Key(*path, project='test')
+
+    def get(self, key):
+        return self.entities.get(key)
+
+    def get_multi(self, keys):
+        return [self.entities[key] for key in keys if key in self.entities]
+
+    def put(self, entity):
+        if self.failing_puts is not None:
+            if self.failing_puts == 0:
+                raise ConnectionError('down')
+            self.failing_puts -= 1
+        self.entities[entity.key] = entity
+
+    def delete(self, key):
+        self.entities.pop(key, None)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+
+class SlowStream(io.BytesIO):
+    """Returns at most 3 bytes from every read like a socket would"""
+    def read(self, size=-1):
+        return super().read(min(size, 3))
+
+
+class IterStreamTestCase(unittest.TestCase):
+    def test_iter_stream_ShortReads(self):
+        """chunks are full even when the stream returns less than asked for"""
+        chunks = list(blobstore.iter_stream(SlowStream(b'0123456789'), 4))
+        self.assertEqual([b'0123', b'4567', b'89'], chunks)
+
+
+class DatastoreBlobBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatastoreClient()
+        clients = connections.DatastoreClientManager(factory=lambda: self.client, health_check_interval=3600)
+        self.store = blobstore.DatastoreBlobBackend(clients, chunk_size=4, read_ahead=2)
+
+    def test_write_then_open(self):
+        """BLOB is split into chunks and read back whole"""
+        self.assertEqual(10, self.store.write('blobs', 'a1', io.BytesIO(b'0123456789')))
+        reader = self.store.open('blobs', 'a1')
+        self.assertEqual(10, reader.size)
+        self.assertEqual([b'0123', b'4567', b'89'], list(reader))
+        self.assertEqual(4, len(self.client.entities))
+
+    def test_overwrite_deletes_previous_chunks(self):
+        """only chunks of the latest write are kept"""
+        self.store.write('blobs', 'a1', io.BytesIO(b'0123456789'))
+        self.store.write('blobs', 'a1', io.BytesIO(b'abc'))
+        self.assertEqual(b'abc', self.store.open('blobs', 'a1').read())
+        self.assertEqual(2, len(self.client.entities))
+
+    def test_failed_write_keeps_previous(self):
+        """a write failing halfway leaves the previous BLOB readable and no orphaned chunks"""
+        self.store.write('blobs', 'a1', io.BytesIO(b'abc'))
+        self.client.failing_puts = 1
+        with self.assertRaises(blobstore.BlobStoreError):
+            self.store.write('blobs', 'a1', io.BytesIO(b'0123456789'))
+        self.assertEqual(b'abc', self.store.open('blobs', 'a1').read())
+        self.assertEqual(2, len(self.client.entities))
+
+    def test_open_NotFound(self):
+        """missing manifest means BlobNotFoundError"""
+        with self.assertRaises(blobstore.BlobNotFoundError):
+            self.store.open('blobs', 'a1')
+
+
+class FilesystemBlobBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = blobstore.FilesystemBlobBackend(self.root, chunk_size=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_write_then_open(self):
+        """BLOB is read back in chunks"""
+        self.store.write('blobs', 'a1', SlowStream(b'0123456789'))
+        reader = self.store.open('blobs', 'a1')
+        self.assertEqual(10, reader.size)
+        self.assertEqual([b'0123', b'4567', b'89'], list(reader))
+
+    def test_ids_stay_inside_root(self):
+        """ids with path separators don't escape the store"""
+        self.store.write('blobs', '../../a1', io.BytesIO(b'abc'))
+        self.assertEqual(b'abc', self.store.open('blobs', '../../a1').read())
+        with self.assertRaises(blobstore.BlobNotFoundError):
+            self.store.open('blobs', 'a1')
+
+    def test_delete(self):
+        """deleted BLOB is not found, deleting it again isn't an error"""
+        self.store.write('blobs', 'a1', io.BytesIO(b'abc'))
+        self.store.delete('blobs', 'a1')
+        self.store.delete('blobs', 'a1')
+        with self.assertRaises(blobstore.BlobNotFoundError):
+            self.store.open('blobs', 'a1')
+
+
+if __name__ == '__main__':
+    unittest.main()
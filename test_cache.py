@@ -0,0 +1,145 @@
+import time
+import unittest
+import cache
+
+
+class CountingLoader:
+    """Loader returning value + number of calls so far"""
+    def __init__(self, value='value'):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self, key):
+        self.calls += 1
+        return self.value + str(self.calls)
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_lru_eviction(self):
+        """least recently used entry is evicted when the cache is full"""
+        lru = cache.TTLCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(1, lru.get('a'))
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(1, lru.stats()['evictions'])
+
+    def test_ttl_expiration(self):
+        """entry is not returned after its ttl"""
+        ttl_cache = cache.TTLCache(maxsize=2, ttl=0.05)
+        ttl_cache.set('a', 1)
+        time.sleep(0.06)
+        self.assertIsNone(ttl_cache.get('a'))
+        self.assertEqual(1, ttl_cache.stats()['expirations'])
+
+
+class ReadThroughCacheTestCase(unittest.TestCase):
+    def test_get_or_load_Hit(self):
+        """second lookup is served from cache"""
+        loader = CountingLoader()
+        items = cache.ReadThroughCache('items', 10, 60)
+        self.assertEqual('value1', items.get_or_load('a', loader))
+        self.assertEqual('value1', items.get_or_load('a', loader))
+        self.assertEqual(1, loader.calls)
+        self.assertEqual(1, items.stats()['hits'])
+        self.assertEqual(1, items.stats()['misses'])
+
+    def test_get_or_load_NotCacheable(self):
+        """error codes are not stored"""
+        items = cache.ReadThroughCache('items', 10, 60)
+        loader = CountingLoader()
+        items.get_or_load('a', loader, lambda value: False)
+        items.get_or_load('a', loader, lambda value: False)
+        self.assertEqual(2, loader.calls)
+
+    def test_invalidate(self):
+        """value is loaded again after invalidation"""
+        loader = CountingLoader()
+        items = cache.ReadThroughCache('items', 10, 60)
+        items.get_or_load('a', loader)
+        items.invalidate('a')
+        self.assertEqual('value2', items.get_or_load('a', loader))
+
+    def test_invalidate_DuringLoad(self):
+        """value loaded while an invalidation happened is not stored"""
+        items = cache.ReadThroughCache('items', 10, 60)
+
+        def racing_loader(key):
+            items.invalidate(key)
+            return 'old'
+        items.get_or_load('a', racing_loader)
+        self.assertEqual(0, items.stats()['size'])
+
+    def test_invalidate_Shared(self):
+        """invalidation in one worker makes copies in other workers stale"""
+        shared = cache.LocalSharedBackend()
+        worker1 = cache.ReadThroughCache('items', 10, 60, shared)
+        worker2 = cache.ReadThroughCache('items', 10, 60, shared)
+        loader = CountingLoader()
+        worker2.get_or_load('a', loader)
+        worker1.invalidate('a')
+        self.assertEqual('value2', worker2.get_or_load('a', loader))
+        self.assertEqual('value2', worker2.get_or_load('a', loader))
+
+    def test_shared_backend_failure(self):
+        """when the shared backend fails the loader is used and nothing is stored"""
+        class BrokenBackend:
+            def get(self, key):
+                raise ConnectionError()
+
+            def incr(self, key):
+                raise ConnectionError()
+        items = cache.ReadThroughCache('items', 10, 60, BrokenBackend())
+        loader = CountingLoader()
+        items.get_or_load('a', loader)
+        items.get_or_load('a', loader)
+        self.assertEqual(2, loader.calls)
+        self.assertEqual(2, items.stats()['shared_errors'])
+
+
+class SearchResultCacheTestCase(unittest.TestCase):
+    def test_get_or_load_Fresh(self):
+        """fresh result is served from cache"""
+        loader = CountingLoader()
+        results = cache.SearchResultCache('search', 10, 60, 60)
+        results.get_or_load(('a', 'b'), loader)
+        self.assertEqual('value1', results.get_or_load(('a', 'b'), loader))
+        self.assertEqual(1, loader.calls)
+
+    def test_get_or_load_StaleWhileRevalidate(self):
+        """stale result is served once while it's refreshed in background"""
+        loader = CountingLoader()
+        results = cache.SearchResultCache('search', 10, 0.01, 60)
+        results.get_or_load(('a',), loader)
+        time.sleep(0.02)
+        self.assertEqual('value1', results.get_or_load(('a',), loader))
+        for _ in range(100):
+            if results.stats()['refreshes'] == 1 and not results._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual('value2', results.get_or_load(('a',), loader))
+        self.assertLessEqual(1, results.stats()['stale_hits'])
+
+    def test_get_or_load_Expired(self):
+        """result past its stale period is loaded synchronously"""
+        loader = CountingLoader()
+        results = cache.SearchResultCache('search', 10, 0.01, 0.01)
+        results.get_or_load(('a',), loader)
+        time.sleep(0.03)
+        self.assertEqual('value2', results.get_or_load(('a',), loader))
+
+    def test_clear_Shared(self):
+        """write in one worker invalidates results of every worker"""
+        shared = cache.LocalSharedBackend()
+        worker1 = cache.SearchResultCache('search', 10, 60, 60, shared)
+        worker2 = cache.SearchResultCache('search', 10, 60, 60, shared)
+        loader = CountingLoader()
+        worker2.get_or_load(('a',), loader)
+        worker1.clear()
+        self.assertEqual('value2', worker2.get_or_load(('a',), loader))
+
+
+if __name__ == '__main__':
+    unittest.main()
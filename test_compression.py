@@ -0,0 +1,103 @@
+import gzip
+import json
+import unittest
+import zlib
+from werkzeug.routing import Map, Rule
+from werkzeug.test import Client
+from compression import CompressionMiddleware, negotiate_encoding
+
+_LISTING = [{'algorithmId': 'algorithm' + str(number), 'displayName': 'Algorithm'} for number in range(200)]
+
+
+def listing_app(environ, start_response):
+    """Listing of known length with a strong ETag"""
+    body = json.dumps(_LISTING).encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8'), ('Content-Length', str(len(body))),
+                              ('ETag', '"listing"'), ('Vary', 'Accept')])
+    return [body]
+
+
+def streamed_app(environ, start_response):
+    """Listing streamed item by item without Content-Length"""
+    start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+    return (json.dumps(item).encode('utf-8') + b'\n' for item in _LISTING)
+
+
+def small_app(environ, start_response):
+    start_response('404 NOT FOUND', [('Content-Type', 'application/json'), ('Content-Length', '2')])
+    return [b'{}']
+
+
+def encoded_app(environ, start_response):
+    body = gzip.compress(b'x' * 5000)
+    start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Encoding', 'gzip'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+class CompressionMiddlewareTestCase(unittest.TestCase):
+    def get(self, app, accept_encoding='gzip, deflate', **kwargs):
+        return Client(CompressionMiddleware(app, **kwargs)).get('/algorithms/', headers={
+            'Accept-Encoding': accept_encoding})
+
+    def test_negotiate_encoding(self):
+        self.assertEqual('gzip', negotiate_encoding('deflate, gzip;q=0.5'))
+        self.assertEqual('deflate', negotiate_encoding('deflate, gzip;q=0'))
+        self.assertIsNone(negotiate_encoding('br'))
+        self.assertIsNone(negotiate_encoding(None))
+
+    def test_compress_KnownLength(self):
+        """a whole body is compressed at once, validators are kept usable"""
+        resp = self.get(listing_app)
+        body = resp.get_data()
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        self.assertEqual(str(len(body)), resp.headers['Content-Length'])
+        self.assertEqual(_LISTING, json.loads(gzip.decompress(body)))
+        self.assertEqual('W/"listing"', resp.headers['ETag'])
+        self.assertEqual('Accept, Accept-Encoding', resp.headers['Vary'])
+
+    def test_compress_Deflate(self):
+        resp = self.get(listing_app, 'deflate')
+        self.assertEqual('deflate', resp.headers['Content-Encoding'])
+        self.assertEqual(_LISTING, json.loads(zlib.decompress(resp.get_data())))
+
+    def test_compress_Streamed(self):
+        """streamed bodies are compressed incrementally"""
+        middleware = CompressionMiddleware(streamed_app, flush_size=1024)
+        status, headers, chunks = None, None, []
+
+        def start_response(response_status, response_headers, exc_info=None):
+            nonlocal status, headers
+            status, headers = response_status, dict(response_headers)
+        body = middleware({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/algorithms/', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                          start_response)
+        for chunk in body:
+            chunks.append(chunk)
+        body.close()
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertNotIn('Content-Length', headers)
+        self.assertGreater(len([chunk for chunk in chunks if chunk]), 2)
+        lines = gzip.decompress(b''.join(chunks)).splitlines()
+        self.assertEqual(_LISTING, [json.loads(line) for line in lines])
+
+    def test_skip(self):
+        """small, already encoded responses and clients not accepting compression are passed through"""
+        self.assertNotIn('Content-Encoding', self.get(small_app).headers)
+        resp = self.get(encoded_app)
+        self.assertEqual(b'x' * 5000, gzip.decompress(resp.get_data()))
+        resp = self.get(listing_app, 'identity')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual('"listing"', resp.headers['ETag'])
+
+    def test_stats_PerRoute(self):
+        url_map = Map([Rule('/algorithms/', endpoint='algorithms')])
+        middleware = CompressionMiddleware(listing_app, url_map=url_map)
+        Client(middleware).get('/algorithms/', headers={'Accept-Encoding': 'gzip'}).get_data()
+        stats = middleware.stats()['routes']['/algorithms/']
+        self.assertEqual(1, stats['compressed'])
+        self.assertLess(stats['ratio'], 0.5)
+        self.assertEqual(len(json.dumps(_LISTING)), stats['bytes_in'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google.api_core import exceptions as api_exceptions
+import connections
+
+
+class FakeDatastoreClient:
+    """Stands in for datastore.Client, get() raises what it's told to"""
+    def __init__(self):
+        self.error = None
+
+    def key(self, *path):
+        return path
+
+    def get(self, key):
+        if self.error is not None:
+            raise self.error
+        return None
+
+
+class FlakySearchHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first `failures` requests and then 200 with keep-alive"""
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+
+    def do_GET(self):
+        if FlakySearchHandler.failures > 0:
+            FlakySearchHandler.failures -= 1
+            status = 503
+        else:
+            status = 200
+        body = b'[]'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DatastoreClientManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manager = connections.DatastoreClientManager(factory=FakeDatastoreClient, health_check_interval=0)
+
+    def test_client_is_reused(self):
+        """the same client is returned by consecutive calls and created only once"""
+        first = self.manager.get()
+        second = self.manager.get()
+        self.assertIs(first, second)
+        self.assertEqual(1, self.manager.stats()['creations'])
+        self.assertEqual(1, self.manager.stats()['reuses'])
+
+    def test_transport_failure_recreates_client(self):
+        """a broken channel drops the client and the next call creates a new one"""
+        first = self.manager.get()
+        self.assertTrue(self.manager.report_failure(api_exceptions.ServiceUnavailable('down')))
+        second = self.manager.get()
+        self.assertIsNot(first, second)
+        self.assertEqual(2, self.manager.stats()['creations'])
+
+    def test_other_failure_keeps_client(self):
+        """errors of the operation itself, like a missing entity, don't drop the client"""
+        first = self.manager.get()
+        self.assertFalse(self.manager.report_failure(AttributeError('pop')))
+        self.assertIs(first, self.manager.get())
+
+    def test_reset_after_fork(self):
+        """a forked child never uses the parent's client"""
+        first = self.manager.get()
+        self.manager.reset()
+        self.assertIsNot(first, self.manager.get())
+
+    def test_failed_health_check_recreates_client(self):
+        """periodic health check replaces a client whose channel is broken"""
+        manager = connections.DatastoreClientManager(factory=FakeDatastoreClient, health_check_interval=1e-9)
+        first = manager.get()
+        first.error = api_exceptions.ServiceUnavailable('down')
+        second = manager.get()
+        self.assertIsNot(first, second)
+        self.assertEqual(1, manager.stats()['health_check_failures'])
+
+    def test_health_check_error_keeps_client(self):
+        """errors other than transport ones are logged, the request triggering the check goes on"""
+        manager = connections.DatastoreClientManager(factory=FakeDatastoreClient, health_check_interval=1e-9)
+        first = manager.get()
+        first.error = api_exceptions.PermissionDenied('denied')
+        with self.assertLogs(level='ERROR'):
+            self.assertIs(first, manager.get())
+        self.assertEqual(1, manager.stats()['health_check_errors'])
+
+    def test_health_check_WithoutLock(self):
+        """a slow health check doesn't hold up threads which need the lock"""
+        manager = connections.DatastoreClientManager(factory=FakeDatastoreClient, health_check_interval=1e-9)
+        client = manager.get()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_get(key):
+            started.set()
+            release.wait(5)
+
+        client.get = slow_get
+        checker = threading.Thread(target=manager.get)
+        checker.start()
+        self.assertTrue(started.wait(5))
+        reporter = threading.Thread(target=manager.report_failure, args=(api_exceptions.ServiceUnavailable('down'),))
+        reporter.start()
+        reporter.join(1)
+        self.assertFalse(reporter.is_alive())
+        release.set()
+        checker.join(5)
+        self.assertEqual(1, manager.stats()['failures'])
+
+    def test_reuses_Threads(self):
+        """counters aren't lost when many threads reuse the client at once"""
+        self.manager.get()
+
+        def reuse():
+            for _ in range(1000):
+                self.manager.get()
+        threads = [threading.Thread(target=reuse) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, self.manager.stats()['reuses'])
+
+
+class SearchSessionManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakySearchHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/algorithms/'
+        self.sessions = connections.SearchSessionManager(pool_size=2, timeout=(1, 1), retries=2, backoff=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        FlakySearchHandler.failures = 0
+
+    def test_connection_is_kept_alive(self):
+        """consecutive calls reuse a single pooled connection"""
+        for _ in range(3):
+            self.assertEqual(200, self.sessions.get(self.url).status_code)
+        pools = self.sessions.stats()['pools']
+        self.assertEqual(1, len(pools))
+        self.assertEqual(1, pools[0]['connections_created'])
+        self.assertEqual(3, pools[0]['requests'])
+
+    def test_idempotent_call_is_retried(self):
+        """GET answered with 503 is retried until it succeeds"""
+        FlakySearchHandler.failures = 2
+        self.assertEqual(200, self.sessions.get(self.url).status_code)
+
+    def test_retries_are_bounded(self):
+        """after the last retry the error status is returned to the caller"""
+        FlakySearchHandler.failures = 5
+        self.assertEqual(503, self.sessions.get(self.url).status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
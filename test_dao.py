@@ -1,6 +1,27 @@
+import atexit
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+# the index queue of dao.py is kept in a temporary directory of this test run
+_QUEUE_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _QUEUE_DIR, True)
+os.environ.setdefault('INDEX_QUEUE_PATH', os.path.join(_QUEUE_DIR, 'index-queue.sqlite3'))
+
 import requests
+import blobstore
 import dao
+import storage
 from main import get_flexible_url
 from google.cloud import datastore
 
@@ -149,7 +170,7 @@ def del_all_from_search():
 
 def del_all():
     """
-    Clears all databases for testing purposes to start from scratch.
+    Clears all databases and DAO caches for testing purposes to start from scratch.
 
     Raises:
         SearchConnectionError: requests.ConnectionError
@@ -163,6 +184,10 @@ def del_all():
     """
     del_all_from_datastore()
     del_all_from_search()
+    dao.algorithm_cache.clear()
+    dao.dataset_cache.clear()
+    dao.algorithm_search_cache.clear()
+    dao.dataset_search_cache.clear()
 
 
 class DaoUnittestAlgorithmDaoTestCase(unittest.TestCase):
@@ -306,5 +331,320 @@ class DaoUnittestAlgorithmDaoTestCase(unittest.TestCase):
         self.assertEqual(1, returned, msg='Wrongly error status Code not returned from Datastore')
 
 
+class DaoUnittestFetchIndexAndDataTestCase(unittest.TestCase):
+    """Tests of concurrent index and data lookup used by AlgorithmDAO.get and DatasetDAO.get"""
+    @staticmethod
+    def slow_getindex(item_id):
+        time.sleep(0.2)
+        return {'algorithmId': item_id}
+
+    @staticmethod
+    def slow_getdata(item_id):
+        time.sleep(0.2)
+        return {'algorithmBLOB': 'blob'}
+
+    def test_fetch_index_and_data_Concurrent(self):
+        """both lookups are run at the same time so it takes as long as the slower one"""
+        started = time.monotonic()
+        idx, dat = dao.fetch_index_and_data(self.slow_getindex, self.slow_getdata, 'algorithmId1')
+        elapsed = time.monotonic() - started
+        self.assertDictEqual({'algorithmId': 'algorithmId1'}, idx)
+        self.assertDictEqual({'algorithmBLOB': 'blob'}, dat)
+        self.assertLess(elapsed, 0.35, msg='Lookups were run in sequence')
+
+    def test_fetch_index_and_data_IndexError(self):
+        """index error is returned without waiting for data"""
+        idx, dat = dao.fetch_index_and_data(lambda item_id: 2, self.slow_getdata, 'algorithmId1')
+        self.assertEqual(2, idx)
+        self.assertIsNone(dat)
+
+
+class DaoUnittestFetchIndexMultiTestCase(unittest.TestCase):
+    """Tests of batch index lookup used by AlgorithmDAO.getmulti and DatasetDAO.getmulti"""
+    def setUp(self):
+        self.index = {'algorithmId' + str(i): create_test_search_algorithm_dict(i) for i in range(5)}
+        self.searches = []
+        self.gets = []
+
+    def searchindex(self, found_algorithms_list, tags=''):
+        self.searches.append(tags)
+        # search finds everything but algorithmId3 which is tokenized differently
+        found_algorithms_list.extend(self.index[tag] for tag in tags.split(',')
+                                     if tag in self.index and tag != 'algorithmId3')
+        return 0
+
+    def getindex(self, algorithm_id):
+        self.gets.append(algorithm_id)
+        return self.index.get(algorithm_id, 1)
+
+    def test_fetch_index_multi(self):
+        """ids are found with one search and ids missing from its result with single lookups"""
+        ids = ['algorithmId1', 'algorithmId3', 'WrongAlgorithmID']
+        found = dao.fetch_index_multi(self.searchindex, self.getindex, 'algorithmId', ids)
+        self.assertCountEqual(['algorithmId1', 'algorithmId3'], found.keys())
+        self.assertDictEqual(self.index['algorithmId3'], found['algorithmId3'])
+        self.assertEqual(1, len(self.searches))
+        self.assertCountEqual(['algorithmId3', 'WrongAlgorithmID'], self.gets)
+
+
+class DaoUnittestSearchQueryTestCase(unittest.TestCase):
+    """Tests of URLs of 17ZSearch calls built from ids and tags sent by clients"""
+    def test_searchindexuncached_Encoded(self):
+        """tags with &, #, + or spaces stay tags of a single query parameter"""
+        response = mock.Mock(status_code=200, text='[]')
+        with mock.patch.object(dao.search_sessions, 'get', return_value=response) as get:
+            self.assertEqual(0, dao.AlgorithmDAO.searchindexuncached([], 'a&limit=1,b#c,d+e f'))
+        query = urlsplit(get.call_args[0][0]).query
+        self.assertEqual({'query': ['a&limit=1 OR b#c OR d+e f']}, parse_qs(query))
+
+    def test_getindex_Encoded(self):
+        response = mock.Mock(status_code=404)
+        with mock.patch.object(dao.search_sessions, 'get', return_value=response) as get:
+            dao.DatasetDAO.getindex('d1?query=x/y')
+        self.assertTrue(get.call_args[0][0].endswith('/datasets/d1%3Fquery%3Dx%2Fy'))
+
+
+class DaoUnittestPaginateTestCase(unittest.TestCase):
+    """Tests of slicing search results into pages"""
+    def test_paginate_AllPages(self):
+        """following nextCursor returns every item exactly once"""
+        found_all = create_test_search_algorithm_list(25)
+        pages = []
+        cursor = None
+        while True:
+            found = []
+            page = {}
+            self.assertEqual(0, dao.paginate(found_all, found, page, limit=10, cursor=cursor))
+            self.assertEqual(25, page['totalCount'])
+            self.assertEqual(3, page['totalPages'])
+            pages.append(found)
+            cursor = page['nextCursor']
+            if cursor is None:
+                break
+        self.assertEqual([10, 10, 5], [len(found) for found in pages])
+        self.assertEqual(found_all, [item for found in pages for item in found])
+
+    def test_paginate_NoLimit(self):
+        """without limit everything is a single page"""
+        found_all = create_test_search_algorithm_list(5)
+        found = []
+        page = {}
+        self.assertEqual(0, dao.paginate(found_all, found, page))
+        self.assertEqual(found_all, found)
+        self.assertIsNone(page['nextCursor'])
+
+    def test_paginate_MalformedCursor(self):
+        """cursor which wasn't made by encode_cursor is rejected"""
+        for cursor in ['abc', dao.encode_cursor(5)[:-1] + '!', 'bzotMQ']:
+            self.assertEqual(1, dao.paginate([], [], {}, limit=10, cursor=cursor), msg=cursor)
+
+
+class FakeSearchHandler(BaseHTTPRequestHandler):
+    """Answers every GET with a JSON array of `length` test algorithms written in small pieces"""
+    protocol_version = 'HTTP/1.1'
+    length = 0
+    requests_count = 0
+
+    def do_GET(self):
+        FakeSearchHandler.requests_count += 1
+        body = json.dumps(create_test_search_algorithm_list(FakeSearchHandler.length)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for start in range(0, len(body), 100):
+            self.wfile.write(body[start:start + 100])
+
+    def log_message(self, *args):
+        pass
+
+
+class DaoUnittestIterSearchTestCase(unittest.TestCase):
+    """Tests of streamed search results used by unpaged listings"""
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSearchHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/algorithms/'
+        self.search_cache = dao.SearchResultCache('test-search', 10, 60, 60)
+        FakeSearchHandler.requests_count = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_iter_search_Cached(self):
+        """streamed results are cached and the next search doesn't call search app"""
+        FakeSearchHandler.length = 30
+        result_code, found, version = dao.iter_search(self.url, self.search_cache,
+                                                      dao.AlgorithmDAO.searchindexuncached)
+        self.assertEqual(0, result_code)
+        self.assertIsNone(version, msg='Version of streamed results is not known before they end')
+        self.assertEqual(create_test_search_algorithm_list(30), list(found))
+        result_code, found, version = dao.iter_search(self.url, self.search_cache,
+                                                      dao.AlgorithmDAO.searchindexuncached)
+        self.assertEqual(create_test_search_algorithm_list(30), list(found))
+        self.assertEqual(dao.listing_version(create_test_search_algorithm_list(30)), version)
+        self.assertEqual(1, FakeSearchHandler.requests_count)
+
+    def test_iter_search_TooLargeToCache(self):
+        """results larger than SEARCH_CACHE_MAX_ITEMS are streamed but not kept"""
+        FakeSearchHandler.length = dao._SEARCH_CACHE_MAX_ITEMS + 1
+        result_code, found, version = dao.iter_search(self.url, self.search_cache,
+                                                      dao.AlgorithmDAO.searchindexuncached)
+        self.assertEqual(dao._SEARCH_CACHE_MAX_ITEMS + 1, sum(1 for item in found))
+        self.assertEqual(0, self.search_cache.stats()['size'])
+
+
+class DaoUnittestCodecTestCase(unittest.TestCase):
+    def test_encoding_stream_RoundTrip(self):
+        """data compressed while it's read is decompressed back chunk by chunk"""
+        codec = dao.get_codec('gzip')
+        data = b'zazolc gesla jazn ' * 10000
+        stream = dao.EncodingStream(io.BytesIO(data), codec, read_size=1000)
+        chunks = []
+        while True:
+            chunk = stream.read(777)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertLess(sum(len(chunk) for chunk in chunks), len(data))
+        self.assertEqual(data, b''.join(dao.iter_decoded(chunks, 'gzip')))
+        self.assertEqual(data, gzip.decompress(b''.join(chunks)), msg='Stored bytes are not servable as gzip')
+
+    def test_encode_text_Short(self):
+        """short text is stored as it is"""
+        self.assertEqual('short', dao.encode_text('short', 'gzip'))
+
+    def test_description_decompressed_lazily(self):
+        """compressed description is decompressed only if it's returned"""
+        description = 'long description ' * 100
+        entity = {'algorithmDescription': dao.encode_text(description, 'gzip'), 'codec': 'gzip',
+                  'datasetDescription': 'dd'}
+        self.assertIsInstance(entity['algorithmDescription'], bytes)
+        dao.decode_properties(entity, ('algorithmDescription', 'datasetDescription'))
+        entity.update({'algorithmId': 'a1', 'algorithmSummary': 's', 'displayName': 'd', 'linkURL': 'l',
+                       'algorithmBLOB': None})
+        algorithm = dao.Algorithm(entity)
+        entity['algorithmDescription'].codec_name = 'unknown'
+        self.assertEqual({'algorithmId': 'a1', 'datasetDescription': 'dd'},
+                         algorithm.get_dict(['algorithmId', 'datasetDescription']))
+        entity['algorithmDescription'].codec_name = 'gzip'
+        self.assertEqual(description, algorithm.get_dict()['algorithmDescription'])
+
+
+class DaoUnittestValueObjectsTestCase(unittest.TestCase):
+    algorithm_data = {'algorithmId': 'a1', 'algorithmSummary': 's', 'displayName': 'd', 'linkURL': 'l',
+                      'algorithmBLOB': None, 'algorithmDescription': 'ad', 'datasetDescription': 'dd'}
+
+    def test_instances_DontShareFields(self):
+        """every object keeps its own fields"""
+        first = dao.Algorithm(self.algorithm_data)
+        second = dao.Algorithm(dict(self.algorithm_data, algorithmId='a2'))
+        first.setsummary('changed')
+        self.assertEqual('a1', first.getalgorithm_id())
+        self.assertEqual('s', second.getsummary())
+        self.assertFalse(hasattr(first, '__dict__'))
+
+    def test_to_dict_RoundTrip(self):
+        user_data = {'userID': 1234, 'firstName': 'f', 'lastName': 'l', 'email': 'e', 'phone': 'p',
+                     'userStatus': 1}
+        self.assertEqual(dict(user_data, userID='1234'), dao.User(user_data).to_dict())
+        self.assertEqual(self.algorithm_data, dao.Algorithm(self.algorithm_data).to_dict())
+        dataset_data = {'datasetId': 'd1', 'datasetSummary': 's', 'displayName': 'd', 'linkURL': 'l',
+                        'datasetBLOB': None, 'datasetDescription': 'dd'}
+        dataset = dao.Dataset(dataset_data)
+        self.assertEqual(dataset_data, dataset.to_dict())
+        self.assertEqual({'linkURL': 'l'}, dataset.get_dict(['linkURL']))
+
+    def test_init_MissingField(self):
+        with self.assertRaises(KeyError):
+            dao.Algorithm({'algorithmId': 'a1'})
+
+
+class DaoUnittestStorageBackendTestCase(unittest.TestCase):
+    """Data of algorithms, datasets and users kept by a backend other than Datastore"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.patches = [mock.patch.object(dao, 'storage', storage.SQLiteStorage(self.root + '/storage.sqlite3')),
+                        mock.patch.object(dao, 'blob_store', blobstore.FilesystemBlobBackend(self.root + '/blobs'))]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.root)
+
+    def test_algorithm_RoundTrip(self):
+        """long descriptions are compressed, BLOB is kept apart and touchdata moves the timestamp"""
+        algorithm = dao.Algorithm(dict(DaoUnittestValueObjectsTestCase.algorithm_data, algorithmBLOB='blob',
+                                       algorithmDescription='long description ' * 100))
+        self.assertEqual(0, dao.AlgorithmDAO.setdata(algorithm))
+        data = dao.AlgorithmDAO.getdata('a1')
+        self.assertEqual('long description ' * 100, dao.decode_text(data['algorithmDescription']))
+        self.assertEqual('dd', data['datasetDescription'])
+        self.assertEqual('blob', dao.AlgorithmDAO.getblob('a1'))
+        timestamp = data['timestamp']
+        self.assertEqual(timedelta(0), timestamp.utcoffset(), msg='Timestamps are UTC whatever the local time zone')
+        self.assertEqual(0, dao.AlgorithmDAO.touchdata('a1'))
+        self.assertGreater(dao.AlgorithmDAO.getdata('a1')['timestamp'], timestamp)
+        self.assertEqual(1, dao.AlgorithmDAO.touchdata('a2'))
+        self.assertEqual(1, dao.AlgorithmDAO.getdata('a2'))
+
+    def test_dataset_Multi(self):
+        datasets = [dao.Dataset({'datasetId': 'd' + str(number), 'datasetSummary': 's', 'displayName': 'd',
+                                 'linkURL': 'l', 'datasetBLOB': None, 'datasetDescription': 'dd'})
+                    for number in range(3)]
+        self.assertEqual([0, 0, 0], dao.DatasetDAO.setdatamulti(datasets))
+        found = dao.DatasetDAO.getdatamulti(['d2', 'd0', 'missing'])
+        self.assertEqual({'d0': dao.DatasetDAO.getdata('d0'), 'd2': dao.DatasetDAO.getdata('d2')}, found)
+
+    def test_dataset_getmulti_SameAsGet(self):
+        """an item of a batch has the same fields as the single item, timestamp included"""
+        dataset = dao.Dataset({'datasetId': 'd0', 'datasetSummary': 's', 'displayName': 'd', 'linkURL': 'l',
+                               'datasetBLOB': None, 'datasetDescription': 'dd'})
+        self.assertEqual(0, dao.DatasetDAO.setdata(dataset))
+        index = dao.DatasetDAO.toindex(dataset)
+        with mock.patch.object(dao.DatasetDAO, 'getindex', return_value=dict(index)), \
+                mock.patch.object(dao.DatasetDAO, 'getindexmulti', return_value={'d0': dict(index)}):
+            single = dao.DatasetDAO.getuncached('d0')
+            batch = dao.DatasetDAO.getmulti(['d0'])['d0']
+        self.assertIn('timestamp', batch)
+        self.assertEqual(dict(single, datasetBLOB=None), batch)
+
+    def test_algorithm_SetmultiFailedChunk(self):
+        """chunks written before a failed one keep their codes and get their index updates"""
+        algorithms = [dao.Algorithm(dict(DaoUnittestValueObjectsTestCase.algorithm_data, algorithmId='a' + str(number)))
+                      for number in range(5)]
+        put_multi = dao.storage.put_multi
+
+        def fail_second_chunk(kind, items, unindexed=()):
+            if items[0][0] == 'a2':
+                raise storage.StorageError('Writing ' + kind + ' failed')
+            put_multi(kind, items, unindexed)
+
+        with mock.patch.object(dao, '_DATASTORE_MAX_BATCH', 2), \
+                mock.patch.object(dao.storage, 'put_multi', fail_second_chunk), \
+                mock.patch.object(dao.index_queue, 'enqueue_many') as enqueue_many:
+            self.assertEqual([0, 0, 12, 12, 0], dao.AlgorithmDAO.setmulti(algorithms))
+        self.assertEqual(['a0', 'a1', 'a4'], [update[1] for update in enqueue_many.call_args[0][0]])
+        self.assertEqual(1, dao.AlgorithmDAO.getdata('a2'))
+        self.assertNotEqual(1, dao.AlgorithmDAO.getdata('a4'))
+
+    def test_check_blob_store(self):
+        """BLOBs may stay in Datastore only together with the other data"""
+        dao.check_blob_store(storage.DatastoreStorage(), blobstore.DatastoreBlobBackend())
+        dao.check_blob_store(dao.storage, dao.blob_store)
+        with self.assertRaises(ValueError):
+            dao.check_blob_store(dao.storage, blobstore.DatastoreBlobBackend())
+
+    def test_user_RoundTrip(self):
+        user_data = {'userID': '1234', 'firstName': 'f', 'lastName': 'l', 'email': 'e', 'phone': 'p',
+                     'userStatus': 1}
+        self.assertEqual(0, dao.UserDAO.set(dao.User(user_data)))
+        self.assertEqual(user_data, dao.UserDAO.get('1234').to_dict())
+        self.assertEqual(1, dao.UserDAO.get('4321'))
+
+
 if __name__ == '__main__':
     unittest.main()
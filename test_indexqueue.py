@@ -0,0 +1,105 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import indexqueue
+
+
+class FakeDispatcher:
+    """Records dispatched entries and answers with statuses taken from `statuses` by item id, 200 by default"""
+    def __init__(self):
+        self.applied = []
+        self.statuses = {}
+
+    def __call__(self, entries):
+        self.applied.extend((entry.item_id, entry.action, entry.document) for entry in entries)
+        return [self.statuses.get(entry.item_id, 200) for entry in entries]
+
+
+class IndexQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dispatcher = FakeDispatcher()
+        self.queue = indexqueue.IndexQueue(os.path.join(self.root, 'queue.sqlite3'), self.dispatcher, workers=0,
+                                           backoff=0, max_backoff=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_enqueue_NoPath(self):
+        """without INDEX_QUEUE_PATH updates are refused, never kept in a temporary file"""
+        queue = indexqueue.IndexQueue('', self.dispatcher, workers=0)
+        with self.assertRaises(sqlite3.OperationalError):
+            queue.enqueue('algorithms', 'a1', indexqueue.ACTION_DELETE)
+
+    def test_flush_AppliesInOrder(self):
+        """updates of different items are applied in the order they were enqueued"""
+        self.queue.enqueue('algorithms', 'a1', indexqueue.ACTION_SET, {'algorithmId': 'a1'})
+        self.queue.enqueue('algorithms', 'a2', indexqueue.ACTION_DELETE)
+        self.assertTrue(self.queue.flush())
+        self.assertEqual([('a1', 'set', {'algorithmId': 'a1'}), ('a2', 'delete', None)], self.dispatcher.applied)
+        self.assertEqual(0, self.queue.stats()['depth'])
+
+    def test_enqueue_Coalesces(self):
+        """a newer update of an item supersedes the one waiting in the queue"""
+        self.queue.enqueue('algorithms', 'a1', indexqueue.ACTION_SET, {'displayName': 'old'})
+        self.queue.enqueue('algorithms', 'a1', indexqueue.ACTION_SET, {'displayName': 'new'})
+        self.assertEqual(('set', {'displayName': 'new'}), self.queue.pending('algorithms', 'a1'))
+        self.queue.flush()
+        self.assertEqual([('a1', 'set', {'displayName': 'new'})], self.dispatcher.applied)
+        self.assertIsNone(self.queue.pending('algorithms', 'a1'))
+
+    def test_flush_RetriesFailures(self):
+        """updates failing with connection errors or 5xx are retried"""
+        self.dispatcher.statuses['a1'] = None
+        self.dispatcher.statuses['a2'] = 503
+        self.queue.enqueue_many([('algorithms', 'a1', indexqueue.ACTION_SET, {}),
+                                 ('datasets', 'a2', indexqueue.ACTION_SET, {})])
+        self.assertEqual(2, self.queue.process_batch())
+        stats = self.queue.stats()
+        self.assertEqual(2, stats['depth'])
+        self.assertEqual(2, stats['retrying'])
+        self.assertEqual('status 503', stats['last_error'])
+        self.dispatcher.statuses.clear()
+        self.assertTrue(self.queue.flush())
+        self.assertEqual(2, self.queue.stats()['succeeded'])
+
+    def test_flush_DropsRejected(self):
+        """updates rejected with 4xx are dropped, deleting a missing document is not an error"""
+        self.dispatcher.statuses['a1'] = 400
+        self.dispatcher.statuses['a2'] = 404
+        self.queue.enqueue('algorithms', 'a1', indexqueue.ACTION_SET, {})
+        self.queue.enqueue('algorithms', 'a2', indexqueue.ACTION_DELETE)
+        self.assertTrue(self.queue.flush())
+        stats = self.queue.stats()
+        self.assertEqual(1, stats['rejected'])
+        self.assertEqual(1, stats['succeeded'])
+
+    def test_stats_Lag(self):
+        """lag is the age of the oldest update waiting in the queue"""
+        self.assertEqual(0.0, self.queue.stats()['lag'])
+        self.queue.enqueue('algorithms', 'a1', indexqueue.ACTION_SET, {})
+        stats = self.queue.stats()
+        self.assertEqual(1, stats['depth'])
+        self.assertEqual(1, stats['ready'])
+        self.assertGreaterEqual(stats['lag'], 0.0)
+
+    def test_start_Drains(self):
+        """background workers apply updates without flush"""
+        queue = indexqueue.IndexQueue(os.path.join(self.root, 'queue.sqlite3'), self.dispatcher, workers=1,
+                                      poll_interval=0.05)
+        queue.enqueue('algorithms', 'a1', indexqueue.ACTION_SET, {})
+        try:
+            for _ in range(100):
+                if queue.stats()['depth'] == 0:
+                    break
+                time.sleep(0.05)
+            self.assertEqual([('a1', 'set', {})], self.dispatcher.applied)
+        finally:
+            queue.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
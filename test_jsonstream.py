@@ -0,0 +1,46 @@
+import io
+import json
+import unittest
+import jsonstream
+
+
+def create_test_items(length):
+    return [{'algorithmId': 'algorithmId' + str(i), 'displayName': 'zażółć ' * i} for i in range(length)] + \
+        [12345, 'string', None, [1, 2], -1.25e-10, True, False, '\U0001F600 "quoted" \\']
+
+
+class JSONStreamTestCase(unittest.TestCase):
+    def test_iter_json_array_ChunkBoundaries(self):
+        """items split across reads in any place, also inside utf-8 characters, are parsed"""
+        items = create_test_items(50)
+        body = json.dumps(items, ensure_ascii=False).encode('utf-8')
+        escaped = json.dumps(items).encode('utf-8')
+        for read_size in [1, 2, 7, 1024]:
+            parsed = list(jsonstream.iter_json_array(io.BytesIO(body), read_size))
+            self.assertEqual(items, parsed, msg='Wrong items for read size ' + str(read_size))
+            parsed = list(jsonstream.iter_json_array(io.BytesIO(escaped), read_size))
+            self.assertEqual(items, parsed, msg='Wrong escaped items for read size ' + str(read_size))
+
+    def test_iter_json_array_Malformed(self):
+        """anything else than a single complete JSON array raises JSONStreamError"""
+        for body in [b'', b'{}', b'[1,]', b'[1 2]', b'[1', b'[1] 2', b'[{"a":]']:
+            with self.assertRaises(jsonstream.JSONStreamError, msg=body):
+                list(jsonstream.iter_json_array(io.BytesIO(body), 2))
+
+    def test_iter_json_array_MalformedEarly(self):
+        """a malformed item raises at once instead of being parsed again with the rest of the stream"""
+        for item in [b'{"a": x}', b'{"a": 1.}', b'"\\q"', b'tru e']:
+            stream = io.BytesIO(b'[' + item + b', ' + b'1, ' * 10000 + b'1]')
+            with self.assertRaises(jsonstream.JSONStreamError, msg=item):
+                list(jsonstream.iter_json_array(stream, 16))
+            self.assertLess(stream.tell(), 100, msg=item)
+
+    def test_iter_ndjson(self):
+        """lines are parsed one by one, empty lines are skipped"""
+        items = create_test_items(20)
+        body = ('\n'.join(json.dumps(item) for item in items) + '\n\n').encode('utf-8')
+        self.assertEqual(items, list(jsonstream.iter_ndjson(io.BytesIO(body), 5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,22 @@
 """It's very important to install in virtualenv
 pip install WebTest
 """
+import atexit
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
 import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+# the index queue of dao.py is kept in a temporary directory of this test run
+_QUEUE_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _QUEUE_DIR, True)
+os.environ.setdefault('INDEX_QUEUE_PATH', os.path.join(_QUEUE_DIR, 'index-queue.sqlite3'))
+
 import webtest
 import main
 
@@ -85,6 +100,376 @@ class MainHTTPTestCase(unittest.TestCase):
         self.assertIsNotNone(response.charset, msg='There is no charset in response')
         self.assertEqual('application/json', response.content_type)
 
+    def test_algorithms_GET_WrongLimit(self):
+        """Test Get with limit out of range or not a number"""
+        for limit in ['0', '-1', 'ten', str(main._PAGE_MAX_LIMIT + 1)]:
+            response = self.test_app.get('/algorithms/', params={'limit': limit}, expect_errors=True)
+            self.assertEqual(400, response.status_int, msg='Wrong response status for ' + limit)
+            self.assertEqual('application/json', response.content_type)
+
+    def test_datasets_GET_EmptyCursor(self):
+        """Test Get with empty cursor"""
+        response = self.test_app.get('/datasets/', params={'cursor': ''}, expect_errors=True)
+        self.assertEqual(400, response.status_int, msg='Wrong response status')
+
+    def test_algorithms_batch_GET_NoIds(self):
+        """Test batch Get without ids parameter"""
+        response = self.test_app.get('/algorithms/batch', expect_errors=True)
+        self.assertEqual(400, response.status_int, msg='Wrong response status')
+        self.assertEqual('application/json', response.content_type)
+
+    def test_algorithms_batch_GET_WrongIds(self):
+        """Test batch Get with empty and space delimited ids"""
+        for ids in [',', 'algorithm1,,algorithm2', 'algorithm1 algorithm2']:
+            response = self.test_app.get('/algorithms/batch', params={'ids': ids}, expect_errors=True)
+            self.assertEqual(400, response.status_int, msg='Wrong response status for ' + ids)
+
+    def test_datasets_batch_GET_TooManyIds(self):
+        """Test batch Get with more ids than allowed"""
+        ids = ','.join('dataset' + str(i) for i in range(main._BATCH_MAX_IDS + 1))
+        response = self.test_app.get('/datasets/batch', params={'ids': ids}, expect_errors=True)
+        self.assertEqual(400, response.status_int, msg='Wrong response status')
+
+    def test_algorithm_GET_UnknownField(self):
+        """Test Get of an algorithm with a field which doesn't exist"""
+        response = self.test_app.get('/algorithms/algorithm1', params={'fields': 'algorithmId,password'},
+                                     expect_errors=True)
+        self.assertEqual(400, response.status_int, msg='Wrong response status')
+        self.assertEqual('fields', response.json['fields'])
+
+    def test_datasets_batch_GET_BLOBField(self):
+        """Test batch Get asking for BLOBs which it doesn't return"""
+        response = self.test_app.get('/datasets/batch', params={'ids': 'dataset1', 'fields': 'datasetBLOB'},
+                                     expect_errors=True)
+        self.assertEqual(400, response.status_int, msg='Wrong response status')
+
+
+class MainGetFieldsTestCase(unittest.TestCase):
+    def test_get_fields_Default(self):
+        """without fields parameter everything but BLOB is returned"""
+        fields = main.get_fields({}, main._ALGORITHM_FIELDS, 'algorithmBLOB')
+        self.assertNotIn('algorithmBLOB', fields)
+        self.assertEqual(len(main._ALGORITHM_FIELDS) - 1, len(fields))
+
+    def test_get_fields_Given(self):
+        """given fields are returned once, in order"""
+        fields = main.get_fields({'fields': 'datasetBLOB, datasetId,datasetBLOB'}, main._DATASET_FIELDS,
+                                 'datasetBLOB')
+        self.assertEqual(['datasetBLOB', 'datasetId'], fields)
+
+
+class MainConditionalGetTestCase(unittest.TestCase):
+    """Tests of ETag and Last-Modified validation"""
+    timestamp = datetime(2017, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+    def test_not_modified_IfNoneMatch(self):
+        """matching ETag gets 304 with validators, other ETags get None"""
+        etag = main.make_etag(self.timestamp, ['algorithmId'])
+        with main.app.test_request_context('/algorithms/a1', headers={'If-None-Match': '"' + etag + '"'}):
+            resp = main.not_modified(etag, self.timestamp)
+            self.assertEqual(304, resp.status_code)
+            self.assertEqual('"' + etag + '"', resp.headers['ETag'])
+            self.assertIsNone(main.not_modified(main.make_etag(self.timestamp, ['displayName']), self.timestamp))
+
+    def test_not_modified_IfModifiedSince(self):
+        """Last-Modified without fractions of a second is still current"""
+        etag = main.make_etag(self.timestamp)
+        with main.app.test_request_context('/user/u1', headers={'If-Modified-Since': 'Mon, 01 May 2017 12:30:15 GMT'}):
+            self.assertEqual(304, main.not_modified(etag, self.timestamp).status_code)
+        with main.app.test_request_context('/user/u1', headers={'If-Modified-Since': 'Mon, 01 May 2017 12:30:14 GMT'}):
+            self.assertIsNone(main.not_modified(etag, self.timestamp))
+
+    def test_algorithm_GET_BlobOnlyWhenReturned(self):
+        """BLOB is loaded with metadata only after the ETag check, never for 304"""
+        body = create_test_algorithm_body('a1')
+        body['timestamp'] = self.timestamp
+
+        def get(algorithm_id, with_blob=False):
+            return main.Algorithm(dict(body, algorithmBLOB='blob' if with_blob else None))
+
+        client = main.app.test_client()
+        with mock.patch.object(main.AlgorithmDAO, 'get', side_effect=get) as get_algorithm:
+            resp = client.get('/algorithms/a1?fields=algorithmId,algorithmBLOB')
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual('blob', json.loads(resp.get_data())['algorithmBLOB'])
+            self.assertEqual([mock.call('a1'), mock.call('a1', with_blob=True)], get_algorithm.call_args_list)
+            get_algorithm.reset_mock()
+            resp = client.get('/algorithms/a1?fields=algorithmId,algorithmBLOB',
+                              headers={'If-None-Match': resp.headers['ETag']})
+            self.assertEqual(304, resp.status_code)
+            self.assertEqual([mock.call('a1')], get_algorithm.call_args_list)
+
+    def test_listing_etag_Format(self):
+        """JSON array and NDJSON listings have different ETags"""
+        with main.app.test_request_context('/algorithms/'):
+            etag = main.listing_etag('version')
+        with main.app.test_request_context('/algorithms/', headers={'Accept': 'application/x-ndjson'}):
+            self.assertNotEqual(etag, main.listing_etag('version'))
+            self.assertIsNone(main.listing_etag(None))
+
+
+class MainStreamListingTestCase(unittest.TestCase):
+    """Tests of streamed listings without databases"""
+    def stream(self, items, accept):
+        with main.app.test_request_context('/algorithms/', headers={'Accept': accept}):
+            resp = main.stream_listing(iter(items))
+            return resp.mimetype, resp.get_data(as_text=True)
+
+    def test_stream_listing_JSONArray(self):
+        """default output is the same as json.dumps of the whole list"""
+        items = [{'algorithmId': 'algorithmId' + str(i)} for i in range(3)]
+        for accept in ['*/*', 'application/json']:
+            mimetype, body = self.stream(items, accept)
+            self.assertEqual('application/json', mimetype)
+            self.assertEqual(main.json.dumps(items), body)
+        self.assertEqual('[]', self.stream([], '*/*')[1])
+
+    def test_stream_listing_NDJSON(self):
+        """client accepting NDJSON gets one item per line"""
+        items = [{'algorithmId': 'algorithmId' + str(i)} for i in range(3)]
+        mimetype, body = self.stream(items, 'application/x-ndjson')
+        self.assertEqual('application/x-ndjson', mimetype)
+        self.assertEqual(items, [json.loads(line) for line in body.splitlines()])
+
+
+class FakeAlgorithmDAO:
+    """Records chunks written by bulk import, algorithms with 'bad' in id fail"""
+    chunks = []
+
+    @staticmethod
+    def setmulti(algorithms):
+        ids = [algorithm.getalgorithm_id() for algorithm in algorithms]
+        FakeAlgorithmDAO.chunks.append(ids)
+        return [11 if 'bad' in algorithm_id else 0 for algorithm_id in ids]
+
+
+def create_test_algorithm_body(algorithm_id):
+    return {'algorithmId': algorithm_id, 'algorithmSummary': 's', 'displayName': 'd', 'linkURL': 'l',
+            'algorithmBLOB': 'b', 'algorithmDescription': 'ad', 'datasetDescription': 'dd'}
+
+
+class MainImportItemsTestCase(unittest.TestCase):
+    """Tests of bulk import without authentication and databases"""
+    def setUp(self):
+        FakeAlgorithmDAO.chunks = []
+
+    def import_body(self, body, content_type):
+        with main.app.test_request_context('/algorithms/import', method='POST', data=body,
+                                           content_type=content_type):
+            resp = main.import_items(main.Algorithm, FakeAlgorithmDAO, 'algorithmId')
+        return resp.status_code, json.loads(resp.get_data(as_text=True))
+
+    def test_import_JSONArray(self):
+        """every item gets its status in order of the body"""
+        body = json.dumps([create_test_algorithm_body('a1'), {'algorithmId': 'missing fields'},
+                           create_test_algorithm_body('bad1')])
+        status, statuses = self.import_body(body, 'application/json')
+        self.assertEqual(200, status)
+        self.assertEqual([200, 400, 503], [item['code'] for item in statuses])
+        self.assertEqual('a1', statuses[0]['algorithmId'])
+        self.assertEqual('bad1', statuses[2]['algorithmId'], msg='Failed writes are server errors, not validation')
+        self.assertEqual([['a1', 'bad1']], FakeAlgorithmDAO.chunks)
+
+    def test_import_NDJSONDuplicateIds(self):
+        """the same id is never written twice in one chunk"""
+        body = '\n'.join(json.dumps(create_test_algorithm_body(i)) for i in ['a1', 'a2', 'a1'])
+        status, statuses = self.import_body(body, 'application/x-ndjson')
+        self.assertEqual(200, status)
+        self.assertEqual([['a1', 'a2'], ['a1']], FakeAlgorithmDAO.chunks)
+
+    def test_import_MalformedBody(self):
+        """items before malformed part are written and an error is appended"""
+        body = '[' + json.dumps(create_test_algorithm_body('a1')) + ', {'
+        status, statuses = self.import_body(body, 'application/json')
+        self.assertEqual(400, status)
+        self.assertEqual([200, 400], [item['code'] for item in statuses])
+        self.assertEqual('body', statuses[-1]['fields'])
+
+    def test_import_WrongContentType(self):
+        """only JSON array and NDJSON bodies are accepted"""
+        status, data = self.import_body('a1', 'text/plain')
+        self.assertEqual(400, status)
+
+
+class MainPostTestCase(unittest.TestCase):
+    """Tests of a single POST without databases"""
+    def setUp(self):
+        self.client = main.app.test_client()
+        self.patch = mock.patch('authentication.verify_id_token_claims', return_value={'sub': 'u1'})
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def post(self, returned_code):
+        with mock.patch.object(main.AlgorithmDAO, 'set', return_value=returned_code):
+            return self.client.post('/algorithms/', data=json.dumps(create_test_algorithm_body('a1')),
+                                    content_type='application/json', headers={'Authorization': 'Bearer token'})
+
+    def test_post_Written(self):
+        self.assertEqual(200, self.post(0).status_code)
+
+    def test_post_IndexQueueUnavailable(self):
+        """an algorithm whose index update wasn't enqueued is a server error, not a malformed request"""
+        self.assertEqual(503, self.post(1).status_code)
+
+
+class FakeBlobDAO:
+    """Keeps BLOBs of existing ids in memory, only 'a1' exists"""
+    blobs = {}
+
+    @staticmethod
+    def get(item_id):
+        return object() if item_id == 'a1' else 1
+
+    @staticmethod
+    def openblob(item_id):
+        if item_id not in FakeBlobDAO.blobs:
+            return 1
+        blob = FakeBlobDAO.blobs[item_id]
+        return main.BlobReader(len(blob), iter([blob[:3], blob[3:]]))
+
+    @staticmethod
+    def writeblob(item_id, stream):
+        FakeBlobDAO.blobs[item_id] = stream.read()
+        return 0
+
+
+class MainBlobTestCase(unittest.TestCase):
+    """Tests of BLOB upload and download without authentication and databases"""
+    def setUp(self):
+        FakeBlobDAO.blobs = {}
+
+    def test_upload_then_stream(self):
+        """uploaded body is streamed back with its length"""
+        with main.app.test_request_context('/algorithms/a1/blob', method='PUT', data=b'\x00blob data'):
+            self.assertEqual(200, main.upload_blob(FakeBlobDAO, 'a1').status_code)
+        with main.app.test_request_context('/algorithms/a1/blob'):
+            resp = main.stream_blob(FakeBlobDAO, 'a1')
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(b'\x00blob data', resp.get_data())
+        self.assertEqual(str(len(b'\x00blob data')), resp.headers['Content-Length'])
+
+    def test_upload_NotFound(self):
+        """BLOB of an item which doesn't exist isn't written"""
+        with main.app.test_request_context('/algorithms/a2/blob', method='PUT', data=b'blob'):
+            self.assertEqual(404, main.upload_blob(FakeBlobDAO, 'a2').status_code)
+        self.assertEqual({}, FakeBlobDAO.blobs)
+
+    def test_stream_Gzip(self):
+        """gzip BLOB is sent as it's stored to clients accepting gzip and decompressed for others"""
+        compressed = gzip.compress(b'blob data')
+
+        class GzipBlobDAO:
+            @staticmethod
+            def openblob(item_id):
+                return main.BlobReader(len(compressed), iter([compressed]), 'gzip')
+        with main.app.test_request_context('/algorithms/a1/blob', headers={'Accept-Encoding': 'gzip'}):
+            resp = main.stream_blob(GzipBlobDAO, 'a1')
+            self.assertEqual(compressed, resp.get_data())
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        with main.app.test_request_context('/algorithms/a1/blob'):
+            resp = main.stream_blob(GzipBlobDAO, 'a1')
+            self.assertEqual(b'blob data', resp.get_data())
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_stream_NotFound(self):
+        """item without BLOB gets 404"""
+        with main.app.test_request_context('/algorithms/a1/blob'):
+            self.assertEqual(404, main.stream_blob(FakeBlobDAO, 'a1').status_code)
+
+
+class MainSwaggerTestCase(unittest.TestCase):
+    """Tests of swagger.json served from memory"""
+    def setUp(self):
+        self.client = main.app.test_client()
+
+    def test_swagger_Host(self):
+        resp = self.client.get('/swagger.json')
+        self.assertEqual(200, resp.status_code)
+        data = json.loads(resp.get_data())
+        self.assertEqual('localhost:5000', data['host'])
+        self.assertEqual(['http'], data['schemes'])
+        self.assertEqual('*', resp.headers['Access-Control-Allow-Origin'])
+
+    def test_swagger_Gzip(self):
+        """clients accepting gzip get the precompressed variant with its own ETag"""
+        plain = self.client.get('/swagger.json')
+        compressed = self.client.get('/swagger.json', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', compressed.headers['Content-Encoding'])
+        self.assertEqual(plain.get_data(), gzip.decompress(compressed.get_data()))
+        self.assertNotEqual(plain.headers['ETag'], compressed.headers['ETag'])
+        self.assertEqual('Accept-Encoding', compressed.headers['Vary'])
+
+    def test_swagger_NotModified(self):
+        etag = self.client.get('/swagger.json').headers['ETag']
+        resp = self.client.get('/swagger.json', headers={'If-None-Match': etag})
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(b'', resp.get_data())
+
+
+class MainStatsTestCase(unittest.TestCase):
+    """Tests of /stats/ without databases"""
+    claims = {'sub': 'u1', 'email': 'admin@example.com'}
+
+    def setUp(self):
+        self.client = main.app.test_client()
+        self.patch = mock.patch('authentication.verify_id_token_claims', return_value=self.claims)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def get(self):
+        return self.client.get('/stats/', headers={'Authorization': 'Bearer token'})
+
+    def test_stats_Unauthenticated(self):
+        self.assertEqual(401, self.client.get('/stats/').status_code)
+
+    def test_stats_Users(self):
+        """only users of STATS_USERS get counters when it's set"""
+        self.assertEqual(200, self.get().status_code)
+        with mock.patch.object(main, '_STATS_USERS', frozenset(['admin@example.com'])):
+            self.assertEqual(200, self.get().status_code)
+        with mock.patch.object(main, '_STATS_USERS', frozenset(['u2'])):
+            self.assertEqual(403, self.get().status_code)
+
+    def test_stats_FailedSection(self):
+        """a failing backend doesn't hide the other sections"""
+        with mock.patch.object(main.index_queue, 'stats', side_effect=sqlite3.OperationalError('locked')):
+            resp = self.get()
+        self.assertEqual(200, resp.status_code)
+        data = json.loads(resp.get_data())
+        self.assertIsNone(data['index_queue'])
+        self.assertIn('reuses', data['datastore'])
+
+
+class MainStaticAssetsTestCase(unittest.TestCase):
+    """Tests of Swagger UI assets served from memory"""
+    def setUp(self):
+        self.client = main.app.test_client()
+
+    def test_swaggerui_Versioned(self):
+        """assets linked from index.html with their versions are immutable"""
+        index = self.client.get('/swaggerui/index.html')
+        self.assertEqual('no-cache', index.headers['Cache-Control'])
+        version = main.swaggerui_assets.get('swagger-ui-bundle.js').version
+        self.assertIn('./swagger-ui-bundle.js?v=' + version, index.get_data(as_text=True))
+        resp = self.client.get('/swaggerui/swagger-ui-bundle.js?v=' + version, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('public, max-age=31536000, immutable', resp.headers['Cache-Control'])
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        with open(os.path.join(main.app.root_path, 'static', 'swaggerui', 'swagger-ui-bundle.js'), 'rb') as bundle:
+            self.assertEqual(bundle.read(), gzip.decompress(resp.get_data()))
+
+    def test_swaggerui_NotModified(self):
+        etag = self.client.get('/swaggerui/swagger-ui.css').headers['ETag']
+        resp = self.client.get('/swaggerui/swagger-ui.css', headers={'If-None-Match': etag})
+        self.assertEqual(304, resp.status_code)
+
+    def test_swaggerui_NotFound(self):
+        self.assertEqual(404, self.client.get('/swaggerui/nothing.js').status_code)
+        self.assertEqual(200, self.client.get('/favicon.ico').status_code)
+
 
 if __name__ == '__main__':
     unittest.main()
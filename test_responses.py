@@ -0,0 +1,41 @@
+import json
+import unittest
+from datetime import datetime
+from flask import Flask
+import responses
+
+
+class ResponsesTestCase(unittest.TestCase):
+    def test_status_body_SameAsFlask(self):
+        """status bodies are the same as flask.json.dumps used to make and they are encoded once"""
+        app = Flask(__name__)
+        with app.app_context():
+            expected = app.json.dumps({"code": 404, "fields": "string", "message": "Not Found"})
+        self.assertEqual(expected.encode('utf-8'), responses.status_body(404))
+        self.assertIs(responses.status_body(404), responses.status_body(404))
+        self.assertEqual([{"code": 400, "fields": "ids", "message": "Malformed Data"}],
+                         json.loads(responses.status_body(400, 'ids', in_list=True)))
+
+    def test_status_response(self):
+        resp = responses.status_response(400, 'fields')
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual('application/json; charset=utf-8', resp.headers['Content-Type'])
+        self.assertEqual({"code": 400, "fields": "fields", "message": "Malformed Data"}, resp.get_json())
+
+    def test_encoders_SameValues(self):
+        """every encoder returns the same data, dates as HTTP dates, with sorted keys"""
+        data = {'b': [1, 2.5, None, True], 'a': 'ąę', 'date': datetime(2017, 1, 2, 3, 4, 5), 'big': 2 ** 70}
+        expected = responses.encode_json(data)
+        for name in ['json', 'orjson']:
+            encoded = responses.get_encoder(name)(data)
+            self.assertEqual(json.loads(expected), json.loads(encoded), msg=name)
+            self.assertEqual(['a', 'b', 'big', 'date'], list(json.loads(encoded)), msg=name)
+        self.assertEqual('Mon, 02 Jan 2017 03:04:05 GMT', json.loads(expected)['date'])
+
+    def test_get_encoder_Unknown(self):
+        with self.assertRaises(ValueError):
+            responses.get_encoder('yaml')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from google.api_core import exceptions as api_exceptions
+from google.cloud import datastore
+import connections
+import storage
+
+
+class FakeTransaction:
+    """Commits at the end of the with block, it conflicts while the client has `conflicts` left"""
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        self.client.transactions += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.client.conflicts > 0:
+            self.client.conflicts -= 1
+            raise api_exceptions.Conflict('too much contention')
+        return False
+
+
+class FakeDatastoreClient:
+    """Keeps entities in a dictionary by key, every call fails with a transport error when `down` is set"""
+    def __init__(self):
+        self.entities = {}
+        self.down = False
+        self.transactions = 0
+        self.conflicts = 0
+
+    def check(self):
+        if self.down:
+            raise ConnectionError('down')
+
+    def key(self, *path):
+        return datastore.Key(*path, project='test')
+
+    def get(self, key):
+        self.check()
+        entity = self.entities.get(key)
+        if entity is None:
+            return None
+        copied = datastore.Entity(key=key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+        copied.update(entity)
+        return copied
+
+    def get_multi(self, keys):
+        return [entity for entity in (self.get(key) for key in keys) if entity is not None]
+
+    def put(self, entity):
+        self.check()
+        self.entities[entity.key] = entity
+
+    def put_multi(self, entities):
+        for entity in entities:
+            self.put(entity)
+
+    def delete_multi(self, keys):
+        self.check()
+        for key in keys:
+            self.entities.pop(key, None)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+
+class StorageTestMixin:
+    """Behaviour every backend shares, self.storage is set up by the test case"""
+    properties = {'algorithmDescription': b'\x1f\x8b compressed', 'datasetDescription': 'text', 'codec': 'gzip',
+                  'count': 3, 'ratio': 0.5, 'public': True, 'missing': None, 'timestamp': datetime(2017, 1, 2, 3, 4, 5)}
+
+    def test_put_then_get(self):
+        """properties are read back with their types"""
+        self.storage.put('algorithms', 'a1', self.properties, unindexed=('algorithmDescription',))
+        self.assertEqual(self.properties, dict(self.storage.get('algorithms', 'a1')))
+        self.assertIsNone(self.storage.get('algorithms', 'a2'))
+        self.assertIsNone(self.storage.get('datasets', 'a1'), msg='Kinds are separate')
+
+    def test_get_Copy(self):
+        """changes of returned properties aren't stored"""
+        self.storage.put('algorithms', 'a1', {'codec': 'gzip'})
+        self.storage.get('algorithms', 'a1').pop('codec')
+        self.assertEqual({'codec': 'gzip'}, dict(self.storage.get('algorithms', 'a1')))
+
+    def test_put_multi_get_multi(self):
+        items = [('a' + str(number), {'number': number}) for number in range(5)]
+        self.storage.put_multi('algorithms', items)
+        found = self.storage.get_multi('algorithms', ['a4', 'a0', 'missing'])
+        self.assertEqual({'a4': {'number': 4}, 'a0': {'number': 0}}, {name: dict(p) for name, p in found.items()})
+
+    def test_update(self):
+        """only changed properties are replaced"""
+        self.storage.put('algorithms', 'a1', {'codec': 'gzip', 'timestamp': datetime(2017, 1, 1)})
+        self.assertTrue(self.storage.update('algorithms', 'a1', {'timestamp': datetime(2018, 1, 1)}))
+        self.assertEqual({'codec': 'gzip', 'timestamp': datetime(2018, 1, 1)}, dict(self.storage.get('algorithms', 'a1')))
+        self.assertFalse(self.storage.update('algorithms', 'a2', {'timestamp': datetime(2018, 1, 1)}))
+        self.assertIsNone(self.storage.get('algorithms', 'a2'))
+
+    def test_delete(self):
+        self.storage.put_multi('algorithms', [('a1', {'n': 1}), ('a2', {'n': 2}), ('a3', {'n': 3})])
+        self.storage.delete('algorithms', 'a1')
+        self.storage.delete_multi('algorithms', ['a2', 'missing'])
+        self.assertEqual(['a3'], list(self.storage.get_multi('algorithms', ['a1', 'a2', 'a3'])))
+
+    def test_stats(self):
+        self.storage.put_multi('algorithms', [('a1', {'n': 1}), ('a2', {'n': 2})])
+        self.storage.get('algorithms', 'a1')
+        stats = self.storage.stats()
+        self.assertEqual(2, stats['writes'])
+        self.assertEqual(1, stats['reads'])
+
+
+class DatastoreStorageTestCase(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatastoreClient()
+        self.clients = connections.DatastoreClientManager(factory=lambda: self.client, health_check_interval=0)
+        self.storage = storage.DatastoreStorage(self.clients)
+
+    def test_put_Unindexed(self):
+        self.storage.put('algorithms', 'a1', self.properties, unindexed=('algorithmDescription',))
+        entity = self.client.entities[self.client.key('algorithms', 'a1')]
+        self.assertEqual({'algorithmDescription'}, set(entity.exclude_from_indexes))
+
+    def test_get_TransportError(self):
+        """errors are raised as StorageError and a broken client is dropped"""
+        self.storage.get('algorithms', 'a1')
+        self.client.down = True
+        with self.assertRaises(storage.StorageError):
+            self.storage.get('algorithms', 'a1')
+        self.assertEqual(1, self.clients.stats()['failures'])
+        self.assertEqual(1, self.storage.stats()['errors'])
+
+    def test_update_Transaction(self):
+        """updates run in transactions, one conflicting with another is attempted again"""
+        self.storage.put('algorithms', 'a1', {'codec': 'gzip'})
+        self.client.conflicts = 1
+        self.assertTrue(self.storage.update('algorithms', 'a1', {'codec': 'identity'}))
+        self.assertEqual(2, self.client.transactions)
+        self.assertEqual({'codec': 'identity'}, dict(self.storage.get('algorithms', 'a1')))
+        self.client.conflicts = 100
+        with self.assertRaises(storage.StorageError):
+            self.storage.update('algorithms', 'a1', {'codec': 'gzip'})
+
+
+class MemoryStorageTestCase(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.storage = storage.MemoryStorage()
+
+
+class SQLiteStorageTestCase(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'storage.sqlite3')
+        self.storage = storage.SQLiteStorage(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_shared_by_instances(self):
+        """another instance, e.g. of another worker process, sees the same entities"""
+        self.storage.put('algorithms', 'a1', self.properties)
+        self.assertEqual(self.properties, storage.SQLiteStorage(self.path).get('algorithms', 'a1'))
+
+    def test_put_multi_Threads(self):
+        """concurrent writers of their own connections don't lose entities"""
+        def write(thread):
+            self.storage.put_multi('algorithms', [(str(thread) + '-' + str(number), {'n': number})
+                                                  for number in range(50)])
+        threads = [threading.Thread(target=write, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        names = [str(thread) + '-' + str(number) for thread in range(4) for number in range(50)]
+        self.assertEqual(200, len(self.storage.get_multi('algorithms', names)))
+
+    def test_put_WrongType(self):
+        """values which can't be stored are rejected before anything is written"""
+        with self.assertRaises(TypeError):
+            self.storage.put('algorithms', 'a1', {'value': object()})
+        self.assertIsNone(self.storage.get('algorithms', 'a1'))
+
+
+class GetStorageTestCase(unittest.TestCase):
+    def test_get_storage(self):
+        self.assertIsInstance(storage.get_storage(''), storage.DatastoreStorage)
+        self.assertIsInstance(storage.get_storage('memory://'), storage.MemoryStorage)
+        root = tempfile.mkdtemp()
+        try:
+            self.assertIsInstance(storage.get_storage('sqlite://' + os.path.join(root, 'db.sqlite3')),
+                                  storage.SQLiteStorage)
+        finally:
+            shutil.rmtree(root)
+        with self.assertRaises(ValueError):
+            storage.get_storage('mysql://localhost/17z')
+
+
+if __name__ == '__main__':
+    unittest.main()